@@ -0,0 +1,367 @@
+"""
+Concurrent unsubscribe executor built on playwright.async_api and httpx.
+
+Links are processed in parallel under a global concurrency limit and a
+per-domain limit, each within a deadline. Results use the same per-sender
+shape as `unsub_process.process_unsubscribe_links` and are yielded as soon as
+each link finishes.
+"""
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse, parse_qs
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator, Callable
+
+import httpx
+from playwright.async_api import async_playwright
+
+from config import config as app_config
+from browser_pool import DEFAULT_USER_AGENT
+from http_pool import create_async_client, create_async_transport
+from domain_routes import DomainRoutes, get_domain_routes
+from request_blocking import get_request_filter, log_blocked
+from unsub_process import (
+    HEADERS, ONE_CLICK_BODY, SUCCESS_PATTERNS, SCAN_PAGE_JS, PAGE_SUCCESS_JS, MAX_CLICK_CANDIDATES, POST_CLICK_TIMEOUT,
+    scan_page_args, candidate_selector, is_unsubscribe_confirmed, find_unsubscribe_forms
+)
+
+class AsyncOneClickStrategy:
+    """Async RFC 8058 one-click POST; only tried for senders that advertise it."""
+
+    name = 'one_click'
+
+    def __init__(self, executor: "AsyncUnsubscribeExecutor"):
+        self.executor = executor
+
+    async def unsubscribe(self, link: str, http: httpx.AsyncClient, attempt: Optional[Dict[str, Any]] = None) -> Tuple[bool, str]:
+        if not link.startswith(('http://', 'https://')):
+            return False, f"Invalid URL: {link}"
+        try:
+            response = await http.post(
+                link,
+                data=ONE_CLICK_BODY,
+                headers={'Content-Type': 'application/x-www-form-urlencoded'},
+                # Timeouts are the client's HTTP_CONNECT_TIMEOUT / HTTP_READ_TIMEOUT
+                follow_redirects=False
+            )
+            if response.is_success:
+                return True, "Successfully unsubscribed (One-click)"
+            return False, f"One-click request failed with status code: {response.status_code}"
+        except httpx.HTTPError as e:
+            return False, f"One-click request error: {str(e)}"
+
+def _parse_unsubscribe_page(html_content: str, url: str) -> Tuple[bool, List[Tuple[str, str, Dict[str, str]]]]:
+    """Return (confirmed, forms): whether the page confirms the unsubscribe, else its unsubscribe forms."""
+    if is_unsubscribe_confirmed(html_content):
+        return True, []
+    return False, find_unsubscribe_forms(html_content, url)
+
+class AsyncRequestsStrategy:
+    """Async port of RequestsUnsubscribeStrategy (GET, then form submit)."""
+
+    name = 'requests'
+
+    def __init__(self, executor: "AsyncUnsubscribeExecutor"):
+        self.executor = executor
+
+    async def unsubscribe(self, link: str, http: httpx.AsyncClient, attempt: Optional[Dict[str, Any]] = None) -> Tuple[bool, str]:
+        if not link.startswith(('http://', 'https://')):
+            return False, f"Invalid URL: {link}"
+        try:
+            if 'sendgrid.net' in link or 'sendgrid.com' in link:
+                parsed = urlparse(link)
+                form_data = {key: value[0] for key, value in parse_qs(parsed.query).items() if value}
+                form_data.update({'unsub_confirm': '1', 'submit': 'Unsubscribe'})
+                response = await http.post(
+                    f"{parsed.scheme}://{parsed.netloc}{parsed.path}",
+                    data=form_data,
+                    headers={'Origin': f"{parsed.scheme}://{parsed.netloc}", 'Referer': link}
+                )
+                if response.status_code == 200 and any(term in response.text.lower() for term in ['unsubscribed', 'success']):
+                    return True, "Successfully unsubscribed from SendGrid"
+                return False, "SendGrid unsubscription failed"
+
+            response = await http.get(link)
+            final_url = str(response.url)
+            redirect_info = f" (redirected from {link})" if final_url != link else ""
+            if response.status_code != 200:
+                return False, f"Request failed with status code: {response.status_code}{redirect_info}"
+            # BeautifulSoup parsing is CPU-bound; do it all in one worker thread hop
+            confirmed, forms = await asyncio.to_thread(_parse_unsubscribe_page, response.text, final_url)
+            if confirmed:
+                return True, f"Successfully unsubscribed{redirect_info}"
+
+            for method, submit_url, form_data in forms:
+                try:
+                    if method == 'post':
+                        r = await http.post(submit_url, data=form_data, headers={'Referer': final_url})
+                    else:
+                        r = await http.get(submit_url, params=form_data)
+                    if r.is_success:
+                        return True, f"Form submitted successfully{redirect_info}"
+                except httpx.HTTPError:
+                    continue
+            return False, f"Unsubscription confirmation not detected{redirect_info}\nYou may need to unsubscribe manually: {final_url}"
+        except httpx.HTTPError as e:
+            return False, f"Request error: {str(e)}"
+
+class AsyncPlaywrightStrategy:
+    """Async port of PlaywrightUnsubscribeStrategy; each link gets a fresh context on the executor's browser."""
+
+    name = 'playwright'
+
+    def __init__(self, executor: "AsyncUnsubscribeExecutor"):
+        self.executor = executor
+        self.request_filter = get_request_filter()
+
+    async def unsubscribe(self, link: str, http: httpx.AsyncClient, attempt: Optional[Dict[str, Any]] = None) -> Tuple[bool, str]:
+        # The browser context has its own cookies; `http` is not used
+        try:
+            browser = await self.executor.browser()
+            context = await browser.new_context(user_agent=DEFAULT_USER_AGENT)
+            try:
+                return await self._unsubscribe_in_context(context, link, attempt)
+            finally:
+                await context.close()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            return False, f"Playwright error: {str(e)}"
+
+    async def _unsubscribe_in_context(self, context, link: str, attempt: Optional[Dict[str, Any]] = None) -> Tuple[bool, str]:
+        page = await context.new_page()
+        blocked = await self.request_filter.install_async(page) if self.request_filter else None
+        try:
+            return await self._unsubscribe_on_page(page, link)
+        finally:
+            if blocked is not None:
+                log_blocked(link, blocked)
+                if attempt is not None:
+                    attempt['blocked'] = dict(blocked)
+
+    async def _unsubscribe_on_page(self, page, link: str) -> Tuple[bool, str]:
+        try:
+            await page.goto(link, timeout=30000, wait_until='domcontentloaded')
+        except Exception as nav_err:
+            return False, f"Navigation failed: {str(nav_err)}"
+        final_url = page.url
+
+        try:
+            scan = await page.evaluate(SCAN_PAGE_JS, scan_page_args())
+        except Exception as e:
+            return False, f"Could not inspect page: {str(e)}. URL: {final_url}"
+        if scan['success']:
+            return True, "Successfully unsubscribed (Direct load)"
+
+        for candidate in scan['candidates'][:MAX_CLICK_CANDIDATES]:
+            try:
+                await page.locator(candidate_selector(candidate)).click(timeout=5000)
+            except Exception:
+                continue
+            if await self._await_confirmation(page):
+                return True, "Successfully unsubscribed (After interaction)"
+            # Some sites don't show a clear success message
+            return True, "Clicked unsubscribe button (Confirmation ambiguous)"
+
+        return False, f"Could not verify unsubscription. URL: {final_url}"
+
+    @staticmethod
+    async def _await_confirmation(page) -> bool:
+        """Async counterpart of PlaywrightUnsubscribeStrategy._await_confirmation."""
+        try:
+            await page.wait_for_function(PAGE_SUCCESS_JS, arg=SUCCESS_PATTERNS, timeout=POST_CLICK_TIMEOUT)
+            return True
+        except Exception:
+            pass
+        try:
+            await page.wait_for_load_state('domcontentloaded', timeout=5000)
+            return bool(await page.evaluate(PAGE_SUCCESS_JS, SUCCESS_PATTERNS))
+        except Exception:
+            return False
+
+class AsyncUnsubscribeExecutor:
+    """
+    Runs unsubscribe jobs concurrently.
+
+    Args:
+        max_concurrency: Links processed at once
+        per_domain: Links processed at once against the same host
+        deadline: Seconds allowed per link before it is reported as timed out
+        strategies: Strategy classes tried in order until one succeeds; defaults to
+            one-click POST, then HTTP with form submit, then a headless browser.
+            Their `unsubscribe(link, http)` gets the job's own HTTP client
+        routes: Per-domain routing table that reorders the strategies and records
+            their outcomes; defaults to the shared table (None when disabled)
+    """
+
+    def __init__(self, max_concurrency: Optional[int] = None, per_domain: Optional[int] = None, deadline: Optional[float] = None, strategies: Optional[List[type]] = None, routes: Optional[DomainRoutes] = None):
+        self.max_concurrency = max_concurrency or app_config['UNSUBSCRIBE_MAX_CONCURRENCY']
+        self.per_domain = per_domain or app_config['UNSUBSCRIBE_PER_DOMAIN']
+        self.deadline = deadline or app_config['UNSUBSCRIBE_DEADLINE']
+        self.strategies = [strategy(self) for strategy in (strategies or [AsyncOneClickStrategy, AsyncRequestsStrategy, AsyncPlaywrightStrategy])]
+        self.routes = routes or get_domain_routes()
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        # domain -> (semaphore, jobs holding or awaiting it)
+        self._domains: Dict[str, Tuple[asyncio.Semaphore, int]] = {}
+        self._browser_lock = asyncio.Lock()
+        self._playwright = None
+        self._browser = None
+        self._transport: Optional[httpx.AsyncHTTPTransport] = None
+
+    def job_client(self) -> httpx.AsyncClient:
+        """
+        HTTP client for one job: pooled connections shared by every job, cookies
+        private to this one so sessions set by ESP pages never leak between users.
+        Do not close it (that would close the shared transport).
+        """
+        if self._transport is None:
+            self._transport = create_async_transport()
+        return create_async_client(headers=HEADERS, transport=self._transport)
+
+    async def browser(self):
+        """Return the shared browser, launching (or relaunching after a crash) on demand."""
+        async with self._browser_lock:
+            if self._browser is None or not self._browser.is_connected():
+                if self._playwright is None:
+                    self._playwright = await async_playwright().start()
+                self._browser = await self._playwright.chromium.launch(headless=True)
+            return self._browser
+
+    async def close(self) -> None:
+        if self._browser is not None:
+            try:
+                await self._browser.close()
+            except Exception as e:
+                logging.error(f"Failed to close browser: {e}")
+            self._browser = None
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+        if self._transport is not None:
+            await self._transport.aclose()
+            self._transport = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    @asynccontextmanager
+    async def _domain_slot(self, link: str):
+        """Hold one of the link's domain slots; the domain's semaphore is dropped once no job holds or awaits it."""
+        domain = (urlparse(link).hostname or '').lower()
+        if domain not in self._domains:
+            self._domains[domain] = (asyncio.Semaphore(self.per_domain), 0)
+        semaphore, users = self._domains[domain]
+        self._domains[domain] = (semaphore, users + 1)
+        try:
+            async with semaphore:
+                yield
+        finally:
+            semaphore, users = self._domains[domain]
+            if users == 1:
+                del self._domains[domain]
+            else:
+                self._domains[domain] = (semaphore, users - 1)
+
+    async def _run_strategies(self, link: str, one_click: bool, attempts: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Cascade through the tiers, cheapest first; same result fields as unsub_process.run_cascade."""
+        success, msg, tier = False, "No strategy attempted", None
+        strategies = self.strategies
+        http = self.job_client()
+        if self.routes is not None:
+            strategies = await asyncio.to_thread(self.routes.order, link, strategies)
+        for strategy in strategies:
+            if strategy.name == 'one_click' and not one_click:
+                continue
+            tier_started = time.monotonic()
+            attempt = {'tier': strategy.name}
+            try:
+                success, msg = await strategy.unsubscribe(link, http, attempt)
+            finally:
+                attempt.update(success=success, elapsed=round(time.monotonic() - tier_started, 3))
+                attempts.append(attempt)
+            if success:
+                tier = strategy.name
+                break
+        return {'status': 'success' if success else 'failed', 'message': msg, 'link': link, 'tier': tier}
+
+    async def unsubscribe(self, link: str, sender: str, dry_run: bool = False, one_click: bool = False) -> Tuple[str, Dict[str, Any]]:
+        """Process one link within the concurrency limits and deadline; returns (sender, result)."""
+        if dry_run:
+            return sender, {'status': 'dry_run', 'message': f'Would unsub from {link}'}
+
+        started = time.monotonic()
+        attempts = []
+        try:
+            async with self._semaphore, self._domain_slot(link):
+                result = await asyncio.wait_for(self._run_strategies(link, one_click, attempts), self.deadline)
+        except asyncio.TimeoutError:
+            result = {'status': 'failed', 'message': f"Timed out after {self.deadline}s", 'link': link, 'tier': None}
+        except Exception as e:
+            result = {'status': 'error', 'message': str(e)}
+        result['elapsed'] = round(time.monotonic() - started, 3)
+        result['attempts'] = attempts
+        if self.routes is not None and attempts:
+            await asyncio.to_thread(self.routes.record_attempts, link, attempts)
+        return sender, result
+
+    async def iter_results(self, unsub_links: List[str], selected_senders: List[str], dry_run: bool = False, one_click: Optional[List[bool]] = None) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """Yield (sender, result) pairs in completion order."""
+        one_click = one_click or [False] * len(unsub_links)
+        tasks = [
+            asyncio.create_task(self.unsubscribe(link, sender, dry_run, link_one_click))
+            for link, sender, link_one_click in zip(unsub_links, selected_senders, one_click)
+        ]
+        try:
+            for done in asyncio.as_completed(tasks):
+                yield await done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+async def process_unsubscribe_links_async(unsub_links: List[str], selected_senders: List[str], dry_run: bool = True, executor: Optional[AsyncUnsubscribeExecutor] = None, on_result: Optional[Callable[[str, Dict[str, Any]], None]] = None, one_click: Optional[List[bool]] = None) -> Dict[str, Any]:
+    """
+    Concurrent counterpart of `process_unsubscribe_links`.
+
+    Args:
+        unsub_links: Unsubscribe links, one per sender
+        selected_senders: Senders matching `unsub_links`
+        dry_run: Report what would be done without visiting the links
+        one_click: Per-link flags of senders advertising RFC 8058 one-click unsubscribe
+        executor: Executor to run on; a temporary one is created (and closed) when omitted
+        on_result: Called with (sender, result) as each link finishes
+
+    Returns:
+        {'results': {sender: {'status', 'message', 'link', 'tier', 'elapsed', 'attempts'}}}
+    """
+    owned = executor is None
+    executor = executor or AsyncUnsubscribeExecutor()
+    results = {}
+    try:
+        async for sender, result in executor.iter_results(unsub_links, selected_senders, dry_run, one_click):
+            results[sender] = result
+            if on_result:
+                on_result(sender, result)
+    finally:
+        if owned:
+            await executor.close()
+    return {'results': results}
+
+_executor: Optional[AsyncUnsubscribeExecutor] = None
+
+def get_unsubscribe_executor() -> AsyncUnsubscribeExecutor:
+    """Return the executor shared by API requests (bound to the server's event loop)."""
+    global _executor
+    if _executor is None:
+        _executor = AsyncUnsubscribeExecutor()
+    return _executor
+
+async def close_unsubscribe_executor() -> None:
+    """Close the shared executor (called on application shutdown)."""
+    global _executor
+    if _executor is not None:
+        await _executor.close()
+        _executor = None
@@ -8,6 +8,7 @@ import json
 import logging
 import urllib.parse
 from db import save_user, update_user_onboarding, get_user
+from user_clients import user_clients
 
 # Allow OAuth scope to change (e.g. if user previously granted more access)
 os.environ['OAUTHLIB_RELAX_TOKEN_SCOPE'] = '1'
@@ -125,7 +126,7 @@ def auth_callback(request: Request, code: str):
         creds = flow.credentials
         
         # Verify and get user info
-        service = build('oauth2', 'v2', credentials=creds)
+        service = build('oauth2', 'v2', credentials=creds, static_discovery=True)
         user_info = service.userinfo().get().execute()
         
         email = user_info.get('email')
@@ -139,6 +140,8 @@ def auth_callback(request: Request, code: str):
         saved = save_user(user_info, creds_json)
         if not saved:
             print("WARNING: Failed to save user to DB")
+        # Drop any cached Gmail client holding the previous tokens
+        user_clients.invalidate(email)
         
         # Get latest user data from DB to include hasOnboarded status
         db_user = get_user(email)
@@ -197,5 +200,8 @@ def mark_user_onboarded(request: Request):
 
 @router.get("/logout")
 def logout(request: Request):
+    user = request.session.get('user')
+    if user and user.get('email'):
+        user_clients.invalidate(user['email'])
     request.session.clear()
     return {"message": "Logged out"}
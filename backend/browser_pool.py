@@ -0,0 +1,155 @@
+"""
+Long-lived headless Chromium pool for the Playwright unsubscribe strategy.
+
+Playwright's sync API is bound to the thread that started it, so each pool
+slot is a worker thread owning one Playwright driver and one browser. Jobs get
+a fresh BrowserContext (isolated cookies and storage) and run on a worker;
+browsers are relaunched after `max_uses` jobs or when they crash.
+"""
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, Any, Optional, TypeVar
+
+from playwright.sync_api import sync_playwright
+
+from config import config as app_config
+
+T = TypeVar('T')
+
+DEFAULT_USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+
+class BrowserPool:
+    """Fixed number of browser workers that run jobs in fresh contexts."""
+
+    def __init__(self, size: int = 2, max_uses: int = 50, launch_options: Optional[Dict[str, Any]] = None, context_options: Optional[Dict[str, Any]] = None):
+        self.size = size
+        self.max_uses = max_uses
+        self.launch_options = launch_options or {'headless': True}
+        self.context_options = context_options or {'user_agent': DEFAULT_USER_AGENT}
+        self.counters = {'jobs': 0, 'launched': 0, 'recycled': 0, 'crashed': 0}
+        self._jobs: "queue.Queue" = queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] += 1
+
+    def _start_workers(self) -> None:
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Browser pool is shut down")
+            self._workers = [worker for worker in self._workers if worker.is_alive()]
+            while len(self._workers) < self.size:
+                worker = threading.Thread(target=self._worker, name=f"browser-{len(self._workers)}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def _worker(self) -> None:
+        playwright = None
+        browser = None
+        uses = 0
+        try:
+            while True:
+                item = self._jobs.get()
+                if item is None:
+                    break
+                job, future = item
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    if browser is not None and (uses >= self.max_uses or not _connected(browser)):
+                        self._count('recycled' if _connected(browser) else 'crashed')
+                        _close_quietly(browser)
+                        browser = None
+                    if browser is None:
+                        if playwright is None:
+                            playwright = sync_playwright().start()
+                        browser = playwright.chromium.launch(**self.launch_options)
+                        uses = 0
+                        self._count('launched')
+
+                    uses += 1
+                    self._count('jobs')
+                    context = browser.new_context(**self.context_options)
+                    try:
+                        future.set_result(job(context))
+                    finally:
+                        _close_quietly(context)
+                except Exception as e:
+                    if browser is not None and not _connected(browser):
+                        logging.warning(f"Browser crashed, relaunching: {e}")
+                        self._count('crashed')
+                        _close_quietly(browser)
+                        browser = None
+                    if not future.done():
+                        future.set_exception(e)
+        finally:
+            if browser is not None:
+                _close_quietly(browser)
+            if playwright is not None:
+                try:
+                    playwright.stop()
+                except Exception as e:
+                    logging.error(f"Failed to stop Playwright: {e}")
+
+    def run(self, job: Callable[[Any], T], timeout: Optional[float] = None) -> T:
+        """
+        Run `job(context)` in a fresh BrowserContext on a pooled browser and return its result.
+
+        Raises:
+            Whatever the job raised, or concurrent.futures.TimeoutError after `timeout` seconds
+        """
+        self._start_workers()
+        future: Future = Future()
+        self._jobs.put((job, future))
+        return future.result(timeout=timeout)
+
+    def shutdown(self, timeout: float = 10) -> None:
+        """Close every browser and stop the workers; queued jobs still run first."""
+        with self._lock:
+            self._closed = True
+            workers = list(self._workers)
+            self._workers = []
+        for _ in workers:
+            self._jobs.put(None)
+        for worker in workers:
+            worker.join(timeout=timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.counters, 'size': self.size, 'workers': len(self._workers), 'queued': self._jobs.qsize()}
+
+def _connected(browser) -> bool:
+    try:
+        return browser.is_connected()
+    except Exception:
+        return False
+
+def _close_quietly(resource) -> None:
+    try:
+        resource.close()
+    except Exception:
+        pass
+
+_pool: Optional[BrowserPool] = None
+_pool_lock = threading.Lock()
+
+def get_browser_pool() -> BrowserPool:
+    """Return the process-wide browser pool, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = BrowserPool(size=app_config['BROWSER_POOL_SIZE'], max_uses=app_config['BROWSER_MAX_USES'])
+        return _pool
+
+def shutdown_browser_pool() -> None:
+    """Close the process-wide pool (FastAPI lifespan and CLI exit)."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown()
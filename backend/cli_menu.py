@@ -1,13 +1,21 @@
 import sys
+import atexit
+import asyncio
 import logging
 import webbrowser
 from typing import Callable, List, Dict, Any, Tuple, Optional
 from unsub_process import process_unsubscribe_links
-from email_fetcher import delete_emails_from_sender, fetch_promotional_emails, preview_emails_with_sequence
+from async_unsubscribe import process_unsubscribe_links_async
+from browser_pool import shutdown_browser_pool
+from http_pool import close_http_pool
+from email_fetcher import iter_promotional_senders, preview_emails_with_sequence, find_unsubscribe_links, delete_senders_pipelined
+from gmail_async import AsyncGmailClient, close_http_client
+from sender_index import get_sender_index
 from unsubscribe_list import extract_unsubscribe_links
-from setup_gmail_service.py.deprecated import create_service
+from setup_gmail_service.py.deprecated import get_credentials, create_service
 from config import config as app_config
 from db import record_activity
+from gmail_executor import gmail_executor
 
 USER_ID = app_config['USER_ID']
 
@@ -121,19 +129,24 @@ def run_with_loading(message: str, func: Callable, *args, **kwargs) -> bool | No
         logging.error(f"Error in run_with_loading: {error_msg}", exc_info=True)
         return False
 
-def get_senders_to_process(service) -> Dict[int, str]:
+def get_senders_to_process(service, user_email: Optional[str] = None) -> Dict[int, str]:
     """
     Helper function to get senders from promotional emails.
+    Messages are cached under `user_email`, so repeated menu runs reuse them.
     
     Returns:
         Dictionary mapping sequence numbers to sender email addresses
     """
     safe_print(f"\n    {BLUE}Fetching promotional emails...{RESET}")
-    promo_emails = fetch_promotional_emails(
+    promo_emails = []
+    for msg in iter_promotional_senders(
         service, 
         max_senders=app_config['MAX_SENDERS'], 
-        max_emails_to_scan=app_config['MAX_EMAILS_TO_SCAN']
-    )
+        max_emails_to_scan=app_config['MAX_EMAILS_TO_SCAN'],
+        user=user_email
+    ):
+        promo_emails.append(msg)
+        safe_print(f"    {GRAY}Found {len(promo_emails)} sender(s)...{RESET}", end="\r")
     
     if not promo_emails:
         safe_print(f"\n    {YELLOW}No promotional emails found.{RESET}")
@@ -148,14 +161,89 @@ def get_senders_to_process(service) -> Dict[int, str]:
     
     return selected_senders
 
+def print_delete_progress(event: Dict[str, Any]) -> None:
+    """Print a progress event emitted by delete_senders_pipelined."""
+    sender = event['sender']
+    if event['type'] == 'found':
+        safe_print(f"    {GRAY}Found {event['total']} email(s) from {sender}{RESET}")
+    elif event['type'] == 'deleted':
+        safe_print(f"    {GREEN}✓ Deleted {event['total']} email(s) from {sender}{RESET}")
+    elif event['type'] == 'error':
+        safe_print(f"    {RED}✗ {event['error']}{RESET}")
+    elif event['type'] == 'done':
+        safe_print(f"    {event['result']['message']}")
+
+def print_unsubscribe_result(sender: str, result: Dict[str, Any]) -> None:
+    """Print one unsubscribe result as soon as it completes."""
+    status = result.get('status')
+    message = result.get('message', '')
+    if status == 'success':
+        safe_print(f"    {GREEN}✓ {sender}: {message} [{result.get('tier')}, {result.get('elapsed', 0):.1f}s]{RESET}")
+    elif status == 'dry_run':
+        safe_print(f"    {YELLOW}⚠ Dry run: {message}{RESET}")
+    else:
+        safe_print(f"    {YELLOW}⚠ {sender}: {message}{RESET}")
+
+# One event loop for all async work of the menu: the shared Gmail HTTP client
+# of gmail_async is bound to the loop it was first used on
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def run_async(coro):
+    """Run a coroutine to completion on the menu's event loop."""
+    global _loop
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+    return _loop.run_until_complete(coro)
+
+def close_async() -> None:
+    """Close the shared Gmail HTTP client and the menu's event loop."""
+    if _loop is not None and not _loop.is_closed():
+        _loop.run_until_complete(close_http_client())
+        _loop.close()
+
+def delete_senders_with_progress(credentials, senders: List[str], user_email: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Delete emails from all senders at once with the pipelined deletion engine,
+    printing progress as batches complete.
+
+    Args:
+        credentials: OAuth credentials the CLI's Gmail service was built with
+        senders: Sender addresses to delete
+        user_email: Mailbox owner, for quota accounting and the sender index
+
+    Returns:
+        Dictionary mapping each sender to its delete_emails_from_sender-style result
+    """
+    safe_print(f"\n    {BLUE}Deleting emails from {len(senders)} sender(s)...{RESET}")
+
+    client = AsyncGmailClient(credentials, user=user_email)
+    try:
+        return run_async(delete_senders_pipelined(
+            client,
+            senders,
+            dry_run=app_config['DRY_RUN'],
+            on_progress=print_delete_progress,
+            user=user_email,
+            index=get_sender_index() if user_email else None
+        ))
+    except Exception as e:
+        safe_print(f"    {RED}✗ Error during deletion: {str(e)}{RESET}")
+        logging.error(f"Error in delete_senders_with_progress: {str(e)}", exc_info=True)
+        return {}
+
 def cli_main():
     """Main function to run the CLI menu."""
+    # Close pooled browsers and connections however the menu exits
+    atexit.register(shutdown_browser_pool)
+    atexit.register(close_http_pool)
+    atexit.register(close_async)
     clear_screen()
     display_banner()
     
     # Initialize Gmail service
     try:
-        service = create_service()
+        credentials = get_credentials()
+        service = create_service(credentials)
         if not service:
             safe_print(f"{RED}Failed to create Gmail service. Please check your credentials.{RESET}")
             return
@@ -165,7 +253,8 @@ def cli_main():
 
     safe_print(f"\n    {GRAY}Attempting to fetch user profile...{RESET}")
     try:
-        profile = service.users().getProfile(userId=USER_ID).execute()
+        # The mailbox owner is only known once this returns; later calls are charged to it
+        profile = gmail_executor.execute(service.users().getProfile(userId=USER_ID), 'users.getProfile')
         current_user_email = profile.get('emailAddress')
         if current_user_email:
             safe_print(f"\n    {GREEN}Logged in as: {current_user_email}{RESET}")
@@ -187,7 +276,7 @@ def cli_main():
         if choice == "1":  # Only Unsubscribe
             clear_screen()
             safe_print("\n    {BLUE}=== UNSUBSCRIBE ONLY ==={RESET}\n")
-            selected_senders = get_senders_to_process(service)
+            selected_senders = get_senders_to_process(service, current_user_email)
             if selected_senders:
                 # For each sender, we need to fetch emails to get unsubscribe links
                 for sequence, sender in selected_senders.items():
@@ -195,26 +284,23 @@ def cli_main():
                     # Fetch recent emails from this sender to find unsubscribe links
                     query = f"from:{sender} category:promotions"
                     try:
-                        response = service.users().messages().list(
+                        response = gmail_executor.execute(service.users().messages().list(
                             userId=USER_ID,
                             q=query,
                             maxResults=5  # Only check the most recent 5 emails
-                        ).execute()
+                        ), 'messages.list', user=current_user_email)
                         
                         messages = response.get('messages', [])
                         if not messages:
                             safe_print(f"    {YELLOW}No emails found from {sender} to extract unsubscribe links{RESET}")
                             continue
                             
-                        # Get the first email to extract unsubscribe links
-                        msg = service.users().messages().get(
-                            userId=USER_ID,
-                            id=messages[0]['id'],
-                            format='full'
-                        ).execute()
-                        
-                        # Extract unsubscribe links from the email
-                        links = extract_unsubscribe_links(msg)
+                        # List-Unsubscribe headers of the listed emails first, then the newest body
+                        found = find_unsubscribe_links(
+                            service, [m['id'] for m in messages], user=current_user_email,
+                            max_body_fetches=1, extract_links=extract_unsubscribe_links
+                        )
+                        links = found['links']
                         
                         if not links:
                             safe_print(f"    {YELLOW}No unsubscribe links found in emails from {sender}{RESET}")
@@ -234,6 +320,8 @@ def cli_main():
                                     unsub_links=[link],
                                     selected_senders=[sender],
                                     dry_run=app_config['DRY_RUN'],
+                                    # One-click applies to the header's first http(s) URI
+                                    one_click=[found['one_click'] and link == links[0]],
 
                                 )
                                 
@@ -265,49 +353,39 @@ def cli_main():
         elif choice == "2":  # Only Delete
             clear_screen()
             safe_print("\n    {BLUE}=== DELETE EMAILS ONLY ==={RESET}\n")
-            selected_senders = get_senders_to_process(service)
+            selected_senders = get_senders_to_process(service, current_user_email)
             if selected_senders:
-                for sequence, sender in selected_senders.items():
-                    res = run_with_loading(
-                        f"Deleting emails from {sender}", 
-                        lambda s=sender: delete_emails_from_sender(
-                        service, 
-                        s, 
-                        dry_run=app_config['DRY_RUN'],
-   
-                        )
-                    )
-                    if isinstance(res, dict) and current_user_email:
+                results = delete_senders_with_progress(credentials, list(selected_senders.values()), current_user_email)
+                for res in results.values():
+                    if current_user_email:
                         record_activity(current_user_email, deleted_delta=res.get('deleted_count', 0))
              
         elif choice == "3":  # Both Unsubscribe and Delete
             clear_screen()
             safe_print("\n    {BLUE}=== UNSUBSCRIBE AND DELETE ==={RESET}\n")
-            selected_senders = get_senders_to_process(service)
+            selected_senders = get_senders_to_process(service, current_user_email)
             if selected_senders:
                 senders = []
                 all_links = []
+                all_one_click = []
                 
                 # First collect all unsubscribe links for each sender
                 for sequence, sender in selected_senders.items():
                     try:
                         # Get emails from this sender to find unsubscribe links
-                        messages = service.users().messages().list(
+                        messages = gmail_executor.execute(service.users().messages().list(
                             userId='me',
                             q=f'from:{sender}',
                             maxResults=5  # Check up to 5 most recent emails
-                        ).execute().get('messages', [])
+                        ), 'messages.list', user=current_user_email).get('messages', [])
                         
                         if messages:
-                            # Get the most recent message
-                            msg = service.users().messages().get(
-                                userId='me',
-                                id=messages[0]['id'],
-                                format='full'
-                            ).execute()
-                            
-                            # Extract unsubscribe links from the email
-                            links = extract_unsubscribe_links(msg)
+                            # List-Unsubscribe headers of the listed emails first, then the newest body
+                            found = find_unsubscribe_links(
+                                service, [m['id'] for m in messages], user=current_user_email,
+                                max_body_fetches=1, extract_links=extract_unsubscribe_links
+                            )
+                            links = found['links']
                             
                             if links:
                                 # Handle mailto: links specially
@@ -323,6 +401,7 @@ def cli_main():
                                 else:
                                     senders.append(sender)
                                     all_links.append(links[0])
+                                    all_one_click.append(found['one_click'])
                                     safe_print(f"    Found HTTP unsubscribe link for {sender}")
                             else:
                                 safe_print(f"    {YELLOW}No unsubscribe link found for {sender}{RESET}")
@@ -333,7 +412,9 @@ def cli_main():
                 # Process unsubscribe links if we found any
                 if senders and all_links and len(senders) == len(all_links):
                     res = run_with_loading("Processing unsubscribe requests", 
-                                      lambda: process_unsubscribe_links(all_links, senders, dry_run=app_config['DRY_RUN']))
+                                      lambda: run_async(process_unsubscribe_links_async(
+                                          all_links, senders, dry_run=app_config['DRY_RUN'],
+                                          on_result=print_unsubscribe_result, one_click=all_one_click)))
                     if isinstance(res, dict) and 'results' in res and current_user_email:
                         success_count = sum(1 for r in res['results'].values() if r.get('status') == 'success')
                         if success_count:
@@ -341,18 +422,15 @@ def cli_main():
                     
                     # After successful unsubscribe, delete the emails
                     if res:
-                        for sender in senders:
-                            del_res = run_with_loading(f"Deleting emails from {sender}", 
-                                         lambda s=sender: delete_emails_from_sender(service, s, dry_run=app_config['DRY_RUN']))
-                            if isinstance(del_res, dict) and current_user_email:
+                        del_results = delete_senders_with_progress(credentials, senders, current_user_email)
+                        for del_res in del_results.values():
+                            if current_user_email:
                                 record_activity(current_user_email, deleted_delta=int(del_res.get('deleted_count', 0)))
                 else:
                     safe_print(f"\n    {YELLOW}No unsubscribe links found for selected senders.{RESET}")
                     if senders:
                         safe_print(f"    {YELLOW}Deleting emails without unsubscribing...{RESET}")
-                        for sender in senders:
-                            run_with_loading(f"Deleting emails from {sender}", 
-                                         lambda s=sender: delete_emails_from_sender(service, s, dry_run=app_config['DRY_RUN']))
+                        delete_senders_with_progress(credentials, senders, current_user_email)
             
         elif choice == "4":  # Help
             clear_screen()
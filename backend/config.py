@@ -19,6 +19,47 @@ def load_config() -> Dict[str, Any]:
         'MAX_EMAILS_TO_SCAN': 100,
         'DRY_RUN': False,
         'USER_ID': 'me',  # 'me' is a special value for the authenticated user in Gmail API
+        'GMAIL_BATCH_SIZE': 50,  # Requests per Gmail HTTP batch (API max is 100)
+        'SENDER_INDEX_PATH': os.path.join(CONFIG_DIR, 'sender_index.db'),
+        'SENDER_INDEX_MAX_SYNC': 500,  # Messages past the scan window indexed by a full sender index sync
+        'MESSAGE_CACHE_SIZE': 2000,  # Messages kept in the in-memory LRU cache
+        'MESSAGE_CACHE_MAX_MB': 64,  # Approximate memory budget of the in-memory message cache
+        'MESSAGE_CACHE_TTL': 0,  # Seconds before a cached message expires (0 = never)
+        'MESSAGE_CACHE_PATH': '',  # Optional SQLite file for a persistent cache tier
+        'GMAIL_MAX_CONCURRENCY': 10,  # Concurrent Gmail requests per async client
+        'GMAIL_MAX_CONNECTIONS': 20,  # Size of the shared async HTTP connection pool
+        'GMAIL_QUOTA_UNITS_PER_SECOND': 250,  # Gmail per-user quota
+        'GMAIL_MAX_RETRIES': 5,  # Retries for 429 / 5xx Gmail responses
+        'GMAIL_QUERY_MAX_LENGTH': 1500,  # Longest search query packed for multi-sender lookups
+        'DELETE_MAX_CONCURRENCY': 4,  # batchDelete calls in flight during bulk deletion
+        'COUNT_CACHE_TTL': 300,  # Seconds a per-sender message count is reused
+        'CLIENT_CACHE_SIZE': 256,  # Per-user Gmail clients kept by the API
+        'CLIENT_CACHE_TTL': 900,  # Seconds before a cached client re-reads the stored tokens
+        'TOKEN_REFRESH_MARGIN': 300,  # Refresh access tokens this many seconds before expiry
+        'DB_BACKEND': 'auto',  # User store: mongo, sqlite, memory, or auto (mongo when MONGODB_URI is set)
+        'DB_SQLITE_PATH': os.path.join(CONFIG_DIR, 'users.db'),  # User store file of the sqlite backend
+        'USER_CACHE_TTL': 30,  # Seconds a user record read from the store is reused
+        'USER_CACHE_SIZE': 1000,  # User records kept in the read-through cache
+        'BROWSER_POOL_SIZE': 2,  # Headless browsers kept running for Playwright unsubscribes
+        'BROWSER_MAX_USES': 50,  # Unsubscribe jobs per browser before it is relaunched
+        'UNSUBSCRIBE_MAX_CONCURRENCY': 5,  # Unsubscribe links processed at once by the async executor
+        'UNSUBSCRIBE_PER_DOMAIN': 2,  # Concurrent unsubscribe links per host
+        'UNSUBSCRIBE_DEADLINE': 60,  # Seconds allowed per unsubscribe link
+        'HTTP_POOL_PER_HOST': 4,  # Keep-alive connections per host for unsubscribe requests
+        'HTTP_POOL_HOSTS': 20,  # Hosts whose connection pools are kept
+        'HTTP_CONNECT_TIMEOUT': 5,  # Seconds to connect to an unsubscribe host
+        'HTTP_READ_TIMEOUT': 20,  # Seconds to wait for an unsubscribe response
+        'HTTP2_ENABLED': True,  # Use HTTP/2 for async unsubscribe requests when h2 is installed
+        'DOMAIN_ROUTES_ENABLED': True,  # Route unsubscribe links by what worked before for their domain
+        'DOMAIN_ROUTES_PATH': os.path.join(CONFIG_DIR, 'domain_routes.db'),
+        'DOMAIN_ROUTES_HALF_LIFE_DAYS': 14,  # Days after which recorded unsubscribe outcomes count half
+        'DOMAIN_ROUTES_MIN_ATTEMPTS': 2,  # Recent attempts needed before a domain's outcome is trusted
+        'DOMAIN_ROUTES_MIN_SUCCESS_PCT': 50,  # Success rate at which a strategy counts as working for a domain
+        'PLAYWRIGHT_BLOCK_ENABLED': True,  # Abort unneeded requests on Playwright unsubscribe pages
+        'PLAYWRIGHT_BLOCK_RESOURCES': 'image,font,media',  # Resource types aborted (comma-separated)
+        'PLAYWRIGHT_BLOCK_HOSTS': '',  # Hosts aborted in addition to the built-in tracker list (comma-separated)
+        'PLAYWRIGHT_ALLOW_HOSTS': '',  # Hosts never aborted, overriding the rules above (comma-separated)
+        'BODY_SCAN_TAIL_KB': 64,  # End of an email body scanned for unsubscribe links before the whole body (0 = whole body)
     }
     
     # Update with environment variables if they exist
@@ -34,6 +75,8 @@ def load_config() -> Dict[str, Any]:
                 except (ValueError, TypeError):
                     # Keep default if conversion fails
                     pass  
+            else:
+                config[key] = value
     
     return config
 
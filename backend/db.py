@@ -1,133 +1,245 @@
 import os
-from datetime import datetime, UTC
+import copy
+import time
+import atexit
+import threading
+from collections import OrderedDict
 import logging
 from dotenv import load_dotenv # Added this line
 
-load_dotenv() # Added this line to load environment variables from .env
+from config import config as app_config
+from user_store import UserStore, MongoUserStore, SQLiteUserStore, MemoryUserStore, MongoClient
 
-try:
-	from pymongo import MongoClient
-	from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError # Import specific exceptions
-except ImportError:
-	MongoClient = None
-except Exception as e: # Catch any other unexpected import errors
-    print(f"ERROR: Failed to import pymongo: {e}")
-    MongoClient = None
+load_dotenv() # Added this line to load environment variables from .env
 
 MONGO_URI = os.getenv("MONGODB_URI")
 DB_NAME = os.getenv("MONGODB_DB", "unclut")
 COLLECTION = os.getenv("MONGODB_COLLECTION", "users")
+MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", "50"))
+MIN_POOL_SIZE = int(os.getenv("MONGODB_MIN_POOL_SIZE", "0"))
+MAX_IDLE_TIME_MS = int(os.getenv("MONGODB_MAX_IDLE_TIME_MS", "300000"))
+# Seconds between server pings; operations in between rely on the driver's own monitoring
+HEALTH_CHECK_INTERVAL = float(os.getenv("MONGODB_HEALTH_CHECK_INTERVAL", "30"))
+# Activity counters are buffered and written in bulk
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv("ACTIVITY_FLUSH_INTERVAL", "5"))
+ACTIVITY_FLUSH_SIZE = int(os.getenv("ACTIVITY_FLUSH_SIZE", "100"))
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def _get_collection():
-	if not (MONGO_URI and MongoClient):
-		return None
-	try:
-		client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=3000)
-		client.admin.command('ismaster')
-		db = client[DB_NAME]
-		logging.info(f"Successfully connected to MongoDB database: {DB_NAME}")
-		return db[COLLECTION]
-	except (ConnectionFailure, ServerSelectionTimeoutError) as e:
-		logging.error(f"MongoDB connection failed: {e}. Please check your MONGODB_URI and Network Access in Atlas.")
-		return None
-	except Exception as e:
-		logging.error(f"An unexpected error occurred during MongoDB connection setup: {e}")
-		return None
+_store = None
+_store_lock = threading.Lock()
+
+# Read-through cache of get_user results
+_user_cache = OrderedDict()  # email -> (stored_at, user or None)
+_user_generations = {}  # email -> invalidation count while a load is in flight, guards against storing stale loads
+_user_loads = {}  # email -> Event of the in-flight load
+_user_cache_lock = threading.Lock()
+
+_pending_activity = {}  # email -> [unsubs, deleted]
+_activity_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_flusher = None
+_flusher_stop = threading.Event()
+_flusher_wakeup = threading.Event()
+
+def create_store(backend: str) -> UserStore:
+	"""
+	Build the user store named by `backend`: 'mongo', 'sqlite', 'memory', or
+	'auto' (MongoDB when MONGODB_URI is set, SQLite otherwise).
+	"""
+	if backend == 'auto':
+		backend = 'mongo' if MONGO_URI and MongoClient else 'sqlite'
+	if backend == 'mongo':
+		return MongoUserStore(
+			MONGO_URI, DB_NAME, COLLECTION,
+			max_pool_size=MAX_POOL_SIZE,
+			min_pool_size=MIN_POOL_SIZE,
+			max_idle_time_ms=MAX_IDLE_TIME_MS,
+			health_check_interval=HEALTH_CHECK_INTERVAL
+		)
+	if backend == 'sqlite':
+		return SQLiteUserStore(app_config['DB_SQLITE_PATH'])
+	if backend == 'memory':
+		return MemoryUserStore()
+	raise ValueError(f"Unknown DB_BACKEND: {backend}")
+
+def get_store() -> UserStore:
+	"""Return the process-wide user store selected by DB_BACKEND."""
+	global _store
+	with _store_lock:
+		if _store is None:
+			_store = create_store(app_config['DB_BACKEND'])
+			logging.info(f"Using {_store.name} user store")
+		return _store
+
+def set_store(store: UserStore) -> None:
+	"""Replace the process-wide user store (benchmarks, tests)."""
+	global _store
+	with _store_lock:
+		_store = store
+
+def _after_fork():
+	global _store_lock, _activity_lock, _flush_lock, _flusher, _user_cache_lock
+	# The parent's locks may have been held by another thread at fork time
+	_store_lock = threading.Lock()
+	_user_cache_lock = threading.Lock()
+	# Loads in flight belong to parent threads and would never complete here
+	_user_loads.clear()
+	_activity_lock = threading.Lock()
+	_flush_lock = threading.Lock()
+	# Buffered counts belong to the parent, which flushes them; threads do not survive a fork
+	_pending_activity.clear()
+	_flusher = None
+	if _store is not None:
+		_store.after_fork()
+
+if hasattr(os, 'register_at_fork'):
+	os.register_at_fork(after_in_child=_after_fork)
+
+def close_client() -> None:
+	"""Close the store's connections (called on application shutdown)."""
+	if _store is not None:
+		_store.close()
+
+def pool_stats() -> dict:
+	"""Connection metrics of the user store in this process."""
+	return get_store().stats()
+
+def invalidate_user(email: str) -> None:
+	"""Drop the cached record of `email`; loads already in flight will not be cached."""
+	with _user_cache_lock:
+		_user_cache.pop(email, None)
+		# Only an in-flight load can still store a stale record
+		if email in _user_loads:
+			_user_generations[email] = _user_generations.get(email, 0) + 1
+
+def _queue_activity(activity: dict) -> int:
+	"""Merge per-user [unsubs, deleted] increments into the pending buffer; returns its size."""
+	with _activity_lock:
+		for email, (unsubs, deleted) in activity.items():
+			counts = _pending_activity.setdefault(email, [0, 0])
+			counts[0] += unsubs
+			counts[1] += deleted
+		return len(_pending_activity)
+
+def _activity_flusher():
+	while not _flusher_stop.is_set():
+		_flusher_wakeup.wait(ACTIVITY_FLUSH_INTERVAL)
+		_flusher_wakeup.clear()
+		flush_activity()
+
+def _ensure_activity_flusher():
+	global _flusher
+	with _activity_lock:
+		if _flusher is None or not _flusher.is_alive():
+			_flusher_stop.clear()
+			_flusher = threading.Thread(target=_activity_flusher, name="activity-flusher", daemon=True)
+			_flusher.start()
 
 def record_activity(user_email: str, unsub_delta: int = 0, deleted_delta: int = 0) -> None:
+	"""
+	Buffer activity counters for a user.
+	Increments are merged per user in memory and written by a background flusher
+	every ACTIVITY_FLUSH_INTERVAL seconds, or sooner once ACTIVITY_FLUSH_SIZE users are pending.
+	"""
 	if not user_email or (unsub_delta == 0 and deleted_delta == 0):
 		return
-	coll = _get_collection()
-	if coll is None:
+	if not get_store().available:
 		return
-	now = datetime.now(UTC)
-	update = {
-		"$setOnInsert": {
-			"email": user_email,
-			"createdAt": now,
-		},
-		"$inc": {
-			"unsubs_count": max(0, int(unsub_delta)),
-			"deleted_count": max(0, int(deleted_delta))
-		},
-		"$set": {"updatedAt": now}
-	}
-	try:
-		result = coll.update_one({"_id": user_email}, update, upsert=True)
-		if result.upserted_id:
-			logging.info(f"New user {user_email} added to database.")
-		elif result.modified_count:
-			logging.info(f"Updated activity for {user_email}. Unsub: {unsub_delta}, Deleted: {deleted_delta}.")
-		else:
-			logging.info(f"Activity record operation for {user_email} completed with no changes (dry run or no new activity).")
-	except Exception as e:
-		logging.error(f"Failed to record activity for {user_email} in MongoDB: {e}")
+	size = _queue_activity({user_email: (max(0, int(unsub_delta)), max(0, int(deleted_delta)))})
+	invalidate_user(user_email)
+	_ensure_activity_flusher()
+	if size >= ACTIVITY_FLUSH_SIZE:
+		_flusher_wakeup.set()
+
+def flush_activity() -> int:
+	"""
+	Write the buffered activity counters in one store write (a bulk_write on MongoDB).
+	Increments that could not be written are put back into the buffer for the next flush.
+
+	Returns:
+		Number of users whose counters were written
+	"""
+	with _flush_lock:
+		with _activity_lock:
+			batch = dict(_pending_activity)
+			_pending_activity.clear()
+		if not batch:
+			return 0
+
+		failed = get_store().apply_activity({email: tuple(counts) for email, counts in batch.items()})
+		if failed:
+			_queue_activity({email: batch[email] for email in failed})
+		for email in batch:
+			invalidate_user(email)
+		written = len(batch) - len(failed)
+		if written:
+			logging.info(f"Recorded activity for {written} user(s).")
+		return written
+
+def shutdown_activity() -> None:
+	"""Stop the background flusher and write whatever is still buffered."""
+	_flusher_stop.set()
+	_flusher_wakeup.set()
+	if _flusher is not None and _flusher is not threading.current_thread():
+		_flusher.join(timeout=10)
+	flush_activity()
+
+atexit.register(shutdown_activity)
 
 def save_user(user_info: dict, credentials: dict) -> bool:
     """
-    Save user info and credentials to MongoDB.
+    Save user info and credentials to the user store.
     """
     if not user_info.get('email'):
         return False
-        
-    coll = _get_collection()
-    if coll is None:
-        return False
-        
-    email = user_info['email']
-    now = datetime.now(UTC)
-    
-    # Prepare the update document
-    update_data = {
-        "$set": {
-            "email": email,
-            "name": user_info.get('name'),
-            "picture": user_info.get('picture'),
-            "updatedAt": now,
-            # Store credentials securely
-            "tokens": credentials # In a real app, encrypt this!
-        },
-        "$setOnInsert": {
-            "createdAt": now,
-            "unsubs_count": 0,
-            "deleted_count": 0,
-            "hasOnboarded": False  # Default to False for new users
-        }
-    }
-    
-    try:
-        coll.update_one({"_id": email}, update_data, upsert=True)
-        logging.info(f"User {email} saved/updated in database.")
+
+    saved = get_store().save_user(user_info, credentials)
+    invalidate_user(user_info['email'])
+    if saved:
+        logging.info(f"User {user_info['email']} saved/updated in database.")
         return True
-    except Exception as e:
-        logging.error(f"Failed to save user {email}: {e}")
-        return False
+    return False
 
 def update_user_onboarding(email: str, status: bool = True) -> bool:
     """
     Update the hasOnboarded status for a user.
     """
-    coll = _get_collection()
-    if coll is None:
-        return False
-        
-    try:
-        coll.update_one(
-            {"_id": email},
-            {"$set": {"hasOnboarded": status, "updatedAt": datetime.now(UTC)}}
-        )
-        return True
-    except Exception as e:
-        logging.error(f"Failed to update onboarding status for {email}: {e}")
-        return False
+    updated = get_store().update_onboarding(email, status)
+    invalidate_user(email)
+    return updated
 
 def get_user(email: str) -> dict:
     """
     Retrieve user by email.
+    Served from a short-lived cache; concurrent misses on the same email share one store read.
     """
-    coll = _get_collection()
-    if coll is None:
-        return None
-    return coll.find_one({"_id": email})
+    while True:
+        with _user_cache_lock:
+            entry = _user_cache.get(email)
+            if entry is not None and time.monotonic() - entry[0] <= app_config['USER_CACHE_TTL']:
+                _user_cache.move_to_end(email)
+                return copy.deepcopy(entry[1])
+            loading = _user_loads.get(email)
+            if loading is None:
+                loading = _user_loads[email] = threading.Event()
+                generation = _user_generations.get(email, 0)
+                break
+        # Another thread is reading this user; use its result once it lands
+        loading.wait()
+
+    try:
+        user = get_store().get_user(email)
+        with _user_cache_lock:
+            if _user_generations.get(email, 0) == generation:
+                _user_cache[email] = (time.monotonic(), user)
+                _user_cache.move_to_end(email)
+                while len(_user_cache) > app_config['USER_CACHE_SIZE']:
+                    _user_cache.popitem(last=False)
+        return copy.deepcopy(user)
+    finally:
+        with _user_cache_lock:
+            _user_loads.pop(email, None)
+            # The next load starts from a fresh generation; nothing to keep per email
+            _user_generations.pop(email, None)
+        loading.set()
@@ -0,0 +1,228 @@
+"""
+Learned per-domain routing of unsubscribe links.
+
+Every strategy attempt is recorded per unsubscribe host: decayed success and
+attempt counts plus a window of recent latencies. Links are then sent straight
+to the tiers known to work for their host, skipping the ones known to fail, so
+a domain that always works with a plain GET never waits on a browser and one
+that always needs JavaScript stops paying for the HTTP tiers first.
+
+Counts halve every DOMAIN_ROUTES_HALF_LIFE_DAYS, so stale knowledge fades out
+and the full cascade is tried again. The table is a local SQLite file in WAL
+mode shared by every worker process.
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+import statistics
+from urllib.parse import urlparse
+from typing import List, Dict, Any, Optional, Sequence, TypeVar
+
+from config import config as app_config
+
+S = TypeVar('S')
+
+# Recent latencies kept per (domain, tier) for the median
+LATENCY_SAMPLES = 15
+# Rows whose decayed attempt count fell below this carry no information and are deleted
+PRUNE_BELOW = 0.05
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS domain_routes (
+    domain TEXT NOT NULL,
+    tier TEXT NOT NULL,
+    successes REAL NOT NULL,
+    attempts REAL NOT NULL,
+    latencies TEXT NOT NULL,
+    last_success REAL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (domain, tier)
+);
+"""
+
+def domain_of(link: str) -> str:
+    """Routing key of an unsubscribe link: its lowercased host without 'www.'."""
+    host = (urlparse(link).hostname or '').lower()
+    return host[4:] if host.startswith('www.') else host
+
+def _push_latency(latencies: Optional[str], elapsed: float) -> str:
+    samples = json.loads(latencies) if latencies else []
+    samples.append(round(elapsed, 3))
+    return json.dumps(samples[-LATENCY_SAMPLES:])
+
+class DomainRoutes:
+    """
+    Per-domain outcome table of the unsubscribe strategies.
+
+    Args:
+        path: SQLite file (or ':memory:')
+        half_life_days: Days after which recorded outcomes count half
+        min_attempts: Decayed attempts needed before an outcome is trusted
+        min_success_rate: Success rate (0-1) at which a tier counts as working for a domain
+    """
+
+    def __init__(self, path: str, half_life_days: float = 14, min_attempts: float = 2, min_success_rate: float = 0.5):
+        if path != ':memory:':
+            path = os.path.expanduser(path)
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.half_life = half_life_days * 86400
+        self.min_attempts = min_attempts
+        self.min_success_rate = min_success_rate
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+
+    def _decay(self, updated_at: float, now: float) -> float:
+        """Weight left of outcomes recorded at `updated_at`."""
+        if self.half_life <= 0:
+            return 1.0
+        return 0.5 ** (max(0.0, now - updated_at) / self.half_life)
+
+    def _connection(self) -> sqlite3.Connection:
+        """Open the database on first use and again in a forked child. Caller holds the lock."""
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            self._conn_pid = os.getpid()
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            # Decay is applied inside the upsert so concurrent writers never lose an update
+            self._conn.create_function('decay', 2, self._decay, deterministic=True)
+            self._conn.create_function('push_latency', 2, _push_latency)
+            with self._conn:
+                self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def after_fork(self) -> None:
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def record(self, domain: str, tier: str, success: bool, elapsed: float) -> None:
+        """Add one strategy attempt to the table."""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "INSERT INTO domain_routes (domain, tier, successes, attempts, latencies, last_success, updated_at) "
+                    "VALUES (?, ?, ?, 1, push_latency(NULL, ?), ?, ?) "
+                    "ON CONFLICT(domain, tier) DO UPDATE SET "
+                    "successes = successes * decay(updated_at, excluded.updated_at) + excluded.successes, "
+                    "attempts = attempts * decay(updated_at, excluded.updated_at) + 1, "
+                    "latencies = push_latency(latencies, ?), "
+                    "last_success = COALESCE(excluded.last_success, last_success), "
+                    "updated_at = excluded.updated_at",
+                    (domain, tier, 1.0 if success else 0.0, elapsed, now if success else None, now, elapsed)
+                )
+
+    def record_attempts(self, link: str, attempts: List[Dict[str, Any]]) -> None:
+        """Record the 'attempts' of a cascade result; failures to write are only logged."""
+        domain = domain_of(link)
+        if not domain:
+            return
+        try:
+            for attempt in attempts:
+                self.record(domain, attempt['tier'], attempt['success'], attempt['elapsed'])
+        except sqlite3.Error as e:
+            logging.error(f"Failed to record unsubscribe route for {domain}: {e}")
+
+    def stats(self, domain: str) -> Dict[str, Dict[str, Any]]:
+        """
+        Decayed outcomes of each tier tried on `domain`.
+
+        Returns:
+            {tier: {'success_rate', 'attempts', 'median_latency', 'last_success'}}
+        """
+        now = time.time()
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT tier, successes, attempts, latencies, last_success, updated_at FROM domain_routes WHERE domain = ?",
+                (domain,)
+            ).fetchall()
+        stats = {}
+        for tier, successes, attempts, latencies, last_success, updated_at in rows:
+            weight = self._decay(updated_at, now)
+            samples = json.loads(latencies)
+            stats[tier] = {
+                'success_rate': successes / attempts if attempts else 0.0,
+                'attempts': round(attempts * weight, 3),
+                'median_latency': statistics.median(samples) if samples else None,
+                'last_success': last_success,
+            }
+        return stats
+
+    def order(self, link: str, strategies: Sequence[S]) -> List[S]:
+        """
+        Order `strategies` (given cheapest first) for the domain of `link`.
+        Tiers known to work come first, fastest median latency first; tiers
+        without enough recent evidence keep their cost order; tiers known to
+        fail are kept only as a last resort.
+        """
+        try:
+            stats = self.stats(domain_of(link))
+        except sqlite3.Error as e:
+            logging.error(f"Failed to read unsubscribe routes: {e}")
+            return list(strategies)
+
+        working, unknown, failing = [], [], []
+        for strategy in strategies:
+            tier = stats.get(strategy.name)
+            if tier is None or tier['attempts'] < self.min_attempts:
+                unknown.append(strategy)
+            elif tier['success_rate'] >= self.min_success_rate:
+                working.append(strategy)
+            else:
+                failing.append(strategy)
+        working.sort(key=lambda strategy: stats[strategy.name]['median_latency'] or 0)
+        return working + unknown + failing
+
+    def prune(self) -> int:
+        """Delete entries whose outcomes have decayed away; returns the number removed."""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                cursor = conn.execute(
+                    "DELETE FROM domain_routes WHERE attempts * decay(updated_at, ?) < ?", (now, PRUNE_BELOW)
+                )
+        return cursor.rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+_routes: Optional[DomainRoutes] = None
+_routes_lock = threading.Lock()
+
+def get_domain_routes() -> Optional[DomainRoutes]:
+    """Return the process-wide routing table, or None when DOMAIN_ROUTES_ENABLED is off."""
+    global _routes
+    if not app_config['DOMAIN_ROUTES_ENABLED']:
+        return None
+    with _routes_lock:
+        if _routes is None:
+            _routes = DomainRoutes(
+                app_config['DOMAIN_ROUTES_PATH'],
+                half_life_days=app_config['DOMAIN_ROUTES_HALF_LIFE_DAYS'],
+                min_attempts=app_config['DOMAIN_ROUTES_MIN_ATTEMPTS'],
+                min_success_rate=app_config['DOMAIN_ROUTES_MIN_SUCCESS_PCT'] / 100
+            )
+            try:
+                _routes.prune()
+            except sqlite3.Error as e:
+                logging.error(f"Failed to prune unsubscribe routes: {e}")
+        return _routes
+
+def _after_fork():
+    global _routes_lock
+    _routes_lock = threading.Lock()
+    if _routes is not None:
+        _routes.after_fork()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
@@ -1,103 +1,266 @@
-from typing import List, Dict, Any, Tuple, Optional
+from typing import List, Dict, Any, Tuple, Optional, Callable, Iterator, AsyncIterator
 import re
+import time
+import asyncio
+from collections import OrderedDict
 from googleapiclient.discovery import Resource
 from termcolor import colored
 import datetime
 import logging
 from config import config as app_config
+from message_cache import message_cache, format_key
+from gmail_executor import gmail_executor
+from extract_unsubscribe import parse_list_unsubscribe, process_email_data
 
-def fetch_promotional_emails(service: Resource, max_senders: int = 20, max_emails_to_scan: int = 200, fetch_full_content: bool = False) -> List[Dict[str, Any]]:
+def _parse_sender(from_header: str) -> Tuple[str, str]:
+    """Split a From header into (display name, email address)."""
+    sender_match = re.search(r'([^<]+)<([^>]+)>', from_header)
+    if sender_match:
+        return sender_match.group(1).strip(), sender_match.group(2).strip()
+    return from_header.strip(), from_header.strip()
+
+def _get_headers(msg: Dict[str, Any]) -> Dict[str, str]:
+    """Return the message headers as a lowercase name -> value dict."""
+    return {h['name'].lower(): h['value']
+            for h in msg.get('payload', {}).get('headers', [])}
+
+def get_message(service: Resource, msg_id: str, msg_format: str = 'full', metadata_headers: Optional[List[str]] = None, user: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Fetch a single message, answering from the message cache when `user` is given.
+
+    Args:
+        service: Gmail API service object
+        msg_id: ID of the message to fetch
+        msg_format: Gmail message format ('metadata', 'full', ...)
+        metadata_headers: Headers to request when msg_format is 'metadata'
+        user: Mailbox owner used as cache key and charged for quota; None bypasses the cache
+
+    Returns:
+        Gmail message resource
+    """
+    cache_format = format_key(msg_format, metadata_headers)
+    if user:
+        msg = message_cache.get(user, msg_id, cache_format)
+        if msg is not None:
+            return msg
+
+    kwargs = {'userId': app_config['USER_ID'], 'id': msg_id, 'format': msg_format}
+    if msg_format == 'metadata' and metadata_headers:
+        kwargs['metadataHeaders'] = metadata_headers
+    msg = gmail_executor.execute(service.users().messages().get(**kwargs), 'messages.get', user=user)
+
+    if user:
+        message_cache.put(user, msg_id, cache_format, msg)
+    return msg
+
+def fetch_messages_batch(
+    service: Resource,
+    message_ids: List[str],
+    msg_format: str = 'metadata',
+    metadata_headers: Optional[List[str]] = None,
+    batch_size: Optional[int] = None,
+    on_message: Optional[Callable[[str, Dict[str, Any]], bool]] = None,
+    user: Optional[str] = None
+) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Exception]]:
+    """
+    Fetch messages through Gmail's batch endpoint instead of one request per message.
+
+    Args:
+        service: Gmail API service object
+        message_ids: IDs of the messages to fetch
+        msg_format: Gmail message format ('metadata', 'full', ...)
+        metadata_headers: Headers to request when msg_format is 'metadata'
+        batch_size: Requests per HTTP batch (Gmail allows at most 100)
+        on_message: Called as on_message(msg_id, msg) for every fetched message,
+            in request order. Returning True stops before the next batch is sent.
+        user: Mailbox owner used as cache key and charged for quota; cached
+            messages skip the request. None bypasses the cache.
+
+    Returns:
+        Tuple of (msg_id -> message, msg_id -> exception for failed items)
+    """
+    fetched = {}
+    errors = {}
+    batch_size = max(1, min(batch_size or app_config['GMAIL_BATCH_SIZE'], 100))
+    cache_format = format_key(msg_format, metadata_headers)
+
+    def _callback(request_id, response, exception):
+        if exception is not None:
+            logging.error(f"Error fetching message {request_id}: {str(exception)}")
+            errors[request_id] = exception
+            return
+        fetched[request_id] = response
+        if user:
+            message_cache.put(user, request_id, cache_format, response)
+
+    for i in range(0, len(message_ids), batch_size):
+        chunk = message_ids[i:i + batch_size]
+        requests = []
+        for msg_id in chunk:
+            if user:
+                cached = message_cache.get(user, msg_id, cache_format)
+                if cached is not None:
+                    fetched[msg_id] = cached
+                    continue
+            kwargs = {'userId': app_config['USER_ID'], 'id': msg_id, 'format': msg_format}
+            if msg_format == 'metadata' and metadata_headers:
+                kwargs['metadataHeaders'] = metadata_headers
+            requests.append((msg_id, service.users().messages().get(**kwargs)))
+        if requests:
+            gmail_executor.execute_batch(service, requests, 'messages.get', _callback, user=user)
+
+        # Report in request order, mixing cached and fetched messages
+        stop = False
+        if on_message:
+            for msg_id in chunk:
+                if msg_id in fetched and on_message(msg_id, fetched[msg_id]):
+                    stop = True
+                    break
+        if stop:
+            break
+
+    return fetched, errors
+
+# More specific query to reduce results
+PROMOTIONS_QUERY = "category:promotions older_than:14d -category:updates -category:social -category:forums"
+
+# Headers requested by scans; the List-Unsubscribe ones tell unsubscribe capability for free
+SCAN_HEADERS = ['From', 'Subject', 'Date', 'List-Unsubscribe', 'List-Unsubscribe-Post']
+UNSUBSCRIBE_HEADERS = ['From', 'List-Unsubscribe', 'List-Unsubscribe-Post']
+
+def iter_message_id_pages(service: Resource, query: str, max_results: int, page_size: int = 100, user: Optional[str] = None) -> Iterator[List[str]]:
+    """
+    Lazily walk `messages().list` pages for a query, following nextPageToken.
+
+    The next page is only requested once the caller asks for it, so a consumer
+    that stops iterating also stops listing.
+
+    Args:
+        service: Gmail API service object
+        query: Gmail search query
+        max_results: Maximum number of message IDs to yield in total
+        page_size: IDs requested per list call (Gmail max is 500)
+        user: Mailbox owner whose quota is charged
+
+    Yields:
+        Lists of message IDs, one per page
+    """
+    remaining = max_results
+    page_token = None
+    while remaining > 0:
+        kwargs = {
+            'userId': app_config['USER_ID'],
+            'q': query,
+            'maxResults': min(page_size, remaining, 500),
+            'fields': "messages(id,threadId),nextPageToken"
+        }
+        if page_token:
+            kwargs['pageToken'] = page_token
+        response = gmail_executor.execute(service.users().messages().list(**kwargs), 'messages.list', user=user)
+
+        message_ids = [msg['id'] for msg in response.get('messages', [])]
+        if message_ids:
+            remaining -= len(message_ids)
+            yield message_ids
+
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            break
+
+def _collect_new_senders(messages: List[Dict[str, Any]], unique_senders: set, max_senders: int) -> List[Dict[str, Any]]:
+    """
+    Keep the first message of each sender not yet in `unique_senders`, in order,
+    until `max_senders` senders were seen. Kept messages are annotated with
+    `sender_display`, `sender_email` and their List-Unsubscribe capability
+    (`can_unsubscribe`, `one_click_unsubscribe`).
+    """
+    resolved = []
+    for msg in messages:
+        if len(unique_senders) >= max_senders:
+            break
+        headers = _get_headers(msg)
+        sender_name, sender_email = _parse_sender(headers.get('from', ''))
+        if sender_email and sender_email not in unique_senders:
+            unique_senders.add(sender_email)
+            msg['sender_display'] = sender_name
+            msg['sender_email'] = sender_email
+            unsubscribe = parse_list_unsubscribe(headers)
+            msg['can_unsubscribe'] = bool(unsubscribe['links'])
+            msg['one_click_unsubscribe'] = unsubscribe['one_click']
+            resolved.append(msg)
+    return resolved
+
+def iter_promotional_senders(service: Resource, max_senders: int = 20, max_emails_to_scan: int = 200, fetch_full_content: bool = False, user: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Streams promotional emails from unique senders, older than 14 days.
+
+    Pages are listed lazily and each sender record is yielded as soon as its
+    metadata batch resolves. Listing stops once `max_senders` unique senders
+    were found or `max_emails_to_scan` messages were scanned.
+
+    Args:
+        service: Gmail API service object
+        max_senders: Maximum number of unique senders to yield
+        max_emails_to_scan: Maximum number of emails to scan before stopping
+        fetch_full_content: If True, fetches the full email content (slower)
+        user: Mailbox owner used as message cache key; None bypasses the cache
+
+    Yields:
+        Email message data containing sender information
+    """
+    unique_senders = set()
+    batch_size = max(1, min(app_config['GMAIL_BATCH_SIZE'], 100))
+
+    try:
+        for page_ids in iter_message_id_pages(service, PROMOTIONS_QUERY, max_emails_to_scan, user=user):
+            for i in range(0, len(page_ids), batch_size):
+                chunk = page_ids[i:i + batch_size]
+                fetched, _ = fetch_messages_batch(
+                    service,
+                    chunk,
+                    msg_format='metadata',
+                    metadata_headers=SCAN_HEADERS,
+                    batch_size=batch_size,
+                    user=user
+                )
+                resolved = _collect_new_senders(
+                    [fetched[msg_id] for msg_id in chunk if msg_id in fetched], unique_senders, max_senders
+                )
+
+                # Only fetch full content for the selected messages, if explicitly needed
+                if fetch_full_content and resolved:
+                    full_msgs, _ = fetch_messages_batch(
+                        service, [msg['id'] for msg in resolved], msg_format='full', user=user
+                    )
+                    for msg in resolved:
+                        if msg['id'] in full_msgs:
+                            msg.update(full_msgs[msg['id']])
+
+                yield from resolved
+
+                # Stop if we have enough senders
+                if len(unique_senders) >= max_senders:
+                    return
+
+    except Exception as e:
+        logging.error(f"Error fetching messages: {str(e)}")
+
+def fetch_promotional_emails(service: Resource, max_senders: int = 20, max_emails_to_scan: int = 200, fetch_full_content: bool = False, user: Optional[str] = None) -> List[Dict[str, Any]]:
     """
     Fetches up to `max_senders` promotional emails from unique senders,
-    older than 14 days. Optimized for faster performance.
+    older than 14 days. See `iter_promotional_senders` for the streaming variant.
 
     Args:
         service: Gmail API service object
         max_senders: Maximum number of unique senders to fetch emails from
         max_emails_to_scan: Maximum number of emails to scan before stopping
         fetch_full_content: If True, fetches the full email content (slower)
+        user: Mailbox owner used as message cache key; None bypasses the cache
 
     Returns:
         List of email message data containing sender information
     """
-    unique_senders = {}
-    messages = []
-    
-    # More specific query to reduce results
-    query = "category:promotions older_than:14d -category:updates -category:social -category:forums"
-    
-    try:
-        # First, get just the message IDs and basic metadata
-        results = service.users().messages().list(
-            userId=app_config['USER_ID'],
-            q=query,
-            maxResults=min(100, max_emails_to_scan),
-            fields="messages(id,threadId),nextPageToken"
-        ).execute()
-        
-        message_ids = [msg['id'] for msg in results.get('messages', [])]
-        
-        # Process messages in batches for better performance
-        batch_size = 25
-        for i in range(0, len(message_ids), batch_size):
-            batch = message_ids[i:i + batch_size]
-            
-            for msg_id in batch:
-                try:
-                    # Get message with minimal metadata first
-                    msg = service.users().messages().get(
-                        userId=app_config['USER_ID'],
-                        id=msg_id,
-                        format='metadata',
-                        metadataHeaders=['From', 'Subject', 'Date']
-                    ).execute()
-                    
-                    # Extract headers
-                    headers = {h['name'].lower(): h['value'] 
-                             for h in msg.get('payload', {}).get('headers', [])}
-                    
-                    # Extract sender information
-                    from_header = headers.get('from', '')
-                    sender_match = re.search(r'([^<]+)<([^>]+)>', from_header)
-                    
-                    if sender_match:
-                        sender_name = sender_match.group(1).strip()
-                        sender_email = sender_match.group(2).strip()
-                    else:
-                        sender_name = from_header.strip()
-                        sender_email = from_header.strip()
-                    
-                    # Only process if we haven't seen this sender yet
-                    if sender_email and sender_email not in unique_senders:
-                        unique_senders[sender_email] = True
-                        
-                        # Add sender info to message
-                        msg['sender_display'] = sender_name
-                        msg['sender_email'] = sender_email
-                        
-                        # Only fetch full content if explicitly needed
-                        if fetch_full_content:
-                            full_msg = service.users().messages().get(
-                                userId=app_config['USER_ID'],
-                                id=msg_id,
-                                format='full'
-                            ).execute()
-                            msg.update(full_msg)
-                        
-                        messages.append(msg)
-                        
-                        # Stop if we have enough senders
-                        if len(unique_senders) >= max_senders:
-                            return messages
-                            
-                except Exception as e:
-                    logging.error(f"Error processing message {msg_id}: {str(e)}")
-                    continue
-    
-    except Exception as e:
-        logging.error(f"Error fetching messages: {str(e)}")
-    
-    return messages
+    return list(iter_promotional_senders(service, max_senders, max_emails_to_scan, fetch_full_content, user))
 
 def get_valid_sequence_numbers(input_str: str, max_index: int) -> List[int]:
     """
@@ -243,7 +406,7 @@ def preview_emails_with_sequence(messages: List[Dict[str, Any]]) -> Dict[int, st
             print(colored(f"An unexpected error occurred: {str(e)}", 'red'))
             continue
 
-def get_message_ids_for_sender(service, sender_email: str, max_results: int = 1000) -> List[str]:
+def get_message_ids_for_sender(service, sender_email: str, max_results: int = 1000, user: Optional[str] = None) -> List[str]:
     """
     Fetch all message IDs from a specific sender.
     
@@ -251,6 +414,7 @@ def get_message_ids_for_sender(service, sender_email: str, max_results: int = 10
         service: Gmail API service instance
         sender_email: Email address of the sender
         max_results: Maximum number of messages to fetch (max 500)
+        user: Mailbox owner whose quota is charged
         
     Returns:
         List of message IDs
@@ -258,11 +422,11 @@ def get_message_ids_for_sender(service, sender_email: str, max_results: int = 10
     try:
         # Search for messages from the sender
         query = f'from:{sender_email}'
-        response = service.users().messages().list(
+        response = gmail_executor.execute(service.users().messages().list(
             userId='me',
             q=query,
             maxResults=min(max_results, 500)  # Gmail API max is 500 per page
-        ).execute()
+        ), 'messages.list', user=user)
         
         message_ids = []
         while 'messages' in response and len(message_ids) < max_results:
@@ -271,12 +435,12 @@ def get_message_ids_for_sender(service, sender_email: str, max_results: int = 10
             # If there are more messages and we haven't reached max_results
             if 'nextPageToken' in response and len(message_ids) < max_results:
                 page_token = response['nextPageToken']
-                response = service.users().messages().list(
+                response = gmail_executor.execute(service.users().messages().list(
                     userId='me',
                     q=query,
                     pageToken=page_token,
                     maxResults=min(max_results - len(message_ids), 500)
-                ).execute()
+                ), 'messages.list', user=user)
             else:
                 break
                 
@@ -286,7 +450,95 @@ def get_message_ids_for_sender(service, sender_email: str, max_results: int = 10
         logging.error(f"Error fetching message IDs for {sender_email}: {str(e)}")
         return []
 
-def delete_messages_batch(service, message_ids: List[str], batch_size: int = 1000) -> Tuple[int, List[str]]:
+def _header_unsubscribe(msg: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    unsubscribe = parse_list_unsubscribe(_get_headers(msg))
+    if unsubscribe['links']:
+        return {**unsubscribe, 'source': 'header', 'message_id': msg.get('id')}
+    return None
+
+def _body_unsubscribe(msg: Dict[str, Any], extract_links: Callable[[Dict[str, Any]], List[str]]) -> Optional[Dict[str, Any]]:
+    links = extract_links(msg)
+    if links:
+        return {**parse_list_unsubscribe(_get_headers(msg)), 'links': links, 'source': 'body', 'message_id': msg.get('id')}
+    return None
+
+def _extract_body_links(msg: Dict[str, Any]) -> List[str]:
+    return process_email_data(msg).get('unsubscribe_links', [])
+
+def find_unsubscribe_links(service, message_ids: List[str], user: Optional[str] = None, max_body_fetches: Optional[int] = None, extract_links: Callable[[Dict[str, Any]], List[str]] = _extract_body_links) -> Dict[str, Any]:
+    """
+    Find unsubscribe links for a sender's messages, headers first.
+
+    The List-Unsubscribe headers of all messages are fetched in one metadata
+    batch; message bodies are only downloaded (format='full') and parsed when
+    none of them carries a usable header.
+
+    Args:
+        service: Gmail API service instance
+        message_ids: IDs of the sender's messages, newest first
+        user: Mailbox owner used as message cache key; None bypasses the cache
+        max_body_fetches: Maximum number of full messages to download in the fallback
+        extract_links: Body parser returning the unsubscribe links of a full message
+
+    Returns:
+        Dict with 'links', 'one_click', 'source' ('header', 'body' or None) and 'message_id'
+    """
+    fetched, _ = fetch_messages_batch(service, message_ids, msg_format='metadata', metadata_headers=UNSUBSCRIBE_HEADERS, user=user)
+    for msg_id in message_ids:
+        if msg_id in fetched:
+            found = _header_unsubscribe(fetched[msg_id])
+            if found:
+                return found
+
+    for msg_id in message_ids[:max_body_fetches]:
+        try:
+            found = _body_unsubscribe(get_message(service, msg_id, 'full', user=user), extract_links)
+            if found:
+                return found
+        except Exception as e:
+            logging.error(f"Error processing message {msg_id}: {str(e)}")
+
+    return {'links': [], 'one_click': False, 'source': None, 'message_id': None}
+
+def _plan_sender_queries(sender_emails: List[str], max_length: int) -> List[List[str]]:
+    """Greedily pack senders into groups whose `from:(a OR b ...)` query stays under max_length."""
+    groups = []
+    current = []
+    for sender in sender_emails:
+        candidate = current + [sender]
+        if current and len(_sender_query(candidate)) > max_length:
+            groups.append(current)
+            candidate = [sender]
+        current = candidate
+    if current:
+        groups.append(current)
+    return groups
+
+def split_by_sender(message_ids: List[str], senders_by_id: Dict[str, str], group_by_address: Dict[str, str]) -> Dict[str, List[str]]:
+    """
+    Split the IDs listed by a combined `from:` query by sender.
+
+    Args:
+        message_ids: Listed message IDs, in listing order
+        senders_by_id: Message ID -> From address
+        group_by_address: Lowercased address -> sender as queried
+
+    Returns:
+        Sender -> its message IDs; messages of other addresses are dropped
+    """
+    by_sender = {}
+    for msg_id in message_ids:
+        sender = group_by_address.get(senders_by_id.get(msg_id, '').lower())
+        if sender:
+            by_sender.setdefault(sender, []).append(msg_id)
+    return by_sender
+
+def _sender_query(sender_emails: List[str]) -> str:
+    if len(sender_emails) == 1:
+        return f'from:{sender_emails[0]}'
+    return f"from:({' OR '.join(sender_emails)})"
+
+def delete_messages_batch(service, message_ids: List[str], batch_size: int = 1000, user: Optional[str] = None) -> Tuple[int, List[str]]:
     """
     Delete messages in batches using Gmail's batchDelete.
     
@@ -294,6 +546,7 @@ def delete_messages_batch(service, message_ids: List[str], batch_size: int = 100
         service: Gmail API service instance
         message_ids: List of message IDs to delete
         batch_size: Number of messages to delete in each batch (Gmail max is 1000)
+        user: Mailbox owner whose quota is charged
         
     Returns:
         Tuple of (number of messages deleted, list of errors)
@@ -308,10 +561,10 @@ def delete_messages_batch(service, message_ids: List[str], batch_size: int = 100
     for i in range(0, len(message_ids), batch_size):
         batch = message_ids[i:i + batch_size]
         try:
-            service.users().messages().batchDelete(
+            gmail_executor.execute(service.users().messages().batchDelete(
                 userId='me',
                 body={'ids': batch}
-            ).execute()
+            ), 'messages.batchDelete', user=user)
             total_deleted += len(batch)
             logging.info(f"Deleted {len(batch)} messages (total: {total_deleted})")
         except Exception as e:
@@ -321,7 +574,7 @@ def delete_messages_batch(service, message_ids: List[str], batch_size: int = 100
     
     return total_deleted, errors
 
-def delete_emails_from_sender(service, sender_email: str, max_messages: int = 10000, dry_run: bool = False):
+def delete_emails_from_sender(service, sender_email: str, max_messages: int = 10000, dry_run: bool = False, user: Optional[str] = None):
     """
     Delete all emails from a specific sender.
     
@@ -330,12 +583,13 @@ def delete_emails_from_sender(service, sender_email: str, max_messages: int = 10
         sender_email: Email address of the sender
         max_messages: Maximum number of messages to delete
         dry_run: If True, only simulate the deletion
+        user: Mailbox owner whose quota is charged
         
     Returns:
         Dictionary with results including count of messages to be deleted and any errors
     """
     try:
-        message_ids = get_message_ids_for_sender(service, sender_email, max_messages)
+        message_ids = get_message_ids_for_sender(service, sender_email, max_messages, user=user)
         total_messages = len(message_ids)
         
         if dry_run:
@@ -357,7 +611,7 @@ def delete_emails_from_sender(service, sender_email: str, max_messages: int = 10
             }
         
         # Delete messages in batches
-        deleted_count, errors = delete_messages_batch(service, message_ids)
+        deleted_count, errors = delete_messages_batch(service, message_ids, user=user)
         
         return {
             'success': len(errors) == 0,
@@ -374,4 +628,346 @@ def delete_emails_from_sender(service, sender_email: str, max_messages: int = 10
             'error': str(e),
             'sender': sender_email,
             'message': f'Error deleting messages from {sender_email}: {str(e)}'
-        }
\ No newline at end of file
+        }
+
+# --- Async variants used by the API (see gmail_async.AsyncGmailClient) ---
+
+async def async_fetch_messages(client, message_ids: List[str], msg_format: str = 'metadata', metadata_headers: Optional[List[str]] = None, user: Optional[str] = None) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Exception]]:
+    """
+    Concurrently fetch messages, answering from the message cache when `user` is given.
+
+    Returns:
+        Tuple of (msg_id -> message, msg_id -> exception for failed items)
+    """
+    cache_format = format_key(msg_format, metadata_headers)
+    # The cache may read and write SQLite; one worker thread hop per lookup and per store
+    fetched = await asyncio.to_thread(message_cache.get_many, user, message_ids, cache_format) if user else {}
+    missing = [msg_id for msg_id in message_ids if msg_id not in fetched]
+
+    errors = {}
+    if missing:
+        new_msgs, errors = await client.get_messages(missing, msg_format, metadata_headers)
+        if user and new_msgs:
+            await asyncio.to_thread(message_cache.put_many, user, new_msgs, cache_format)
+        fetched.update(new_msgs)
+    return fetched, errors
+
+async def aiter_message_id_pages(client, query: str, max_results: int, page_size: int = 100) -> AsyncIterator[List[str]]:
+    """Async variant of `iter_message_id_pages`."""
+    remaining = max_results
+    page_token = None
+    while remaining > 0:
+        response = await client.list_messages(
+            q=query,
+            max_results=min(page_size, remaining, 500),
+            page_token=page_token,
+            fields="messages(id,threadId),nextPageToken"
+        )
+
+        message_ids = [msg['id'] for msg in response.get('messages', [])]
+        if message_ids:
+            remaining -= len(message_ids)
+            yield message_ids
+
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            break
+
+async def aiter_promotional_senders(client, max_senders: int = 20, max_emails_to_scan: int = 200, fetch_full_content: bool = False, user: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+    """Async variant of `iter_promotional_senders`."""
+    unique_senders = set()
+    batch_size = max(1, min(app_config['GMAIL_BATCH_SIZE'], 100))
+
+    try:
+        async for page_ids in aiter_message_id_pages(client, PROMOTIONS_QUERY, max_emails_to_scan):
+            for i in range(0, len(page_ids), batch_size):
+                chunk = page_ids[i:i + batch_size]
+                fetched, _ = await async_fetch_messages(
+                    client, chunk, msg_format='metadata', metadata_headers=SCAN_HEADERS, user=user
+                )
+                resolved = _collect_new_senders(
+                    [fetched[msg_id] for msg_id in chunk if msg_id in fetched], unique_senders, max_senders
+                )
+
+                if fetch_full_content and resolved:
+                    full_msgs, _ = await async_fetch_messages(
+                        client, [msg['id'] for msg in resolved], msg_format='full', user=user
+                    )
+                    for msg in resolved:
+                        if msg['id'] in full_msgs:
+                            msg.update(full_msgs[msg['id']])
+
+                for msg in resolved:
+                    yield msg
+
+                if len(unique_senders) >= max_senders:
+                    return
+
+    except Exception as e:
+        logging.error(f"Error fetching messages: {str(e)}")
+
+async def async_get_message_ids_for_sender(client, sender_email: str, max_results: int = 1000) -> List[str]:
+    """Async variant of `get_message_ids_for_sender`."""
+    try:
+        message_ids = []
+        async for page_ids in aiter_message_id_pages(client, f'from:{sender_email}', max_results, page_size=500):
+            message_ids.extend(page_ids)
+        return message_ids[:max_results]
+    except Exception as e:
+        logging.error(f"Error fetching message IDs for {sender_email}: {str(e)}")
+        return []
+
+# (user, sender) -> (stored_at, count, exact); filled by async_count_messages_for_sender
+_sender_counts: "OrderedDict[Tuple[Optional[str], str], Tuple[float, int, bool]]" = OrderedDict()
+_SENDER_COUNTS_MAX = 1000
+
+def invalidate_sender_count(sender_email: str, user: Optional[str] = None) -> None:
+    """Forget the cached message count of a sender (after its messages changed)."""
+    _sender_counts.pop((user, sender_email.lower()), None)
+
+async def async_count_messages_for_sender(client, sender_email: str, exact: bool = False, user: Optional[str] = None, max_results: int = 10000) -> Tuple[int, bool]:
+    """
+    Count the messages from a sender without listing them when possible.
+
+    A fresh cached count (COUNT_CACHE_TTL seconds) is returned as is. Otherwise
+    the estimate mode makes a single list call and reads `resultSizeEstimate`;
+    the exact mode pages through IDs with a minimal field mask.
+
+    Args:
+        client: gmail_async.AsyncGmailClient of the mailbox owner
+        sender_email: Email address of the sender
+        exact: If True, count message IDs instead of trusting Gmail's estimate
+        user: Mailbox owner, key for the count cache
+        max_results: Upper bound for the exact count
+
+    Returns:
+        Tuple of (count, whether the count is exact)
+    """
+    key = (user, sender_email.lower())
+    cached = _sender_counts.get(key)
+    if cached and time.monotonic() - cached[0] < app_config['COUNT_CACHE_TTL'] and (cached[2] or not exact):
+        _sender_counts.move_to_end(key)
+        return cached[1], cached[2]
+
+    query = f'from:{sender_email}'
+    if exact:
+        count = 0
+        page_token = None
+        while count < max_results:
+            response = await client.list_messages(
+                q=query, max_results=500, page_token=page_token, fields="messages(id),nextPageToken"
+            )
+            count += len(response.get('messages', []))
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                break
+        count = min(count, max_results)
+    else:
+        response = await client.list_messages(q=query, max_results=1, fields="resultSizeEstimate")
+        count = int(response.get('resultSizeEstimate', 0))
+
+    _sender_counts[key] = (time.monotonic(), count, exact)
+    _sender_counts.move_to_end(key)
+    while len(_sender_counts) > _SENDER_COUNTS_MAX:
+        _sender_counts.popitem(last=False)
+    return count, exact
+
+async def async_find_unsubscribe_links(client, message_ids: List[str], user: Optional[str] = None, max_body_fetches: Optional[int] = None, extract_links: Callable[[Dict[str, Any]], List[str]] = _extract_body_links) -> Dict[str, Any]:
+    """Async variant of `find_unsubscribe_links`; body downloads run concurrently after the newest message."""
+    fetched, _ = await async_fetch_messages(client, message_ids, msg_format='metadata', metadata_headers=UNSUBSCRIBE_HEADERS, user=user)
+    for msg_id in message_ids:
+        if msg_id in fetched:
+            found = _header_unsubscribe(fetched[msg_id])
+            if found:
+                return found
+
+    candidates = message_ids[:max_body_fetches]
+    for window in (candidates[:1], candidates[1:]):
+        msgs, _ = await async_fetch_messages(client, window, msg_format='full', user=user)
+        for msg_id in window:
+            if msg_id in msgs:
+                # Body parsing is CPU-bound; keep it off the event loop
+                found = await asyncio.to_thread(_body_unsubscribe, msgs[msg_id], extract_links)
+                if found:
+                    return found
+
+    return {'links': [], 'one_click': False, 'source': None, 'message_id': None}
+
+async def _async_resolve_senders(client, message_ids: List[str], user: Optional[str] = None, index=None) -> Dict[str, str]:
+    """Map message IDs to sender addresses via the sender index, the message cache, then metadata fetches."""
+    senders_by_id = await asyncio.to_thread(index.get_message_senders, user, message_ids) if (index is not None and user) else {}
+    unresolved = [msg_id for msg_id in message_ids if msg_id not in senders_by_id]
+    if unresolved:
+        fetched, _ = await async_fetch_messages(client, unresolved, msg_format='metadata', metadata_headers=['From'], user=user)
+        for msg_id, msg in fetched.items():
+            senders_by_id[msg_id] = _parse_sender(_get_headers(msg).get('from', ''))[1]
+    return senders_by_id
+
+async def delete_senders_pipelined(
+    client,
+    sender_emails: List[str],
+    max_messages: int = 10000,
+    dry_run: bool = False,
+    on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+    user: Optional[str] = None,
+    index=None,
+    batch_size: int = 1000
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Delete all emails from several senders, pipelining listing and deletion.
+
+    Senders are listed concurrently with packed `from:(a OR b ...)` queries.
+    Each listed page is split by sender and a batchDelete is started as soon
+    as `batch_size` IDs of a sender are ready, with at most
+    DELETE_MAX_CONCURRENCY batches in flight (quota is enforced by the executor).
+
+    Args:
+        client: gmail_async.AsyncGmailClient of the mailbox owner
+        sender_emails: Email addresses of the senders
+        max_messages: Maximum number of messages to delete per sender
+        dry_run: If True, only count the messages
+        on_progress: Called with an event dict for every step: type 'found'
+            (IDs listed), 'deleted' (batch removed), 'error' or 'done'
+        user: Mailbox owner, key for the message cache and the sender index
+        index: Optional sender_index.SenderIndex used to split combined queries
+        batch_size: IDs per batchDelete call (Gmail max is 1000)
+
+    Returns:
+        Dictionary mapping each sender to a `delete_emails_from_sender` result dict,
+        with 'partial' set when messages were deleted before an error
+    """
+    found = {sender: 0 for sender in sender_emails}
+    deleted = {sender: 0 for sender in sender_emails}
+    errors = {sender: [] for sender in sender_emails}
+    buffers = {sender: [] for sender in sender_emails}
+    seen = set()
+    delete_tasks = []
+    semaphore = asyncio.Semaphore(app_config['DELETE_MAX_CONCURRENCY'])
+
+    def _emit(event_type: str, sender: str, **data):
+        if on_progress:
+            try:
+                on_progress({'type': event_type, 'sender': sender, **data})
+            except Exception as e:
+                logging.error(f"Progress callback failed: {e}")
+
+    def _error(sender: str, error_msg: str):
+        logging.error(error_msg)
+        errors[sender].append(error_msg)
+        _emit('error', sender, error=error_msg)
+
+    async def _delete(sender: str, ids: List[str]):
+        async with semaphore:
+            try:
+                await client.batch_delete(ids)
+            except Exception as e:
+                _error(sender, f"Error deleting batch of {len(ids)} messages from {sender}: {str(e)}")
+                return
+        deleted[sender] += len(ids)
+        _emit('deleted', sender, count=len(ids), total=deleted[sender])
+
+    def _route(sender: str, ids: List[str]):
+        ids = [msg_id for msg_id in ids if msg_id not in seen][:max_messages - found[sender]]
+        if not ids:
+            return
+        seen.update(ids)
+        found[sender] += len(ids)
+        _emit('found', sender, count=len(ids), total=found[sender])
+        if dry_run:
+            return
+        buffer = buffers[sender]
+        buffer.extend(ids)
+        while len(buffer) >= batch_size:
+            delete_tasks.append(asyncio.create_task(_delete(sender, buffer[:batch_size])))
+            del buffer[:batch_size]
+
+    async def _list_query(group: List[str]) -> bool:
+        """List one `from:` query, capped at max_messages per sender in total; returns whether it ran out."""
+        group_by_address = {sender.lower(): sender for sender in group}
+        limit = max_messages * len(group)
+        listed = 0
+        async for page_ids in aiter_message_id_pages(client, _sender_query(group), limit, page_size=500):
+            listed += len(page_ids)
+            if len(group) == 1:
+                _route(group[0], page_ids)
+                continue
+            # `from:` also matches display names; keep exact address matches only
+            senders_by_id = await _async_resolve_senders(client, page_ids, user, index)
+            for sender, ids in split_by_sender(page_ids, senders_by_id, group_by_address).items():
+                _route(sender, ids)
+        return listed < limit
+
+    async def _list_group(group: List[str]):
+        # A heavy sender can fill the combined cap on its own; senders still
+        # short are queried again until each has its cap or the listing runs out
+        pending = list(group)
+        try:
+            while pending:
+                if await _list_query(pending):
+                    return
+                still_short = [sender for sender in pending if found[sender] < max_messages]
+                if still_short == pending:
+                    return
+                pending = still_short
+        except Exception as e:
+            if len(pending) > 1:
+                # Fall back to one query per sender so one bad group does not hide all of them
+                logging.warning(f"Combined listing of {len(pending)} senders failed, listing them one by one: {e}")
+                await asyncio.gather(*(_list_group([sender]) for sender in pending))
+                return
+            _error(pending[0], f"Error listing messages from {pending[0]}: {str(e)}")
+
+    # Deleting while paging may shift later pages, so a second pass picks up anything left behind
+    for _ in range(1 if dry_run else 2):
+        deleted_before = sum(deleted.values())
+        pending = [sender for sender in sender_emails if found[sender] < max_messages]
+        await asyncio.gather(*(_list_group(group) for group in _plan_sender_queries(pending, app_config['GMAIL_QUERY_MAX_LENGTH'])))
+        for sender, buffer in buffers.items():
+            if buffer:
+                delete_tasks.append(asyncio.create_task(_delete(sender, list(buffer))))
+                buffer.clear()
+        await asyncio.gather(*delete_tasks)
+        delete_tasks.clear()
+        if sum(deleted.values()) == deleted_before:
+            break
+
+    results = {}
+    for sender in sender_emails:
+        if not dry_run:
+            invalidate_sender_count(sender, user)
+        if errors[sender] and not found[sender]:
+            message = f'Could not list messages from {sender}'
+        elif dry_run:
+            message = f'Would delete {found[sender]} messages from {sender} (dry run)'
+        elif not found[sender]:
+            message = f'No messages found from {sender}'
+        elif errors[sender] and deleted[sender]:
+            message = f'Deleted {deleted[sender]} messages from {sender} before an error: {errors[sender][0]}'
+        else:
+            message = f'Deleted {deleted[sender]} messages from {sender}'
+        results[sender] = {
+            'success': len(errors[sender]) == 0,
+            # Some messages are gone even though a later listing or batch failed
+            'partial': bool(errors[sender]) and deleted[sender] > 0,
+            'deleted_count': found[sender] if dry_run else deleted[sender],
+            'errors': errors[sender],
+            'sender': sender,
+            'message': message
+        }
+        _emit('done', sender, result=results[sender])
+    return results
+
+async def async_delete_emails_from_sender(client, sender_email: str, max_messages: int = 10000, dry_run: bool = False, on_progress: Optional[Callable[[Dict[str, Any]], None]] = None):
+    """Async variant of `delete_emails_from_sender`, running on `delete_senders_pipelined`."""
+    try:
+        results = await delete_senders_pipelined(client, [sender_email], max_messages, dry_run, on_progress, user=client.user)
+        return results[sender_email]
+    except Exception as e:
+        return {
+            'success': False,
+            'partial': False,
+            'deleted_count': 0,
+            'error': str(e),
+            'sender': sender_email,
+            'message': f'Error deleting messages from {sender_email}: {str(e)}'
+        }
@@ -5,7 +5,8 @@ import base64
 import re
 import json
 from typing import List, Dict, Any
-from bs4 import BeautifulSoup
+
+from link_extractor import extract_unsubscribe_hrefs, find_body_unsubscribe_links
 
 def extract_links_from_html(html_content: str) -> List[str]:
     """Extract unsubscribe links from HTML content."""
@@ -18,47 +19,27 @@ def extract_links_from_html(html_content: str) -> List[str]:
     except:
         pass
     
-    # Clean up HTML entities and other common issues
-    html_content = html_content.replace('=\r\n', '').replace('=\n', '')
-    
-    # Try to parse with BeautifulSoup
-    try:
-        soup = BeautifulSoup(html_content, 'html.parser')
-        
-        # Look for common unsubscribe link patterns
-        patterns = [
-            r'unsubscribe',
-            r'email_preferences',
-            r'preferences',
-            r'optout',
-            r'opt-out',
-            r'manage_preferences',
-            r'emailpreferences',
-            r'email-preferences',
-            r'email_optout',
-            r'email-optout'
-        ]
-        
-        # Find all links that match our patterns
-        links = []
-        for pattern in patterns:
-            for a in soup.find_all('a', href=re.compile(pattern, re.IGNORECASE)):
-                href = a.get('href', '').strip()
-                if href and href not in links:
-                    links.append(href)
-        
-        # Also look for mailto: links with unsubscribe in the email
-        for a in soup.find_all('a', href=re.compile(r'mailto:.*unsubscribe', re.IGNORECASE)):
-            href = a.get('href', '').strip()
-            if href and href not in links:
-                links.append(href)
-        
-        return links
-    
-    except Exception as e:
-        print(f"Error parsing HTML: {e}")
-        # Fallback to regex if BeautifulSoup fails
-        return re.findall(r'https?://[^\s">]+unsubscribe[^\s">]*', html_content, re.IGNORECASE)
+    return extract_unsubscribe_hrefs(html_content)
+
+def parse_list_unsubscribe(headers: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Parse the RFC 2369 List-Unsubscribe and RFC 8058 List-Unsubscribe-Post headers.
+
+    Args:
+        headers: Message headers as a lowercase name -> value dict
+
+    Returns:
+        Dict with the header 'links' (http(s) first, then mailto) and whether the
+        sender supports 'one_click' unsubscribe via POST
+    """
+    value = headers.get('list-unsubscribe', '')
+    links = [link.strip() for link in re.findall(r'<([^>]*)>', value)]
+    http_links = [link for link in links if link.startswith(('http://', 'https://'))]
+    mailto_links = [link for link in links if link.startswith('mailto:')]
+    one_click = bool(
+        http_links and 'list-unsubscribe=one-click' in headers.get('list-unsubscribe-post', '').lower()
+    )
+    return {'links': http_links + mailto_links, 'one_click': one_click}
 
 def process_email_data(email_data: Dict[str, Any]) -> Dict[str, Any]:
     """Process email data and extract unsubscribe links."""
@@ -91,14 +72,8 @@ def process_email_data(email_data: Dict[str, Any]) -> Dict[str, Any]:
         links = re.findall(r'<(https?://[^>]+)>', headers['list-unsubscribe'])
         result['unsubscribe_links'].extend(links)
     
-    # Check email body for unsubscribe links
-    parts = payload.get('parts', [])
-    for part in parts:
-        if part.get('mimeType') == 'text/html':
-            body_data = part.get('body', {}).get('data', '')
-            if body_data:
-                html_links = extract_links_from_html(body_data)
-                result['unsubscribe_links'].extend(html_links)
+    # Check email body for unsubscribe links, nested multiparts included
+    result['unsubscribe_links'].extend(find_body_unsubscribe_links(payload))
     
     # Remove duplicates
     result['unsubscribe_links'] = list(set(result['unsubscribe_links']))
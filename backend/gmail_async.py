@@ -0,0 +1,149 @@
+"""
+Asyncio-native Gmail REST client built on a pooled httpx.AsyncClient.
+
+Covers the calls the API endpoints need (list, get, batchDelete, getProfile,
+history) so they can run concurrently without tying up threadpool workers.
+"""
+import asyncio
+import logging
+import datetime
+from typing import List, Dict, Any, Optional, Tuple, Callable
+
+import httpx
+from google.auth.transport.requests import Request as GoogleAuthRequest
+from google.oauth2.credentials import Credentials
+
+from config import config as app_config
+from gmail_executor import gmail_executor
+
+GMAIL_API_URL = "https://gmail.googleapis.com/gmail/v1/users"
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the process-wide pooled HTTP client, creating it on first use."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0),
+            limits=httpx.Limits(
+                max_connections=app_config['GMAIL_MAX_CONNECTIONS'],
+                max_keepalive_connections=app_config['GMAIL_MAX_CONNECTIONS']
+            )
+        )
+    return _http_client
+
+async def close_http_client() -> None:
+    """Close the shared HTTP client (called on application shutdown)."""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+class AsyncGmailClient:
+    """Gmail API client for one user's credentials."""
+
+    def __init__(self, credentials: Credentials, http: Optional[httpx.AsyncClient] = None, user_id: Optional[str] = None, user: Optional[str] = None, on_refresh: Optional[Callable[[Credentials], None]] = None):
+        self.credentials = credentials
+        self.user_id = user_id or app_config['USER_ID']
+        # Mailbox owner whose Gmail quota the executor charges
+        self.user = user
+        # Called (in a worker thread) with the credentials after each token refresh
+        self.on_refresh = on_refresh
+        self.refresh_margin = datetime.timedelta(seconds=app_config['TOKEN_REFRESH_MARGIN'])
+        self._http = http
+        self._refresh_lock = asyncio.Lock()
+        self._semaphore = asyncio.Semaphore(app_config['GMAIL_MAX_CONCURRENCY'])
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        return self._http or get_http_client()
+
+    def _needs_refresh(self) -> bool:
+        """True when the token is invalid or expires within the refresh margin."""
+        if not self.credentials.valid:
+            return True
+        expiry = self.credentials.expiry
+        # google-auth keeps expiry as naive UTC
+        now = datetime.datetime.now(datetime.UTC).replace(tzinfo=None)
+        return expiry is not None and self.credentials.refresh_token is not None and expiry - self.refresh_margin <= now
+
+    def _refresh(self) -> None:
+        self.credentials.refresh(GoogleAuthRequest())
+        if self.on_refresh:
+            try:
+                self.on_refresh(self.credentials)
+            except Exception as e:
+                logging.error(f"Failed to persist refreshed credentials for {self.user}: {e}")
+
+    async def _auth_header(self) -> Dict[str, str]:
+        if self._needs_refresh():
+            async with self._refresh_lock:
+                if self._needs_refresh():
+                    # google-auth refresh is blocking, keep it off the event loop
+                    await asyncio.to_thread(self._refresh)
+        return {'Authorization': f"Bearer {self.credentials.token}"}
+
+    async def _request(self, quota_method: str, method: str, path: str, params: Optional[Dict[str, Any]] = None, json: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        url = f"{GMAIL_API_URL}/{self.user_id}/{path}"
+
+        async def _call():
+            async with self._semaphore:
+                response = await self.http.request(method, url, params=params, json=json, headers=await self._auth_header())
+            response.raise_for_status()
+            return response.json() if response.content else {}
+
+        return await gmail_executor.execute_async(_call, quota_method, self.user)
+
+    async def list_messages(self, q: Optional[str] = None, max_results: int = 100, page_token: Optional[str] = None, fields: Optional[str] = None) -> Dict[str, Any]:
+        params = {'maxResults': max_results}
+        if q:
+            params['q'] = q
+        if page_token:
+            params['pageToken'] = page_token
+        if fields:
+            params['fields'] = fields
+        return await self._request('messages.list', 'GET', 'messages', params=params)
+
+    async def get_message(self, msg_id: str, msg_format: str = 'full', metadata_headers: Optional[List[str]] = None) -> Dict[str, Any]:
+        params = {'format': msg_format}
+        if msg_format == 'metadata' and metadata_headers:
+            params['metadataHeaders'] = metadata_headers
+        return await self._request('messages.get', 'GET', f"messages/{msg_id}", params=params)
+
+    async def get_messages(self, message_ids: List[str], msg_format: str = 'full', metadata_headers: Optional[List[str]] = None) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Exception]]:
+        """
+        Fetch several messages concurrently.
+
+        Returns:
+            Tuple of (msg_id -> message, msg_id -> exception for failed items)
+        """
+        responses = await asyncio.gather(
+            *(self.get_message(msg_id, msg_format, metadata_headers) for msg_id in message_ids),
+            return_exceptions=True
+        )
+        fetched = {}
+        errors = {}
+        for msg_id, response in zip(message_ids, responses):
+            if isinstance(response, Exception):
+                logging.error(f"Error fetching message {msg_id}: {str(response)}")
+                errors[msg_id] = response
+            else:
+                fetched[msg_id] = response
+        return fetched, errors
+
+    async def batch_delete(self, message_ids: List[str]) -> None:
+        await self._request('messages.batchDelete', 'POST', 'messages/batchDelete', json={'ids': message_ids})
+
+    async def get_profile(self) -> Dict[str, Any]:
+        return await self._request('users.getProfile', 'GET', 'profile')
+
+    async def list_history(self, start_history_id: str, history_types: Optional[List[str]] = None, label_id: Optional[str] = None, page_token: Optional[str] = None) -> Dict[str, Any]:
+        params = {'startHistoryId': start_history_id}
+        if history_types:
+            params['historyTypes'] = history_types
+        if label_id:
+            params['labelId'] = label_id
+        if page_token:
+            params['pageToken'] = page_token
+        return await self._request('history.list', 'GET', 'history', params=params)
@@ -0,0 +1,238 @@
+"""
+Shared executor for Gmail API calls.
+
+Every call is charged against a per-user token bucket sized to Gmail's quota
+(units per second), and 429 / 5xx / rate-limit 403 responses are retried with
+jittered exponential backoff. Throttle events are logged and counted.
+"""
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Dict, Any, Optional, List, Tuple, Callable, Awaitable
+
+import httpx
+from googleapiclient.errors import HttpError
+
+from config import config as app_config
+
+# Quota units charged by Gmail per method
+QUOTA_UNITS = {
+    'messages.list': 5,
+    'messages.get': 5,
+    'messages.batchDelete': 50,
+    'users.getProfile': 1,
+    'history.list': 2,
+}
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+class TokenBucket:
+    """Thread-safe token bucket; callers reserve units and wait for the debt to refill."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, units: float) -> float:
+        """Take `units` from the bucket and return how long the caller must wait."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= units
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def acquire(self, units: float) -> float:
+        wait = self.reserve(units)
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, units: float) -> float:
+        wait = self.reserve(units)
+        if wait:
+            await asyncio.sleep(wait)
+        return wait
+
+def _retry_after(headers) -> Optional[float]:
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+def _retryable(status: int, content: str) -> bool:
+    content = content.lower()
+    return status in RETRYABLE_STATUSES or (
+        status == 403 and ('ratelimitexceeded' in content or 'quotaexceeded' in content)
+    )
+
+def _http_error_info(error: Exception) -> Optional[Tuple[int, str, Optional[float]]]:
+    """Return (status, body, retry-after) for Gmail HTTP errors, None for anything else."""
+    if isinstance(error, HttpError):
+        content = error.content.decode('utf-8', errors='ignore') if isinstance(error.content, bytes) else str(error.content)
+        return error.resp.status, content, _retry_after(error.resp)
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code, error.response.text, _retry_after(error.response.headers)
+    return None
+
+class GmailExecutor:
+    """Runs Gmail requests within per-user quota, retrying throttled ones."""
+
+    def __init__(self, units_per_second: float = 250, max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 32.0):
+        self.units_per_second = units_per_second
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.throttle_listeners: List[Callable[[Dict[str, Any]], None]] = []
+        self.recent_events = deque(maxlen=100)
+        self.counters = {'calls': 0, 'units': 0, 'retries': 0, 'throttled': 0, 'quota_wait_seconds': 0.0}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, user: Optional[str]) -> TokenBucket:
+        user = user or app_config['USER_ID']
+        with self._lock:
+            if user not in self._buckets:
+                self._buckets[user] = TokenBucket(self.units_per_second)
+            return self._buckets[user]
+
+    def _charge(self, method: str, count: int) -> int:
+        units = QUOTA_UNITS.get(method, 5) * count
+        with self._lock:
+            self.counters['calls'] += count
+            self.counters['units'] += units
+        return units
+
+    def _record_wait(self, wait: float) -> None:
+        if wait:
+            with self._lock:
+                self.counters['quota_wait_seconds'] += wait
+
+    def _backoff(self, attempt: int, error: Exception, method: str, user: Optional[str]) -> Optional[float]:
+        """Return the delay before the next attempt, or None if the error is not retried."""
+        info = _http_error_info(error)
+        if info is None or attempt >= self.max_retries:
+            return None
+        status, content, retry_after = info
+        if not _retryable(status, content):
+            return None
+
+        if retry_after is not None:
+            # A hostile or broken Retry-After must not park the worker indefinitely
+            delay = min(max(retry_after, 0.0), self.max_delay)
+        else:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        event = {'method': method, 'user': user or app_config['USER_ID'], 'status': status, 'attempt': attempt + 1, 'delay': delay}
+        with self._lock:
+            self.counters['retries'] += 1
+            if status in (403, 429):
+                self.counters['throttled'] += 1
+            self.recent_events.append(event)
+        logging.warning(f"Gmail {method} returned {status}, retrying in {delay:.2f}s (attempt {attempt + 1}/{self.max_retries})")
+        for listener in self.throttle_listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                logging.error(f"Throttle listener failed: {e}")
+        return delay
+
+    def execute(self, request, method: str, user: Optional[str] = None, http=None) -> Any:
+        """
+        Execute a googleapiclient request within quota.
+
+        Args:
+            request: googleapiclient HttpRequest
+            method: Gmail method name, used for quota accounting (see QUOTA_UNITS)
+            user: Mailbox owner whose quota is charged
+            http: Optional http object to execute on (for use from worker threads)
+        """
+        units = self._charge(method, 1)
+        attempt = 0
+        while True:
+            self._record_wait(self._bucket(user).acquire(units))
+            try:
+                return request.execute(http=http) if http is not None else request.execute()
+            except Exception as e:
+                delay = self._backoff(attempt, e, method, user)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+
+    def execute_batch(self, service, requests: List[Tuple[str, Any]], method: str, callback: Callable[[str, Any, Optional[Exception]], None], user: Optional[str] = None) -> None:
+        """
+        Execute requests as one Gmail HTTP batch within quota.
+        Items that fail with a retryable error are re-sent in a follow-up batch;
+        `callback(request_id, response, exception)` receives the final outcome of each item.
+        """
+        pending = list(requests)
+        attempt = 0
+        while pending:
+            self._record_wait(self._bucket(user).acquire(self._charge(method, len(pending))))
+            outcomes = {}
+
+            def _collect(request_id, response, exception):
+                outcomes[request_id] = (response, exception)
+
+            batch = service.new_batch_http_request(callback=_collect)
+            for request_id, request in pending:
+                batch.add(request, request_id=request_id)
+            try:
+                batch.execute()
+            except Exception as e:
+                # The batch request itself failed; retry it whole or fail every item
+                delay = self._backoff(attempt, e, method, user)
+                if delay is None:
+                    for request_id, _ in pending:
+                        callback(request_id, None, e)
+                    return
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            retry = []
+            delay = None
+            for request_id, request in pending:
+                response, exception = outcomes.get(request_id, (None, None))
+                if exception is not None:
+                    item_delay = self._backoff(attempt, exception, method, user)
+                    if item_delay is not None:
+                        retry.append((request_id, request))
+                        delay = max(delay or 0.0, item_delay)
+                        continue
+                callback(request_id, response, exception)
+
+            if retry:
+                time.sleep(delay)
+                attempt += 1
+            pending = retry
+
+    async def execute_async(self, call: Callable[[], Awaitable[Any]], method: str, user: Optional[str] = None) -> Any:
+        """Async variant of `execute`; `call` creates the request coroutine for each attempt."""
+        units = self._charge(method, 1)
+        attempt = 0
+        while True:
+            self._record_wait(await self._bucket(user).acquire_async(units))
+            try:
+                return await call()
+            except Exception as e:
+                delay = self._backoff(attempt, e, method, user)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.counters, 'recent_throttle_events': list(self.recent_events)}
+
+gmail_executor = GmailExecutor(
+    units_per_second=app_config['GMAIL_QUOTA_UNITS_PER_SECOND'],
+    max_retries=app_config['GMAIL_MAX_RETRIES']
+)
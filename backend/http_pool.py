@@ -0,0 +1,104 @@
+"""
+Shared HTTP connection pools for the unsubscribe strategies.
+
+Unsubscribe links concentrate on a few ESP hosts (sendgrid.net,
+list-manage.com, klaviyo...), so keep-alive connections are reused across
+links instead of paying a TCP and TLS handshake per request. The sync pool is a
+set of requests adapters shared by per-job sessions: urllib3 pools are
+thread-safe, while each job keeps its own cookies. Async jobs likewise get
+their own client and cookie jar over one shared transport, which speaks
+HTTP/2 when the `h2` package is installed.
+"""
+import logging
+import threading
+from typing import Optional, Tuple
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import config as app_config
+
+try:
+    import h2  # noqa: F401  (enables httpx HTTP/2)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+def default_timeout() -> Tuple[float, float]:
+    """(connect, read) timeout in seconds for unsubscribe requests."""
+    return (app_config['HTTP_CONNECT_TIMEOUT'], app_config['HTTP_READ_TIMEOUT'])
+
+class HttpPool:
+    """
+    Keep-alive connection pools shared by the requests-based strategies.
+
+    Args:
+        per_host: Connections kept (and allowed at once) per host
+        hosts: Hosts whose pools are kept
+        headers: Default headers of every session
+    """
+
+    def __init__(self, per_host: int = 4, hosts: int = 20, headers: Optional[dict] = None):
+        self.headers = headers or {}
+        # pool_block caps concurrent connections per host instead of opening throwaway ones
+        self._adapter = HTTPAdapter(pool_connections=hosts, pool_maxsize=per_host, pool_block=True)
+
+    def session(self) -> requests.Session:
+        """
+        New session for one unsubscribe job, backed by the shared pools.
+        Do not close it: closing a session closes its adapters.
+        """
+        session = requests.Session()
+        session.mount('http://', self._adapter)
+        session.mount('https://', self._adapter)
+        session.headers.update(self.headers)
+        return session
+
+    def close(self) -> None:
+        self._adapter.close()
+
+_pool: Optional[HttpPool] = None
+_pool_lock = threading.Lock()
+
+def get_http_pool() -> HttpPool:
+    """Return the process-wide sync pool, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = HttpPool(per_host=app_config['HTTP_POOL_PER_HOST'], hosts=app_config['HTTP_POOL_HOSTS'])
+        return _pool
+
+def close_http_pool() -> None:
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.close()
+
+def create_async_transport() -> httpx.AsyncHTTPTransport:
+    """Connection pool for async unsubscribe requests; HTTP/2 when available and enabled."""
+    http2 = app_config['HTTP2_ENABLED'] and HTTP2_AVAILABLE
+    if app_config['HTTP2_ENABLED'] and not HTTP2_AVAILABLE:
+        logging.info("HTTP/2 requested but the h2 package is not installed, using HTTP/1.1")
+    return httpx.AsyncHTTPTransport(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=app_config['HTTP_POOL_PER_HOST'] * app_config['HTTP_POOL_HOSTS'],
+            max_keepalive_connections=app_config['HTTP_POOL_HOSTS']
+        )
+    )
+
+def create_async_client(headers: Optional[dict] = None, transport: Optional[httpx.AsyncHTTPTransport] = None) -> httpx.AsyncClient:
+    """
+    Async client for one unsubscribe job, with its own cookie jar.
+    When `transport` is shared between jobs, do not close the client: closing
+    a client closes its transport.
+    """
+    connect, read = default_timeout()
+    return httpx.AsyncClient(
+        headers=headers,
+        follow_redirects=True,
+        timeout=httpx.Timeout(read, connect=connect),
+        transport=transport or create_async_transport()
+    )
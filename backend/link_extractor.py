@@ -0,0 +1,201 @@
+"""
+Unsubscribe link extraction from email bodies.
+
+The anchors are walked once and each href is matched against a single
+precompiled alternation. Parsing uses the fastest installed backend:
+selectolax, then lxml, then the standard library's html.parser (which only
+collects anchors, without building a BeautifulSoup tree).
+
+Gmail payloads are walked lazily through nested multiparts, HTML parts
+before plain text ones; a part is only decoded when it is about to be
+scanned, and the walk stops at the first part with unsubscribe links.
+
+Unsubscribe links nearly always sit in the footer, so a large body is
+scanned tail first: only its last BODY_SCAN_TAIL_KB are decoded, prefiltered
+with the link regex and parsed. The whole body is decoded and parsed only
+when the tail has no link.
+"""
+import re
+import base64
+import logging
+from html.parser import HTMLParser
+from typing import List, Callable, Dict, Any, Iterator, Tuple, Optional
+
+from config import config as app_config
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as SelectolaxParser
+except ImportError:
+    SelectolaxParser = None
+
+try:
+    import lxml.html
+    import lxml.etree
+except ImportError:
+    lxml = None
+
+# Covers unsubscribe, (email|manage)[-_]preferences, optout, opt-out and email[-_]optout
+# links, mailto:...unsubscribe included
+UNSUBSCRIBE_HREF = re.compile(r'unsubscribe|preferences|opt-?out', re.IGNORECASE)
+# Unsubscribe URLs in plain text, and the last resort when HTML cannot be parsed at all
+UNSUBSCRIBE_URL = re.compile(r'https?://[^\s">]+unsubscribe[^\s">]*', re.IGNORECASE)
+
+def clean_html(html_content: str) -> str:
+    """Undo quoted-printable soft line breaks left in some bodies."""
+    return html_content.replace('=\r\n', '').replace('=\n', '')
+
+class _AnchorCollector(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.hrefs = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            for name, value in attrs:
+                if name == 'href' and value:
+                    self.hrefs.append(value)
+                    break
+
+def _hrefs_selectolax(html_content: str) -> List[str]:
+    tree = SelectolaxParser(html_content)
+    return [node.attributes.get('href') or '' for node in tree.css('a[href]')]
+
+def _hrefs_lxml(html_content: str) -> List[str]:
+    # Bytes, so documents with an XML encoding declaration parse too
+    parser = lxml.etree.HTMLParser(encoding='utf-8')
+    root = lxml.html.fromstring(html_content.encode('utf-8'), parser=parser)
+    return [anchor.get('href') or '' for anchor in root.iter('a')]
+
+def _hrefs_html_parser(html_content: str) -> List[str]:
+    collector = _AnchorCollector()
+    collector.feed(html_content)
+    collector.close()
+    return collector.hrefs
+
+BACKENDS: Dict[str, Callable[[str], List[str]]] = {'html.parser': _hrefs_html_parser}
+if lxml is not None:
+    BACKENDS['lxml'] = _hrefs_lxml
+if SelectolaxParser is not None:
+    BACKENDS['selectolax'] = _hrefs_selectolax
+
+# Fastest available backend
+DEFAULT_BACKEND = 'selectolax' if 'selectolax' in BACKENDS else 'lxml' if 'lxml' in BACKENDS else 'html.parser'
+
+def extract_unsubscribe_hrefs(html_content: str, backend: str = DEFAULT_BACKEND) -> List[str]:
+    """
+    Extract unsubscribe links from an HTML body.
+
+    Args:
+        html_content: Decoded HTML
+        backend: Parser from BACKENDS
+
+    Returns:
+        Matching hrefs (http(s) and mailto) in document order, without duplicates
+    """
+    if not html_content or html_content.isspace():
+        return []
+    html_content = clean_html(html_content)
+    try:
+        hrefs = BACKENDS[backend](html_content)
+    except Exception as e:
+        logging.warning(f"Error parsing HTML with {backend}: {e}")
+        return list(dict.fromkeys(UNSUBSCRIBE_URL.findall(html_content)))
+
+    links = {}
+    for href in hrefs:
+        if UNSUBSCRIBE_HREF.search(href):
+            href = href.strip()
+            if href:
+                links[href] = None
+    return list(links)
+
+def extract_unsubscribe_urls(text: str) -> List[str]:
+    """Unsubscribe URLs in a plain text body, in order of appearance, without duplicates."""
+    return list(dict.fromkeys(UNSUBSCRIBE_URL.findall(text)))
+
+def walk_parts(part: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Yield a Gmail message part and all its nested parts, depth first."""
+    yield part
+    for child in part.get('parts') or []:
+        yield from walk_parts(child)
+
+def iter_text_parts(payload: Dict[str, Any]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Yield (mime_type, part) for the inline text parts of a Gmail payload,
+    every text/html part before any other text part. Nothing is decoded here.
+    """
+    deferred = []
+    for part in walk_parts(payload):
+        mime_type = part.get('mimeType', '').lower()
+        if not mime_type.startswith('text/') or part.get('filename') or not part.get('body', {}).get('data'):
+            continue
+        if mime_type == 'text/html':
+            yield mime_type, part
+        else:
+            deferred.append((mime_type, part))
+    yield from deferred
+
+def _b64decode(data: str) -> str:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4)).decode('utf-8', errors='ignore')
+
+def decode_part(part: Dict[str, Any]) -> str:
+    """Decode the base64url body data of a Gmail message part."""
+    return _b64decode(part['body']['data'])
+
+def decode_part_tail(part: Dict[str, Any], max_bytes: int) -> Tuple[str, bool]:
+    """
+    Decode at most about the last `max_bytes` of a part's body.
+
+    Returns:
+        (text, whether it is the whole body); a partial tail starts at a tag
+        boundary so no cut-off anchor is parsed
+    """
+    data = part['body']['data']
+    if max_bytes <= 0 or len(data) * 3 // 4 <= max_bytes:
+        return _b64decode(data), True
+    # Every 4 base64 characters hold 3 bytes; start on a 4-character boundary
+    start = len(data) - -(-max_bytes // 3) * 4
+    start -= start % 4
+    text = _b64decode(data[start:])
+    boundary = text.find('<')
+    return (text[boundary:] if boundary > 0 else text), False
+
+def _scan_text(mime_type: str, text: str) -> List[str]:
+    if mime_type == 'text/html':
+        text = clean_html(text)
+    # Cheap prefilter: without a keyword anywhere there is nothing to parse
+    if not UNSUBSCRIBE_HREF.search(text):
+        return []
+    return extract_unsubscribe_hrefs(text) if mime_type == 'text/html' else extract_unsubscribe_urls(text)
+
+def scan_part(mime_type: str, part: Dict[str, Any], tail_bytes: int) -> List[str]:
+    """Unsubscribe links of one text part, scanning its tail first and the whole body only if that finds nothing."""
+    text, complete = decode_part_tail(part, tail_bytes)
+    links = _scan_text(mime_type, text)
+    if links or complete:
+        return links
+    return _scan_text(mime_type, decode_part(part))
+
+def find_body_unsubscribe_links(payload: Dict[str, Any], tail_bytes: Optional[int] = None) -> List[str]:
+    """
+    Unsubscribe links from the body of a Gmail message fetched in 'full' format.
+
+    Args:
+        payload: Message payload
+        tail_bytes: Bytes at the end of each body scanned before the whole of it;
+            defaults to BODY_SCAN_TAIL_KB, 0 scans whole bodies
+
+    Returns:
+        Links of the first text part that has any (HTML parts are tried first), or []
+    """
+    if tail_bytes is None:
+        tail_bytes = app_config['BODY_SCAN_TAIL_KB'] * 1024
+    for mime_type, part in iter_text_parts(payload):
+        try:
+            links = scan_part(mime_type, part, tail_bytes)
+        except (ValueError, TypeError) as e:
+            logging.warning(f"Error decoding {mime_type} part: {e}")
+            continue
+        if links:
+            return links
+    return []
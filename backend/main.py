@@ -2,21 +2,36 @@ from fastapi import FastAPI, HTTPException, Request, Depends
 from pydantic import BaseModel
 from typing import List, Optional
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.sessions import SessionMiddleware
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
+from contextlib import asynccontextmanager
 import os
 import json
+import asyncio
 
 # Import your existing logic
 # from setup_gmail_service import create_service # No longer used for global service
-from email_fetcher import fetch_promotional_emails, delete_emails_from_sender, get_message_ids_for_sender
-from unsub_process import process_unsubscribe_links
-from extract_unsubscribe import process_email_data
-from db import record_activity, get_user
+from email_fetcher import aiter_promotional_senders, async_delete_emails_from_sender, async_get_message_ids_for_sender, async_find_unsubscribe_links, async_count_messages_for_sender
+from gmail_async import close_http_client
+from async_unsubscribe import process_unsubscribe_links_async, get_unsubscribe_executor, close_unsubscribe_executor
+from http_pool import close_http_pool
+from sender_index import sync_sender_index, get_sender_index
+from db import record_activity, shutdown_activity, close_client
+from user_clients import user_clients
 from auth import router as auth_router
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await close_http_client()
+    await close_unsubscribe_executor()
+    close_http_pool()
+    # Write buffered activity counters before the pool goes away
+    await run_in_threadpool(shutdown_activity)
+    close_client()
+
+app = FastAPI(lifespan=lifespan)
 
 # Add Session Middleware
 # REPLACE 'your-secret-key' with a real secret in .env for production
@@ -50,28 +65,25 @@ app.add_middleware(
 app.include_router(auth_router)
 
 # No global service anymore!
-# Authentication is handled strictly via get_current_user_service dependency.
+# Authentication is handled strictly via get_current_user_client dependency.
 
-# Dependency to get Gmail Service for the current user
-def get_current_user_service(request: Request):
+# Dependency to get the async Gmail client for the current user (cached per user)
+def get_current_user_client(request: Request):
     user = request.session.get('user')
     if not user or not user.get('email'):
         raise HTTPException(status_code=401, detail="Not authenticated")
     
     email = user['email']
-    user_data = get_user(email)
-    
-    if not user_data or 'tokens' not in user_data:
-        raise HTTPException(status_code=401, detail="User tokens not found. Please login again.")
-        
     try:
-        creds = Credentials.from_authorized_user_info(user_data['tokens'])
-        service = build('gmail', 'v1', credentials=creds)
-        return service
+        client = user_clients.get(email)
     except Exception as e:
         print(f"Error rebuilding credentials: {e}")
         raise HTTPException(status_code=401, detail="Invalid credentials. Please login again.")
 
+    if client is None:
+        raise HTTPException(status_code=401, detail="User tokens not found. Please login again.")
+    return client
+
 @app.get("/")
 def read_root(request: Request):
     user = request.session.get('user')
@@ -81,12 +93,37 @@ def read_root(request: Request):
     }
 
 @app.get("/scan")
-def scan_inbox(max_senders: int = 10, service = Depends(get_current_user_service)):
+async def scan_inbox(
+    request: Request,
+    max_senders: int = 10,
+    stream: bool = False,
+    client = Depends(get_current_user_client)
+):
     """
     Triggers the email scan for the logged-in user.
+    Served from the sender index, which only syncs the mailbox changes since the last scan.
+    With `stream=true`, a live scan streams sender records as NDJSON as soon as they resolve.
     """
+    email = request.session['user']['email']
     try:
-        results = fetch_promotional_emails(service, max_senders=max_senders)
+        if stream:
+            async def ndjson():
+                async for msg in aiter_promotional_senders(client, max_senders=max_senders, user=email):
+                    yield json.dumps(msg) + "\n"
+            return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+        results = None
+        try:
+            await sync_sender_index(client, email)
+            index = get_sender_index()
+            if await run_in_threadpool(index.covers, email):
+                results = await run_in_threadpool(index.get_senders, email, max_senders=max_senders)
+            else:
+                print("Sender index does not cover the scan window yet, falling back to live scan")
+        except Exception as e:
+            print(f"Sender index unavailable, falling back to live scan: {e}")
+        if results is None:
+            results = [msg async for msg in aiter_promotional_senders(client, max_senders=max_senders, user=email)]
         return {"count": len(results), "emails": results}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -95,66 +132,60 @@ class UnsubscribeRequest(BaseModel):
     sender_email: str
 
 @app.post("/count_emails")
-def count_emails(
+async def count_emails(
     request: UnsubscribeRequest,
-    service = Depends(get_current_user_service)
+    exact: bool = False,
+    client = Depends(get_current_user_client)
 ):
+    """
+    Counts the emails from a sender. Served from the count cache when fresh, otherwise
+    from Gmail's resultSizeEstimate; `exact=true` pages through the message IDs instead.
+    """
     try:
-        # Use existing utility to find IDs. This is what delete/unsubscribe uses under the hood.
-        # We fetch up to 500 (or some reasonable limit) to give a good estimate or exact count.
-        email_ids = get_message_ids_for_sender(service, request.sender_email, max_results=500)
-        return {"count": len(email_ids), "sender": request.sender_email}
+        count, is_exact = await async_count_messages_for_sender(client, request.sender_email, exact=exact, user=client.user)
+        return {"count": count, "sender": request.sender_email, "exact": is_exact}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/unsubscribe")
-def unsubscribe_sender(
+async def unsubscribe_sender(
     request: UnsubscribeRequest, 
-    service = Depends(get_current_user_service),
+    client = Depends(get_current_user_client),
     req: Request = None # To access session
 ):
     try:
-        # 1. Fetch recent emails to find links
-        messages = fetch_promotional_emails(
-            service, 
-            max_senders=1, 
-            max_emails_to_scan=50, 
-            fetch_full_content=True
-        )
-        
-        # Targeted search
-        email_ids = get_message_ids_for_sender(service, request.sender_email, max_results=10)
+        user_email = req.session.get('user', {}).get('email') if req else None
+
+        # 1. Targeted search for recent emails to find links
+        email_ids = await async_get_message_ids_for_sender(client, request.sender_email, max_results=10)
         
         if not email_ids:
              return {"status": "error", "message": "No emails found from this sender."}
 
-        # Extract links
-        unsub_links = []
-        for msg_id in email_ids:
-            msg = service.users().messages().get(userId='me', id=msg_id, format='full').execute()
-            processed = process_email_data(msg)
-            unsub_links.extend(processed.get('unsubscribe_links', []))
-            if unsub_links: break
+        # 2. Extract links: List-Unsubscribe headers first, bodies only as a fallback
+        found = await async_find_unsubscribe_links(client, email_ids, user=user_email)
+        unsub_links = [link for link in found['links'] if not link.startswith('mailto:')]
         
         if not unsub_links:
+             if found['links']:
+                 return {"status": "error", "message": f"Only a mailto unsubscribe is available: {found['links'][0]}"}
              return {"status": "error", "message": "No unsubscribe links found."}
 
-        # 3. Process
-        result = process_unsubscribe_links(
+        # 3. Process on the shared async executor (one-click POST, then HTTP, then browser)
+        result = await process_unsubscribe_links_async(
             unsub_links=[unsub_links[0]], 
             selected_senders=[request.sender_email],
-            dry_run=False
+            dry_run=False,
+            executor=get_unsubscribe_executor(),
+            # One-click applies to the header's http(s) URI, which sorts first
+            one_click=[found['one_click']]
         )
         
         # Log activity
         try:
-            user_info = service.users().getProfile(userId='me').execute()
-            # or just use req.session['user']['email']
-            current_user_email = user_info.get('emailAddress')
-            
             sender_res = result.get('results', {}).get(request.sender_email, {})
-            if sender_res.get('status') == 'success':
-                record_activity(user_email=current_user_email, unsub_delta=1)
+            if user_email and sender_res.get('status') == 'success':
+                record_activity(user_email=user_email, unsub_delta=1)
         except Exception as db_err:
             print(f"DB Logging Error: {db_err}")
 
@@ -164,48 +195,71 @@ def unsubscribe_sender(
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/delete")
-def delete_sender_emails(
+async def delete_sender_emails(
     request: UnsubscribeRequest, 
-    service = Depends(get_current_user_service)
+    client = Depends(get_current_user_client),
+    req: Request = None,
+    stream: bool = False
 ):
+    """
+    Deletes all emails from the sender.
+    With `stream=true`, progress events (found / deleted / error / done) are sent as NDJSON.
+    """
     print(f"DEBUG: Delete request for {request.sender_email}")
-    try:
-        result = delete_emails_from_sender(service, request.sender_email, dry_run=False)
+
+    async def run_delete(on_progress=None):
+        result = await async_delete_emails_from_sender(client, request.sender_email, dry_run=False, on_progress=on_progress)
         
         # Log activity
         try:
-            user_info = service.users().getProfile(userId='me').execute()
+            user_email = req.session.get('user', {}).get('email') if req else None
+            if not user_email:
+                user_email = (await client.get_profile()).get('emailAddress')
             deleted = result.get('deleted_count', 0)
             if deleted > 0:
-                record_activity(user_email=user_info.get('emailAddress'), deleted_delta=deleted)
+                record_activity(user_email=user_email, deleted_delta=deleted)
         except Exception as db_err:
             print(f"DB Logging Error: {db_err}")
             
         return result
+
+    if stream:
+        async def ndjson():
+            events = asyncio.Queue()
+
+            async def run():
+                try:
+                    await run_delete(events.put_nowait)
+                finally:
+                    events.put_nowait(None)
+
+            task = asyncio.create_task(run())
+            while (event := await events.get()) is not None:
+                yield json.dumps(event) + "\n"
+            await task
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+    try:
+        return await run_delete()
     except Exception as e:
         print(f"DEBUG: Exception in delete: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/unsubscribe_and_delete")
-def unsubscribe_and_delete(
+async def unsubscribe_and_delete(
     request: UnsubscribeRequest, 
-    service = Depends(get_current_user_service),
+    client = Depends(get_current_user_client),
     req: Request = None
 ):
     # We cannot call the endpoint functions directly because they depend on Depends()
-    # But we passed `service` so we can call the helper logic directly or refactor.
-    # To keep it simple, we'll re-implement the orchestration here using the passed service
-    # OR we can just call them if we refactor logic out of the route handler.
-    # Refactoring is safer.
-    
-    # 1. Unsub Logic (Inline for now to avoid Dependency injection mess in direct calls)
-    # Actually, let's just do the sub-calls. `unsubscribe_sender` expects `service` as argument now!
-    unsub_result = unsubscribe_sender(request, service, req)
+    # But we passed `client` so we can call the helper logic directly.
+    # Unsubscribe first: it needs a message from the sender to find the link.
+    unsub_result = await unsubscribe_sender(request, client, req)
     
     # 2. Delete Logic
-    delete_result = delete_sender_emails(request, service)
+    delete_result = await delete_sender_emails(request, client, req)
     
     return {
         "unsubscribe": unsub_result,
         "delete": delete_result
-    }
\ No newline at end of file
+    }
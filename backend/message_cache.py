@@ -0,0 +1,174 @@
+"""
+Cache of Gmail message resources keyed by (user, message_id, format).
+
+Gmail message ids are immutable, so a fetched message can be reused across
+requests and CLI menu iterations. The in-memory tier is an LRU with an
+optional TTL, bounded both by entry count and by the approximate size of the
+cached JSON (full-format messages can be megabytes each); an optional SQLite
+file acts as a second, persistent tier.
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List, Tuple
+
+from config import config as app_config
+
+CacheKey = Tuple[str, str, str]
+
+def format_key(msg_format: str, metadata_headers: Optional[List[str]] = None) -> str:
+    """Cache format component; metadata requests differ by the headers they ask for."""
+    if msg_format == 'metadata' and metadata_headers:
+        return 'metadata:' + ','.join(sorted(h.lower() for h in metadata_headers))
+    return msg_format
+
+class MessageCache:
+    """
+    Thread-safe LRU/TTL cache for Gmail message resources.
+
+    Args:
+        max_entries: Messages kept in memory
+        ttl: Seconds before a cached message expires (None = never)
+        path: Optional SQLite file for the persistent tier
+        max_bytes: Approximate memory budget, measured as the JSON size of the messages (None = unbounded)
+    """
+
+    def __init__(self, max_entries: int = 2000, ttl: Optional[float] = None, path: Optional[str] = None,
+                 max_bytes: Optional[int] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        self._entries: "OrderedDict[CacheKey, Tuple[float, Dict[str, Any], int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        if path:
+            path = os.path.expanduser(path)
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            with self._conn:
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS messages (user TEXT, message_id TEXT, format TEXT, "
+                    "data TEXT, stored_at REAL, PRIMARY KEY (user, message_id, format))"
+                )
+
+    def _expired(self, stored_at: float) -> bool:
+        return bool(self.ttl) and time.time() - stored_at > self.ttl
+
+    def _lookup(self, key: CacheKey) -> Optional[Dict[str, Any]]:
+        """Find a key in memory, then on disk. Caller holds the lock."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            if not self._expired(entry[0]):
+                self._entries.move_to_end(key)
+                return entry[1]
+            self._evict(key)
+
+        if self._conn is not None:
+            row = self._conn.execute(
+                "SELECT data, stored_at FROM messages WHERE user = ? AND message_id = ? AND format = ?", key
+            ).fetchone()
+            if row and not self._expired(row[1]):
+                msg = json.loads(row[0])
+                self._store(key, msg, row[1], len(row[0]))
+                return msg
+        return None
+
+    def _evict(self, key: CacheKey) -> None:
+        """Drop one entry from the memory tier. Caller holds the lock."""
+        self.size -= self._entries.pop(key)[2]
+
+    def _store(self, key: CacheKey, msg: Dict[str, Any], stored_at: float, size: int) -> None:
+        """Insert into the memory tier, evicting the least recently used entries. Caller holds the lock."""
+        if key in self._entries:
+            self._evict(key)
+        if self.max_bytes is not None and size > self.max_bytes:
+            # Would evict everything else and still not fit
+            return
+        self._entries[key] = (stored_at, msg, size)
+        self.size += size
+        while len(self._entries) > self.max_entries or (self.max_bytes is not None and self.size > self.max_bytes):
+            self._evict(next(iter(self._entries)))
+
+    def get(self, user: str, message_id: str, msg_format: str) -> Optional[Dict[str, Any]]:
+        """
+        Return a cached message or None.
+        A cached 'full' message also answers 'metadata' lookups, since it carries every header.
+        """
+        with self._lock:
+            msg = self._lookup((user, message_id, msg_format))
+            if msg is None and msg_format.startswith('metadata'):
+                msg = self._lookup((user, message_id, 'full'))
+            if msg is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            # Callers annotate the messages they get back; keep the cached copy clean
+            return dict(msg)
+
+    def get_many(self, user: str, message_ids: List[str], msg_format: str) -> Dict[str, Dict[str, Any]]:
+        """Return message_id -> message for the cached messages among `message_ids` (see `get`)."""
+        found = {}
+        for message_id in message_ids:
+            msg = self.get(user, message_id, msg_format)
+            if msg is not None:
+                found[message_id] = msg
+        return found
+
+    def put(self, user: str, message_id: str, msg_format: str, msg: Dict[str, Any]) -> None:
+        self.put_many(user, {message_id: msg}, msg_format)
+
+    def put_many(self, user: str, messages: Dict[str, Dict[str, Any]], msg_format: str) -> None:
+        """Cache message_id -> message pairs, writing the SQLite tier in one transaction."""
+        now = time.time()
+        # The serialized size stands in for the message's memory footprint
+        rows = [(message_id, msg, json.dumps(msg)) for message_id, msg in messages.items()]
+        if not rows:
+            return
+        with self._lock:
+            for message_id, msg, data in rows:
+                self._store((user, message_id, msg_format), dict(msg), now, len(data))
+            if self._conn is not None:
+                try:
+                    with self._conn:
+                        self._conn.executemany(
+                            "INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?)",
+                            [(user, message_id, msg_format, data, now) for message_id, _, data in rows]
+                        )
+                except sqlite3.Error as e:
+                    logging.error(f"Failed to persist {len(rows)} cached message(s): {e}")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            self.hits = self.misses = 0
+            if self._conn is not None:
+                with self._conn:
+                    self._conn.execute("DELETE FROM messages")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+            }
+
+message_cache = MessageCache(
+    max_entries=app_config['MESSAGE_CACHE_SIZE'],
+    ttl=app_config['MESSAGE_CACHE_TTL'] or None,
+    path=app_config['MESSAGE_CACHE_PATH'] or None,
+    max_bytes=app_config['MESSAGE_CACHE_MAX_MB'] * 1024 * 1024 or None
+)
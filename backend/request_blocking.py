@@ -0,0 +1,117 @@
+"""
+Route-level request blocking for Playwright unsubscribe pages.
+
+Unsubscribe pages only need their document, scripts, styles and form
+requests. Images, fonts, media and analytics/ad trackers are aborted before
+they hit the network, which keeps pages small and lets them settle instead
+of waiting on trackers that keep the network busy.
+"""
+import logging
+from collections import Counter
+from typing import Optional, Iterable, Set
+from urllib.parse import urlparse
+
+from config import config as app_config
+
+# Analytics, ad and session-recording hosts seen on ESP landing pages; subdomains match too
+TRACKER_HOSTS = {
+    'google-analytics.com', 'googletagmanager.com', 'googleadservices.com', 'googlesyndication.com',
+    'doubleclick.net', 'facebook.net', 'hotjar.com', 'clarity.ms',
+    'bat.bing.com', 'segment.io', 'segment.com', 'mixpanel.com', 'fullstory.com',
+    'newrelic.com', 'nr-data.net', 'quantserve.com', 'scorecardresearch.com', 'adsrvr.org',
+    'criteo.com', 'taboola.com', 'outbrain.com', 'snap.licdn.com', 'ads.linkedin.com',
+}
+
+def _split(value: str) -> Set[str]:
+    return {item.strip().lower() for item in (value or '').split(',') if item.strip()}
+
+def _host_matches(host: str, hosts: Iterable[str]) -> bool:
+    return any(host == pattern or host.endswith('.' + pattern) for pattern in hosts)
+
+class RequestFilter:
+    """
+    Decides which page requests are aborted.
+
+    Args:
+        resource_types: Playwright resource types to block ('image', 'font', 'media'...)
+        deny_hosts: Hosts blocked for every resource type, subdomains included
+        allow_hosts: Hosts never blocked; takes precedence over the other rules
+    """
+
+    def __init__(self, resource_types: Iterable[str], deny_hosts: Iterable[str], allow_hosts: Iterable[str] = ()):
+        self.resource_types = set(resource_types)
+        self.deny_hosts = set(deny_hosts)
+        self.allow_hosts = set(allow_hosts)
+
+    def reason(self, url: str, resource_type: str) -> Optional[str]:
+        """Why a request should be blocked ('tracker' or its resource type), or None to let it through."""
+        host = (urlparse(url).hostname or '').lower()
+        if self.allow_hosts and _host_matches(host, self.allow_hosts):
+            return None
+        if _host_matches(host, self.deny_hosts):
+            return 'tracker'
+        if resource_type in self.resource_types:
+            return resource_type
+        return None
+
+    def _blocked(self, request) -> Optional[str]:
+        # The unsubscribe page itself is never blocked, whatever host it lives on
+        if request.is_navigation_request() and request.frame.parent_frame is None:
+            return None
+        return self.reason(request.url, request.resource_type)
+
+    def install(self, page) -> Counter:
+        """
+        Route every request of a sync Playwright page through the filter.
+
+        Returns:
+            Counter of blocked requests per reason, filled in as the page loads
+        """
+        blocked = Counter()
+
+        def handle(route):
+            reason = self._blocked(route.request)
+            if reason:
+                blocked[reason] += 1
+                route.abort()
+            else:
+                route.continue_()
+
+        page.route('**/*', handle)
+        return blocked
+
+    async def install_async(self, page) -> Counter:
+        """Async API counterpart of `install`."""
+        blocked = Counter()
+
+        async def handle(route):
+            reason = self._blocked(route.request)
+            if reason:
+                blocked[reason] += 1
+                await route.abort()
+            else:
+                await route.continue_()
+
+        await page.route('**/*', handle)
+        return blocked
+
+def log_blocked(url: str, blocked: Counter) -> None:
+    """Report the requests blocked on one page."""
+    if blocked:
+        summary = ', '.join(f"{reason}={count}" for reason, count in sorted(blocked.items()))
+        logging.info(f"Blocked {sum(blocked.values())} request(s) on {url}: {summary}")
+
+_filter: Optional[RequestFilter] = None
+
+def get_request_filter() -> Optional[RequestFilter]:
+    """Filter built from the PLAYWRIGHT_BLOCK_* settings, or None when blocking is disabled."""
+    global _filter
+    if not app_config['PLAYWRIGHT_BLOCK_ENABLED']:
+        return None
+    if _filter is None:
+        _filter = RequestFilter(
+            resource_types=_split(app_config['PLAYWRIGHT_BLOCK_RESOURCES']),
+            deny_hosts=TRACKER_HOSTS | _split(app_config['PLAYWRIGHT_BLOCK_HOSTS']),
+            allow_hosts=_split(app_config['PLAYWRIGHT_ALLOW_HOSTS'])
+        )
+    return _filter
@@ -0,0 +1,403 @@
+"""
+Persistent per-user index of promotional senders.
+
+The first sync lists the promotions category once, back past the age window of
+the live scan; later syncs only apply the delta reported by Gmail's history API
+since the recorded historyId. The async sync runs its SQLite calls in worker
+threads so they never block the event loop.
+"""
+import os
+import sys
+import asyncio
+import sqlite3
+import logging
+import threading
+import datetime
+from typing import List, Dict, Any, Optional, Iterable
+
+import httpx
+
+from config import config as app_config
+from email_fetcher import _parse_sender, _get_headers, aiter_message_id_pages, async_fetch_messages, SCAN_HEADERS
+from extract_unsubscribe import parse_list_unsubscribe
+
+# Everything in promotions; the age filter of the live scan is applied on read
+INDEX_QUERY = "category:promotions -category:updates -category:social -category:forums"
+# Age filter of PROMOTIONS_QUERY, the live scan the index stands in for
+WINDOW_DAYS = 14
+PROMOTIONS_LABEL = 'CATEGORY_PROMOTIONS'
+EXCLUDED_LABELS = {'CATEGORY_UPDATES', 'CATEGORY_SOCIAL', 'CATEGORY_FORUMS', 'TRASH', 'SPAM'}
+METADATA_HEADERS = SCAN_HEADERS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sync_state (
+    user TEXT PRIMARY KEY,
+    history_id TEXT,
+    synced_at TEXT,
+    covered_from INTEGER
+);
+CREATE TABLE IF NOT EXISTS messages (
+    user TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    sender_email TEXT NOT NULL,
+    sender_display TEXT,
+    subject TEXT,
+    date_header TEXT,
+    snippet TEXT,
+    internal_date INTEGER,
+    list_unsubscribe TEXT,
+    list_unsubscribe_post TEXT,
+    PRIMARY KEY (user, message_id)
+);
+CREATE INDEX IF NOT EXISTS idx_messages_sender ON messages (user, sender_email);
+CREATE TABLE IF NOT EXISTS senders (
+    user TEXT NOT NULL,
+    sender_email TEXT NOT NULL,
+    sender_display TEXT,
+    message_count INTEGER NOT NULL,
+    newest_date INTEGER,
+    oldest_date INTEGER,
+    sample_id TEXT,
+    PRIMARY KEY (user, sender_email)
+);
+"""
+
+class SenderIndex:
+    """SQLite-backed store of promotional messages and per-sender aggregates."""
+
+    def __init__(self, path: str):
+        if path != ':memory:':
+            path = os.path.expanduser(path)
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.executescript(SCHEMA)
+            # Indexes created before these columns existed
+            for table, column in (('messages', 'list_unsubscribe TEXT'), ('messages', 'list_unsubscribe_post TEXT'),
+                                  ('sync_state', 'covered_from INTEGER')):
+                try:
+                    self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column}")
+                except sqlite3.OperationalError:
+                    pass
+
+    def get_history_id(self, user: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT history_id FROM sync_state WHERE user = ?", (user,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def get_covered_from(self, user: str) -> Optional[int]:
+        """
+        Internal date (ms) back to which the index holds every promotional
+        message of `user`: 0 when it holds all of them, None before a full sync.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT covered_from FROM sync_state WHERE user = ?", (user,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_history_id(self, user: str, history_id: str, covered_from: Optional[int] = None) -> None:
+        """Record the history id a sync reached; `covered_from` is set by full syncs and kept otherwise."""
+        now = datetime.datetime.now(datetime.UTC).isoformat()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO sync_state (user, history_id, synced_at, covered_from) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(user) DO UPDATE SET history_id = excluded.history_id, synced_at = excluded.synced_at, "
+                "covered_from = COALESCE(excluded.covered_from, sync_state.covered_from)",
+                (user, str(history_id), now, covered_from)
+            )
+
+    def covers(self, user: str, older_than_days: int = WINDOW_DAYS) -> bool:
+        """True when the index holds every promotional message of `user` back past the age cutoff."""
+        covered_from = self.get_covered_from(user)
+        return covered_from is not None and covered_from <= _cutoff(older_than_days)
+
+    def clear(self, user: str) -> None:
+        with self._lock, self._conn:
+            for table in ('sync_state', 'messages', 'senders'):
+                self._conn.execute(f"DELETE FROM {table} WHERE user = ?", (user,))
+
+    def add_messages(self, user: str, messages: Iterable[Dict[str, Any]]) -> int:
+        """
+        Index Gmail messages fetched in 'metadata' format.
+        Messages outside the promotions category are ignored.
+
+        Returns:
+            Number of messages added to the index
+        """
+        rows = []
+        for msg in messages:
+            labels = set(msg.get('labelIds', []))
+            if labels and (PROMOTIONS_LABEL not in labels or labels & EXCLUDED_LABELS):
+                continue
+            headers = _get_headers(msg)
+            sender_name, sender_email = _parse_sender(headers.get('from', ''))
+            if not sender_email:
+                continue
+            rows.append((
+                user, msg['id'], sender_email, sender_name,
+                headers.get('subject', ''), headers.get('date', ''),
+                msg.get('snippet', ''), int(msg.get('internalDate', 0)),
+                headers.get('list-unsubscribe', ''), headers.get('list-unsubscribe-post', '')
+            ))
+        if not rows:
+            return 0
+
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO messages (user, message_id, sender_email, sender_display, "
+                "subject, date_header, snippet, internal_date, list_unsubscribe, list_unsubscribe_post) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            self._refresh_senders(user, {row[2] for row in rows})
+        return len(rows)
+
+    def remove_messages(self, user: str, message_ids: Iterable[str]) -> int:
+        """
+        Drop messages from the index.
+
+        Returns:
+            Number of indexed messages that were removed
+        """
+        message_ids = list(message_ids)
+        if not message_ids:
+            return 0
+
+        with self._lock, self._conn:
+            affected = set()
+            removed = 0
+            for i in range(0, len(message_ids), 500):
+                chunk = message_ids[i:i + 500]
+                placeholders = ','.join('?' * len(chunk))
+                affected.update(row[0] for row in self._conn.execute(
+                    f"SELECT DISTINCT sender_email FROM messages WHERE user = ? AND message_id IN ({placeholders})",
+                    (user, *chunk)
+                ))
+                removed += self._conn.execute(
+                    f"DELETE FROM messages WHERE user = ? AND message_id IN ({placeholders})",
+                    (user, *chunk)
+                ).rowcount
+            self._refresh_senders(user, affected)
+        return removed
+
+    def get_message_senders(self, user: str, message_ids: Iterable[str]) -> Dict[str, str]:
+        """Return message_id -> sender email for the indexed messages among `message_ids`."""
+        message_ids = list(message_ids)
+        senders = {}
+        with self._lock:
+            for i in range(0, len(message_ids), 500):
+                chunk = message_ids[i:i + 500]
+                placeholders = ','.join('?' * len(chunk))
+                senders.update(self._conn.execute(
+                    f"SELECT message_id, sender_email FROM messages WHERE user = ? AND message_id IN ({placeholders})",
+                    (user, *chunk)
+                ).fetchall())
+        return senders
+
+    def _refresh_senders(self, user: str, sender_emails: Iterable[str]) -> None:
+        """Recompute the aggregate rows of the given senders. Caller holds the lock."""
+        for sender_email in sender_emails:
+            count, newest, oldest = self._conn.execute(
+                "SELECT COUNT(*), MAX(internal_date), MIN(internal_date) FROM messages "
+                "WHERE user = ? AND sender_email = ?",
+                (user, sender_email)
+            ).fetchone()
+            if not count:
+                self._conn.execute(
+                    "DELETE FROM senders WHERE user = ? AND sender_email = ?", (user, sender_email)
+                )
+                continue
+            sample_id, sender_display = self._conn.execute(
+                "SELECT message_id, sender_display FROM messages WHERE user = ? AND sender_email = ? "
+                "ORDER BY internal_date DESC LIMIT 1",
+                (user, sender_email)
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO senders (user, sender_email, sender_display, message_count, "
+                "newest_date, oldest_date, sample_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (user, sender_email, sender_display, count, newest, oldest, sample_id)
+            )
+
+    def get_senders(self, user: str, max_senders: int = 20, older_than_days: int = WINDOW_DAYS) -> List[Dict[str, Any]]:
+        """
+        Return indexed senders that have mail older than `older_than_days`,
+        newest first, shaped like the records of `iter_promotional_senders`.
+
+        Check `covers` first: senders are only complete once a full sync
+        reached past the cutoff. When the full sync stopped before the oldest
+        promotional message, message_count and oldest_date only describe the
+        indexed window and are reported as None.
+        """
+        cutoff = _cutoff(older_than_days)
+        complete = self.get_covered_from(user) == 0
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT s.sender_email, s.sender_display, s.message_count, s.newest_date, s.oldest_date, "
+                "m.message_id, m.subject, m.date_header, m.snippet, m.list_unsubscribe, m.list_unsubscribe_post "
+                "FROM senders s JOIN messages m ON m.user = s.user AND m.message_id = s.sample_id "
+                "WHERE s.user = ? AND s.oldest_date <= ? "
+                "ORDER BY s.newest_date DESC LIMIT ?",
+                (user, cutoff, max_senders)
+            ).fetchall()
+
+        senders = []
+        for (sender_email, sender_display, count, newest, oldest,
+             message_id, subject, date_header, snippet, list_unsubscribe, list_unsubscribe_post) in rows:
+            unsubscribe = parse_list_unsubscribe({
+                'list-unsubscribe': list_unsubscribe or '',
+                'list-unsubscribe-post': list_unsubscribe_post or '',
+            })
+            senders.append({
+                'id': message_id,
+                'snippet': snippet,
+                'payload': {'headers': [
+                    {'name': 'From', 'value': f"{sender_display} <{sender_email}>"},
+                    {'name': 'Subject', 'value': subject},
+                    {'name': 'Date', 'value': date_header},
+                ]},
+                'sender_email': sender_email,
+                'sender_display': sender_display,
+                'message_count': count if complete else None,
+                'newest_date': newest,
+                'oldest_date': oldest if complete else None,
+                'can_unsubscribe': bool(unsubscribe['links']),
+                'one_click_unsubscribe': unsubscribe['one_click'],
+            })
+        return senders
+
+def _cutoff(older_than_days: int) -> int:
+    """Internal date (ms) of the age cutoff."""
+    return int((datetime.datetime.now(datetime.UTC)
+                - datetime.timedelta(days=older_than_days)).timestamp() * 1000)
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_sender_index() -> SenderIndex:
+    """Return the process-wide sender index, opening it on first use."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = SenderIndex(app_config['SENDER_INDEX_PATH'])
+        return _index
+
+async def _full_sync(client, user: str, index: SenderIndex, max_messages: int, older_than_days: int) -> Dict[str, Any]:
+    """
+    Rebuild the index of `user`. Everything newer than the age cutoff is
+    indexed, since those messages age into the window later, plus up to
+    `max_messages` older ones, the window the live scan reads.
+    """
+    # Record the history id first so changes made during the sync are replayed next time
+    history_id = (await client.get_profile())['historyId']
+    await asyncio.to_thread(index.clear, user)
+
+    cutoff = _cutoff(older_than_days)
+    added = 0
+    past_cutoff = 0
+    oldest = None
+    complete = True
+    # Listing is newest first; stop once the budget past the cutoff is spent
+    async for page_ids in aiter_message_id_pages(client, INDEX_QUERY, sys.maxsize, page_size=500):
+        fetched, _ = await async_fetch_messages(client, page_ids, msg_format='metadata', metadata_headers=METADATA_HEADERS)
+        added += await asyncio.to_thread(index.add_messages, user, list(fetched.values()))
+        for msg in fetched.values():
+            date = int(msg.get('internalDate', 0))
+            oldest = date if oldest is None else min(oldest, date)
+            if date <= cutoff:
+                past_cutoff += 1
+        if past_cutoff >= max_messages:
+            complete = False
+            break
+
+    covered_from = 0 if complete or oldest is None else oldest
+    await asyncio.to_thread(index.set_history_id, user, history_id, covered_from)
+    return {'mode': 'full', 'added': added, 'removed': 0}
+
+async def _apply_history(client, user: str, index: SenderIndex, start_history_id: str) -> Dict[str, Any]:
+    # Message id -> True to (re-)add, False to remove; the latest change wins
+    changes: Dict[str, bool] = {}
+    history_id = start_history_id
+    page_token = None
+
+    while True:
+        response = await client.list_history(
+            start_history_id,
+            history_types=['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved'],
+            label_id=PROMOTIONS_LABEL,
+            page_token=page_token
+        )
+
+        for record in response.get('history', []):
+            for item in record.get('messagesAdded', []):
+                changes[item['message']['id']] = True
+            for item in record.get('messagesDeleted', []):
+                changes[item['message']['id']] = False
+            for item in record.get('labelsAdded', []):
+                labels = set(item.get('labelIds', []))
+                if labels & EXCLUDED_LABELS:
+                    changes[item['message']['id']] = False
+                elif PROMOTIONS_LABEL in labels:
+                    changes[item['message']['id']] = True
+            for item in record.get('labelsRemoved', []):
+                labels = set(item.get('labelIds', []))
+                if PROMOTIONS_LABEL in labels:
+                    changes[item['message']['id']] = False
+                elif labels & EXCLUDED_LABELS:
+                    # Restored from trash or spam, or moved out of another category:
+                    # a candidate again if its remaining labels still qualify
+                    changes[item['message']['id']] = True
+
+        history_id = response.get('historyId', history_id)
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            break
+
+    removed = await asyncio.to_thread(index.remove_messages, user, [msg_id for msg_id, add in changes.items() if not add])
+
+    # Re-read labels of the added messages (uncached, labels are mutable);
+    # the index drops those no longer in promotions
+    pending = [msg_id for msg_id, add in changes.items() if add]
+    added = 0
+    if pending:
+        fetched, _ = await async_fetch_messages(client, pending, msg_format='metadata', metadata_headers=METADATA_HEADERS)
+        added = await asyncio.to_thread(index.add_messages, user, list(fetched.values()))
+
+    await asyncio.to_thread(index.set_history_id, user, history_id)
+    return {'mode': 'incremental', 'added': added, 'removed': removed}
+
+async def sync_sender_index(client, user: str, index: Optional[SenderIndex] = None, max_messages: Optional[int] = None, older_than_days: int = WINDOW_DAYS) -> Dict[str, Any]:
+    """
+    Bring the sender index of `user` up to date.
+
+    Uses the history API when a previous sync recorded a historyId and covered
+    the age window, and falls back to a full listing otherwise or when Gmail
+    no longer has the historyId.
+
+    Args:
+        client: gmail_async.AsyncGmailClient of the mailbox owner
+        user: Email address of the mailbox owner (index key)
+        index: Index to update, defaults to the process-wide one
+        max_messages: Messages older than the age cutoff indexed by a full sync
+        older_than_days: Age cutoff of the scans the index answers
+
+    Returns:
+        Dictionary with the sync mode and the number of added/removed messages
+    """
+    index = index or get_sender_index()
+    max_messages = max_messages or app_config['SENDER_INDEX_MAX_SYNC']
+
+    history_id = await asyncio.to_thread(index.get_history_id, user)
+    if history_id and await asyncio.to_thread(index.covers, user, older_than_days):
+        try:
+            return await _apply_history(client, user, index, history_id)
+        except httpx.HTTPStatusError as e:
+            # 404 means the start history id is too old; rebuild from scratch
+            if e.response.status_code != 404:
+                raise
+            logging.info(f"History {history_id} expired for {user}, running full sender index sync")
+
+    return await _full_sync(client, user, index, max_messages, older_than_days)
@@ -0,0 +1,9 @@
+"""
+Test setup: the backend modules are imported flat, as the app and the CLI do.
+The tests use in-process fakes of the Gmail clients and stores; they need the
+packages of requirements.txt plus pytest, and never reach Gmail.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
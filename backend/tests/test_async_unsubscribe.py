@@ -0,0 +1,70 @@
+import asyncio
+import threading
+
+import httpx
+
+import async_unsubscribe
+from async_unsubscribe import AsyncRequestsStrategy
+
+PAGE = '<form action="/confirm" method="post"><input name="id" value="7"><button>Unsubscribe</button></form>'
+
+def test_requests_strategy_parses_the_page_once_off_the_event_loop(monkeypatch):
+    loop_thread = threading.get_ident()
+    parses = []
+    parse = async_unsubscribe._parse_unsubscribe_page
+
+    def recording_parse(html_content, url):
+        parses.append((url, threading.get_ident() != loop_thread))
+        return parse(html_content, url)
+
+    def handler(request):
+        if request.url.path == '/confirm':
+            return httpx.Response(200, text='ok')
+        return httpx.Response(200, text=PAGE)
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http:
+            return await AsyncRequestsStrategy(executor=None).unsubscribe('https://esp.com/u', http)
+
+    monkeypatch.setattr(async_unsubscribe, '_parse_unsubscribe_page', recording_parse)
+
+    assert asyncio.run(run()) == (True, 'Form submitted successfully')
+    assert parses == [('https://esp.com/u', True)]
+
+def test_confirmation_page_has_no_forms_to_submit():
+    assert async_unsubscribe._parse_unsubscribe_page('<p>You have been successfully unsubscribed.</p>', 'https://esp.com/u') == (True, [])
+    confirmed, forms = async_unsubscribe._parse_unsubscribe_page(PAGE, 'https://esp.com/u')
+    assert not confirmed and forms and forms[0][:2] == ('post', 'https://esp.com/confirm')
+
+class SlowStrategy:
+    name = 'requests'
+
+    def __init__(self, executor):
+        self.executor = executor
+        self.running = {}
+        self.peak = {}
+
+    async def unsubscribe(self, link, http, attempt=None):
+        domain = link.split('/')[2]
+        self.running[domain] = self.running.get(domain, 0) + 1
+        self.peak[domain] = max(self.peak.get(domain, 0), self.running[domain])
+        await asyncio.sleep(0.01)
+        self.running[domain] -= 1
+        return True, 'ok'
+
+def test_domain_semaphores_are_dropped_once_idle():
+    async def run():
+        executor = async_unsubscribe.AsyncUnsubscribeExecutor(max_concurrency=10, per_domain=2, deadline=5, strategies=[SlowStrategy])
+        executor.routes = None
+        links = [f'https://{domain}/u{i}' for domain in ('a.com', 'b.com') for i in range(5)]
+        try:
+            results = [result async for result in executor.iter_results(links, links)]
+            return executor, results
+        finally:
+            await executor.close()
+
+    executor, results = asyncio.run(run())
+
+    assert len(results) == 10 and all(result['status'] == 'success' for _, result in results)
+    assert executor.strategies[0].peak == {'a.com': 2, 'b.com': 2}
+    assert executor._domains == {}
@@ -0,0 +1,109 @@
+import threading
+
+import pytest
+
+import browser_pool as browser_pool_module
+from browser_pool import BrowserPool
+
+class FakeContext:
+    def __init__(self, browser):
+        self.browser = browser
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+class FakeBrowser:
+    def __init__(self):
+        self.connected = True
+        self.thread = threading.get_ident()
+        self.contexts = []
+
+    def is_connected(self):
+        return self.connected
+
+    def new_context(self, **options):
+        # Playwright's sync API only works on the thread that started it
+        assert threading.get_ident() == self.thread
+        context = FakeContext(self)
+        self.contexts.append(context)
+        return context
+
+    def close(self):
+        self.connected = False
+
+class FakePlaywright:
+    def __init__(self):
+        self.browsers = []
+        self.chromium = self
+
+    def start(self):
+        return self
+
+    def launch(self, **options):
+        browser = FakeBrowser()
+        self.browsers.append(browser)
+        return browser
+
+    def stop(self):
+        pass
+
+@pytest.fixture
+def playwright(monkeypatch):
+    fake = FakePlaywright()
+    monkeypatch.setattr(browser_pool_module, 'sync_playwright', lambda: fake)
+    return fake
+
+@pytest.fixture
+def pool(playwright):
+    pool = BrowserPool(size=1, max_uses=3)
+    yield pool
+    pool.shutdown()
+
+def test_jobs_share_a_browser_with_fresh_contexts(pool, playwright):
+    contexts = [pool.run(lambda context: context, timeout=5) for _ in range(2)]
+
+    assert len(playwright.browsers) == 1
+    assert contexts[0] is not contexts[1]
+    assert all(context.closed for context in contexts)
+    assert pool.stats()['jobs'] == 2 and pool.stats()['launched'] == 1
+
+def test_browser_is_recycled_after_max_uses(pool, playwright):
+    for _ in range(4):
+        pool.run(lambda context: None, timeout=5)
+
+    assert len(playwright.browsers) == 2
+    assert not playwright.browsers[0].connected
+    assert pool.stats()['recycled'] == 1
+
+def test_crashed_browser_is_relaunched(pool, playwright):
+    def crash(context):
+        context.browser.connected = False
+        raise RuntimeError('Target closed')
+
+    with pytest.raises(RuntimeError, match='Target closed'):
+        pool.run(crash, timeout=5)
+    assert pool.run(lambda context: 'ok', timeout=5) == 'ok'
+
+    assert len(playwright.browsers) == 2
+    assert pool.stats()['crashed'] == 1
+
+def test_job_errors_keep_a_healthy_browser(pool, playwright):
+    def fail(context):
+        raise ValueError('no form')
+
+    with pytest.raises(ValueError):
+        pool.run(fail, timeout=5)
+    pool.run(lambda context: None, timeout=5)
+
+    assert len(playwright.browsers) == 1
+
+def test_shut_down_pool_rejects_jobs(playwright):
+    pool = BrowserPool(size=2)
+    pool.run(lambda context: None, timeout=5)
+
+    pool.shutdown()
+
+    assert not playwright.browsers[0].connected
+    with pytest.raises(RuntimeError):
+        pool.run(lambda context: None)
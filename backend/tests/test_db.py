@@ -0,0 +1,146 @@
+import threading
+
+import pytest
+
+import db
+from user_store import MemoryUserStore, SQLiteUserStore
+
+class FlakyStore(MemoryUserStore):
+    """Memory store whose activity writes fail for the users in `failing`."""
+
+    def __init__(self):
+        super().__init__()
+        self.failing = set()
+        self.writes = []
+
+    def apply_activity(self, batch):
+        self.writes.append(dict(batch))
+        failed = [email for email in batch if email in self.failing]
+        super().apply_activity({email: counts for email, counts in batch.items() if email not in self.failing})
+        return failed
+
+@pytest.fixture
+def store(monkeypatch):
+    store = FlakyStore()
+    db.set_store(store)
+    db._pending_activity.clear()
+    db._user_cache.clear()
+    # Flushes are driven by the tests, not the background thread
+    monkeypatch.setattr(db, '_ensure_activity_flusher', lambda: None)
+    yield store
+    db._pending_activity.clear()
+    db._user_cache.clear()
+    db.set_store(None)
+
+def test_increments_are_merged_per_user(store):
+    db.record_activity('a@x.com', unsub_delta=1)
+    db.record_activity('a@x.com', unsub_delta=1, deleted_delta=5)
+    db.record_activity('b@x.com', deleted_delta=3)
+
+    assert db.flush_activity() == 2
+    assert store.writes == [{'a@x.com': (2, 5), 'b@x.com': (0, 3)}]
+    assert db.flush_activity() == 0
+
+def test_failed_users_are_requeued_for_the_next_flush(store):
+    store.failing = {'b@x.com'}
+    db.record_activity('a@x.com', unsub_delta=1)
+    db.record_activity('b@x.com', deleted_delta=3)
+
+    assert db.flush_activity() == 1
+    assert db._pending_activity == {'b@x.com': [0, 3]}
+
+    # New increments merge with the ones put back
+    db.record_activity('b@x.com', deleted_delta=2)
+    store.failing = set()
+    assert db.flush_activity() == 1
+    assert store.writes[-1] == {'b@x.com': (0, 5)}
+    assert store.get_user('b@x.com')['deleted_count'] == 5
+    assert store.get_user('a@x.com')['unsubs_count'] == 1
+
+def test_flush_invalidates_cached_users(store):
+    store.apply_activity({'a@x.com': (0, 0)})
+    assert db.get_user('a@x.com')['unsubs_count'] == 0
+
+    db.record_activity('a@x.com', unsub_delta=4)
+    db.flush_activity()
+
+    assert db.get_user('a@x.com')['unsubs_count'] == 4
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def user_store(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryUserStore()
+    return SQLiteUserStore(str(tmp_path / 'users.db'))
+
+def test_store_round_trip(user_store):
+    assert user_store.get_user('a@x.com') is None
+
+    assert user_store.save_user({'email': 'a@x.com', 'name': 'A', 'picture': 'a.png'}, {'token': 't'})
+    user_store.update_onboarding('a@x.com', True)
+    assert user_store.apply_activity({'a@x.com': (1, 2), 'b@x.com': (0, 3)}) == []
+    user_store.save_user({'email': 'a@x.com', 'name': 'A2'}, {'token': 't2'})
+
+    user = user_store.get_user('a@x.com')
+    assert (user['name'], user['tokens'], user['hasOnboarded']) == ('A2', {'token': 't2'}, True)
+    assert (user['unsubs_count'], user['deleted_count']) == (1, 2)
+    # Users created by activity alone have counters but no profile
+    activity_only = user_store.get_user('b@x.com')
+    assert activity_only['deleted_count'] == 3 and 'tokens' not in activity_only
+
+class SlowStore(MemoryUserStore):
+    """Memory store whose reads block until released, counting them."""
+
+    def __init__(self):
+        super().__init__()
+        self.reads = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def get_user(self, email):
+        self.reads += 1
+        self.started.set()
+        self.release.wait(5)
+        return super().get_user(email)
+
+@pytest.fixture
+def slow_store():
+    store = SlowStore()
+    store.apply_activity({'a@x.com': (1, 0)})
+    db.set_store(store)
+    db._user_cache.clear()
+    yield store
+    store.release.set()
+    db._user_cache.clear()
+    db.set_store(None)
+
+def test_concurrent_misses_share_one_read(slow_store):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(db.get_user('a@x.com'))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    slow_store.started.wait(5)
+    slow_store.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert slow_store.reads == 1
+    assert [user['unsubs_count'] for user in results] == [1] * 5
+
+def test_invalidation_during_a_load_is_not_cached_and_not_kept(slow_store):
+    loader = threading.Thread(target=db.get_user, args=('a@x.com',))
+    loader.start()
+    slow_store.started.wait(5)
+    db.invalidate_user('a@x.com')
+    slow_store.release.set()
+    loader.join(5)
+
+    assert 'a@x.com' not in db._user_cache
+    assert db._user_generations == {}
+
+def test_invalidations_leave_no_state_behind(slow_store):
+    slow_store.release.set()
+    for i in range(50):
+        db.get_user(f'user{i}@x.com')
+        db.invalidate_user(f'user{i}@x.com')
+
+    assert db._user_cache == {} and db._user_generations == {}
@@ -0,0 +1,88 @@
+from types import SimpleNamespace
+
+import pytest
+
+import domain_routes
+from domain_routes import DomainRoutes, domain_of
+
+DAY = 86400
+STRATEGIES = [SimpleNamespace(name=name) for name in ('one_click', 'requests', 'playwright')]
+LINK = 'https://www.shop.com/unsubscribe?u=1'
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(domain_routes.time, 'time', clock)
+    return clock
+
+@pytest.fixture
+def routes(clock):
+    routes = DomainRoutes(':memory:', half_life_days=14, min_attempts=2, min_success_rate=0.5)
+    yield routes
+    routes.close()
+
+def names(strategies):
+    return [strategy.name for strategy in strategies]
+
+def record(routes, tier, success, elapsed=1.0, times=2):
+    for _ in range(times):
+        routes.record('shop.com', tier, success, elapsed)
+
+def test_domain_key_drops_www_and_case():
+    assert domain_of('https://WWW.Shop.com/u') == 'shop.com'
+    assert domain_of('mailto:unsub@shop.com') == ''
+
+def test_unknown_domain_keeps_cost_order(routes):
+    assert names(routes.order(LINK, STRATEGIES)) == ['one_click', 'requests', 'playwright']
+
+def test_working_tiers_first_and_failing_last(routes):
+    record(routes, 'one_click', False)
+    record(routes, 'playwright', True, elapsed=4.0)
+
+    assert names(routes.order(LINK, STRATEGIES)) == ['playwright', 'requests', 'one_click']
+
+def test_working_tiers_sorted_by_median_latency(routes):
+    record(routes, 'requests', True, elapsed=3.0)
+    record(routes, 'playwright', True, elapsed=0.5)
+
+    assert names(routes.order(LINK, STRATEGIES)) == ['playwright', 'requests', 'one_click']
+
+def test_single_outcome_is_not_trusted(routes):
+    record(routes, 'playwright', True, times=1)
+
+    assert names(routes.order(LINK, STRATEGIES)) == ['one_click', 'requests', 'playwright']
+
+def test_outcomes_decay_back_to_cost_order(routes, clock):
+    record(routes, 'one_click', False, times=3)
+    record(routes, 'playwright', True, times=3)
+    assert names(routes.order(LINK, STRATEGIES)) == ['playwright', 'requests', 'one_click']
+
+    # One half-life: 3 attempts count as 1.5, below min_attempts
+    clock.now += 14 * DAY
+    assert routes.stats('shop.com')['playwright']['attempts'] == pytest.approx(1.5)
+    assert names(routes.order(LINK, STRATEGIES)) == ['one_click', 'requests', 'playwright']
+
+def test_new_outcomes_outweigh_decayed_ones(routes, clock):
+    record(routes, 'requests', True, times=4)
+    clock.now += 28 * DAY
+    record(routes, 'requests', False, times=3)
+
+    stats = routes.stats('shop.com')['requests']
+    # 4 successes decayed to 1, then 3 failures: 1 success in 4 attempts
+    assert stats['attempts'] == pytest.approx(4.0)
+    assert stats['success_rate'] == pytest.approx(0.25)
+    assert names(routes.order(LINK, STRATEGIES))[-1] == 'requests'
+
+def test_prune_drops_decayed_rows(routes, clock):
+    record(routes, 'requests', True, times=1)
+    clock.now += 14 * DAY * 6
+
+    assert routes.prune() == 1
+    assert routes.stats('shop.com') == {}
@@ -0,0 +1,174 @@
+import re
+import asyncio
+import threading
+
+import email_fetcher
+from email_fetcher import _plan_sender_queries, _sender_query, split_by_sender, delete_senders_pipelined, async_fetch_messages
+from message_cache import MessageCache
+
+def test_plan_packs_senders_under_the_query_limit():
+    senders = [f'sender{i}@shop{i}.com' for i in range(20)]
+
+    groups = _plan_sender_queries(senders, max_length=120)
+
+    assert [sender for group in groups for sender in group] == senders
+    assert len(groups) > 1
+    assert all(len(_sender_query(group)) <= 120 for group in groups)
+
+def test_plan_keeps_an_oversized_sender_on_its_own():
+    long_sender = 'a' * 200 + '@shop.com'
+
+    groups = _plan_sender_queries(['x@shop.com', long_sender, 'y@shop.com'], max_length=100)
+
+    assert groups == [['x@shop.com'], [long_sender], ['y@shop.com']]
+
+def test_plan_single_query_when_everything_fits():
+    assert _plan_sender_queries(['a@x.com', 'b@y.com'], max_length=1500) == [['a@x.com', 'b@y.com']]
+    assert _sender_query(['a@x.com', 'b@y.com']) == 'from:(a@x.com OR b@y.com)'
+    assert _sender_query(['a@x.com']) == 'from:a@x.com'
+    assert _plan_sender_queries([], max_length=1500) == []
+
+def test_split_by_sender_matches_addresses_case_insensitively():
+    group_by_address = {'news@shop.com': 'News@Shop.com', 'deals@store.com': 'deals@store.com'}
+    senders_by_id = {
+        'm1': 'news@shop.com',
+        'm2': 'DEALS@store.com',
+        'm3': 'NEWS@SHOP.COM',
+        # Matched the `from:` query through its display name only
+        'm4': 'someone@else.com',
+    }
+
+    by_sender = split_by_sender(['m1', 'm2', 'm3', 'm4', 'm5'], senders_by_id, group_by_address)
+
+    assert by_sender == {'News@Shop.com': ['m1', 'm3'], 'deals@store.com': ['m2']}
+
+class FakeGmail:
+    """
+    Async Gmail client over an in-memory mailbox of (id, From header) pairs.
+    A `from:` query matches the whole header, display name included, like Gmail.
+    """
+
+    def __init__(self, mailbox, fail=lambda query: False):
+        self.mailbox = dict(mailbox)
+        self.fail = fail
+        self.queries = []
+        self.deleted_batches = []
+        self.user = None
+
+    async def list_messages(self, q=None, max_results=100, page_token=None, fields=None):
+        self.queries.append(q)
+        if self.fail(q):
+            raise RuntimeError(f'cannot list {q}')
+        senders = re.findall(r'[\w.]+@[\w.]+', q)
+        ids = [msg_id for msg_id, header in self.mailbox.items() if any(sender in header for sender in senders)]
+        start = int(page_token or 0)
+        response = {'messages': [{'id': msg_id} for msg_id in ids[start:start + max_results]]}
+        if start + max_results < len(ids):
+            response['nextPageToken'] = str(start + max_results)
+        return response
+
+    async def get_messages(self, message_ids, msg_format='metadata', metadata_headers=None):
+        return {
+            msg_id: {'id': msg_id, 'payload': {'headers': [{'name': 'From', 'value': self.mailbox[msg_id]}]}}
+            for msg_id in message_ids
+        }, {}
+
+    async def batch_delete(self, message_ids):
+        self.deleted_batches.append(list(message_ids))
+        for msg_id in message_ids:
+            del self.mailbox[msg_id]
+
+def mail(prefix, sender, count):
+    return [(f'{prefix}{i}', sender) for i in range(count)]
+
+def test_heavy_sender_does_not_starve_the_others():
+    # Newest first: the heavy sender fills the first pages of the combined listing
+    client = FakeGmail(mail('h', 'heavy@x.com', 30) + mail('l', 'light@y.com', 3))
+
+    results = asyncio.run(delete_senders_pipelined(client, ['heavy@x.com', 'light@y.com'], max_messages=10, dry_run=True))
+
+    assert results['heavy@x.com']['deleted_count'] == 10
+    assert results['light@y.com']['deleted_count'] == 3
+    assert client.queries[-1] == 'from:light@y.com'
+
+def test_display_name_matches_are_not_deleted():
+    client = FakeGmail(mail('n', 'news@shop.com', 2) + [('spoof', '"news@shop.com" <other@evil.com>')] + mail('d', 'deals@store.com', 1))
+
+    results = asyncio.run(delete_senders_pipelined(client, ['news@shop.com', 'deals@store.com']))
+
+    assert results['news@shop.com']['deleted_count'] == 2
+    assert list(client.mailbox) == ['spoof']
+
+def test_deletes_in_batches_and_reports_progress():
+    client = FakeGmail(mail('a', 'a@x.com', 5))
+    events = []
+
+    results = asyncio.run(delete_senders_pipelined(client, ['a@x.com'], batch_size=2, on_progress=events.append))
+
+    assert sorted(len(batch) for batch in client.deleted_batches) == [1, 2, 2]
+    assert results['a@x.com']['success'] and results['a@x.com']['deleted_count'] == 5
+    assert [event['type'] for event in events].count('deleted') == 3
+    assert events[-1]['type'] == 'done'
+
+def test_dry_run_only_counts():
+    client = FakeGmail(mail('a', 'a@x.com', 3) + mail('b', 'b@y.com', 2))
+
+    results = asyncio.run(delete_senders_pipelined(client, ['a@x.com', 'b@y.com'], dry_run=True))
+
+    assert {sender: result['deleted_count'] for sender, result in results.items()} == {'a@x.com': 3, 'b@y.com': 2}
+    assert results['a@x.com']['message'] == 'Would delete 3 messages from a@x.com (dry run)'
+    assert client.deleted_batches == []
+
+def test_failed_combined_query_falls_back_per_sender():
+    client = FakeGmail(mail('h', 'heavy@x.com', 3) + mail('l', 'light@y.com', 3), fail=lambda q: ' OR ' in q)
+
+    results = asyncio.run(delete_senders_pipelined(client, ['heavy@x.com', 'light@y.com'], dry_run=True))
+
+    assert {sender: result['deleted_count'] for sender, result in results.items()} == {'heavy@x.com': 3, 'light@y.com': 3}
+    assert all(result['success'] for result in results.values())
+
+def test_sender_that_cannot_be_listed_is_reported_alone():
+    client = FakeGmail(mail('h', 'heavy@x.com', 3) + mail('l', 'light@y.com', 3), fail=lambda q: 'heavy' in q)
+
+    results = asyncio.run(delete_senders_pipelined(client, ['heavy@x.com', 'light@y.com'], dry_run=True))
+
+    assert not results['heavy@x.com']['success']
+    assert results['heavy@x.com']['message'] == 'Could not list messages from heavy@x.com'
+    assert results['light@y.com']['success'] and results['light@y.com']['deleted_count'] == 3
+
+def test_failed_requery_reports_what_was_already_deleted():
+    # The combined query fills its cap with heavy@x.com; only the re-query of light@y.com fails
+    client = FakeGmail(mail('h', 'heavy@x.com', 5) + mail('l', 'light@y.com', 3), fail=lambda q: ' OR ' not in q and 'light' in q)
+
+    results = asyncio.run(delete_senders_pipelined(client, ['heavy@x.com', 'light@y.com'], max_messages=3))
+
+    light = results['light@y.com']
+    assert not light['success'] and light['partial'] and light['deleted_count'] == 1
+    assert light['message'] == f"Deleted 1 messages from light@y.com before an error: {light['errors'][0]}"
+    assert 'cannot list' in light['errors'][0]
+    assert results['heavy@x.com']['success'] and not results['heavy@x.com']['partial']
+
+def test_fetch_reads_and_writes_the_cache_off_the_event_loop(monkeypatch):
+    loop_thread = threading.get_ident()
+    calls = []
+
+    class RecordingCache(MessageCache):
+        def get_many(self, *args):
+            calls.append(('get_many', threading.get_ident() != loop_thread))
+            return super().get_many(*args)
+
+        def put_many(self, *args):
+            calls.append(('put_many', threading.get_ident() != loop_thread))
+            return super().put_many(*args)
+
+    cache = RecordingCache()
+    cache.put('me', 'm1', 'full', {'id': 'm1', 'payload': {}})
+    calls.clear()
+    monkeypatch.setattr(email_fetcher, 'message_cache', cache)
+    client = FakeGmail(mail('m', 'news@shop.com', 3))
+
+    fetched, errors = asyncio.run(async_fetch_messages(client, ['m0', 'm1', 'm2'], 'full', user='me'))
+
+    assert sorted(fetched) == ['m0', 'm1', 'm2'] and fetched['m1'] == {'id': 'm1', 'payload': {}}
+    assert calls == [('get_many', True), ('put_many', True)]
+    assert cache.get('me', 'm2', 'full')['id'] == 'm2'
@@ -0,0 +1,30 @@
+from extract_unsubscribe import parse_list_unsubscribe
+
+def test_http_links_come_before_mailto():
+    headers = {'list-unsubscribe': '<mailto:unsub@shop.com?subject=stop>, <https://shop.com/u/1>'}
+
+    parsed = parse_list_unsubscribe(headers)
+
+    assert parsed == {'links': ['https://shop.com/u/1', 'mailto:unsub@shop.com?subject=stop'], 'one_click': False}
+
+def test_one_click_needs_the_post_header_and_an_http_link():
+    headers = {
+        'list-unsubscribe': '<https://shop.com/u/1>',
+        'list-unsubscribe-post': 'List-Unsubscribe=One-Click',
+    }
+    assert parse_list_unsubscribe(headers)['one_click'] is True
+
+    mailto_only = {**headers, 'list-unsubscribe': '<mailto:unsub@shop.com>'}
+    assert parse_list_unsubscribe(mailto_only) == {'links': ['mailto:unsub@shop.com'], 'one_click': False}
+
+    without_post = {'list-unsubscribe': '<https://shop.com/u/1>'}
+    assert parse_list_unsubscribe(without_post)['one_click'] is False
+
+def test_whitespace_and_other_schemes_are_ignored():
+    headers = {'list-unsubscribe': '< https://shop.com/u/1 >,<ftp://shop.com/u>, <>'}
+
+    assert parse_list_unsubscribe(headers)['links'] == ['https://shop.com/u/1']
+
+def test_missing_or_malformed_header():
+    assert parse_list_unsubscribe({}) == {'links': [], 'one_click': False}
+    assert parse_list_unsubscribe({'list-unsubscribe': 'https://shop.com/u/1'}) == {'links': [], 'one_click': False}
@@ -0,0 +1,178 @@
+import pytest
+from googleapiclient.errors import HttpError
+
+import email_fetcher
+import gmail_executor as executor_module
+from gmail_executor import GmailExecutor, TokenBucket
+from message_cache import MessageCache
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class FakeResponse(dict):
+    """Stands in for the httplib2 response carried by HttpError."""
+
+    def __init__(self, status, headers=None):
+        super().__init__(headers or {})
+        self.status = status
+        self.reason = 'error'
+
+def http_error(status, headers=None):
+    return HttpError(FakeResponse(status, headers), b'{"error": {"message": "error"}}')
+
+class FakeBatch:
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.items = []
+
+    def add(self, request, request_id=None):
+        self.items.append(request_id)
+
+    def execute(self):
+        self.service.batches.append(list(self.items))
+        outcomes = self.service.script.pop(0)
+        if isinstance(outcomes, Exception):
+            raise outcomes
+        for request_id in self.items:
+            outcome = outcomes[request_id]
+            if isinstance(outcome, Exception):
+                self.callback(request_id, None, outcome)
+            else:
+                self.callback(request_id, outcome, None)
+
+class FakeService:
+    """googleapiclient service whose batches answer from a script, one entry per batch."""
+
+    def __init__(self, script):
+        self.script = list(script)
+        self.batches = []
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(self, callback)
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    slept = []
+    monkeypatch.setattr(executor_module.time, 'sleep', slept.append)
+    return slept
+
+def run_batch(executor, service, ids):
+    results = {}
+    executor.execute_batch(
+        service, [(msg_id, msg_id) for msg_id in ids], 'messages.get',
+        lambda request_id, response, exception: results.__setitem__(request_id, (response, exception)),
+        user='me@x.com'
+    )
+    return results
+
+def test_reserve_returns_wait_for_debt(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(executor_module.time, 'monotonic', clock)
+    bucket = TokenBucket(rate=10)
+
+    assert bucket.reserve(10) == 0.0
+    assert bucket.reserve(5) == pytest.approx(0.5)
+    # The debt refills at `rate` units per second
+    clock.now += 1.0
+    assert bucket.reserve(5) == 0.0
+
+def test_reserve_refill_is_capped_at_capacity(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(executor_module.time, 'monotonic', clock)
+    bucket = TokenBucket(rate=10, capacity=20)
+
+    clock.now += 3600
+    assert bucket.reserve(20) == 0.0
+    assert bucket.reserve(10) == pytest.approx(1.0)
+
+def test_execute_batch_retries_only_failed_items(sleeps):
+    service = FakeService([
+        {'a': {'id': 'a'}, 'b': http_error(429), 'c': http_error(404)},
+        {'b': {'id': 'b'}},
+    ])
+
+    results = run_batch(GmailExecutor(max_retries=3), service, ['a', 'b', 'c'])
+
+    assert service.batches == [['a', 'b', 'c'], ['b']]
+    assert results['a'] == ({'id': 'a'}, None)
+    assert results['b'] == ({'id': 'b'}, None)
+    assert results['c'][0] is None and results['c'][1].resp.status == 404
+    assert len(sleeps) == 1
+
+def test_execute_batch_gives_up_after_max_retries(sleeps):
+    service = FakeService([{'a': http_error(503)}] * 3)
+
+    results = run_batch(GmailExecutor(max_retries=2), service, ['a'])
+
+    assert len(service.batches) == 3
+    assert results['a'][1].resp.status == 503
+
+def test_execute_batch_retries_a_failed_batch_whole(sleeps):
+    service = FakeService([http_error(500), {'a': {'id': 'a'}, 'b': {'id': 'b'}}])
+
+    results = run_batch(GmailExecutor(), service, ['a', 'b'])
+
+    assert service.batches == [['a', 'b'], ['a', 'b']]
+    assert results == {'a': ({'id': 'a'}, None), 'b': ({'id': 'b'}, None)}
+
+def test_execute_batch_fails_every_item_on_a_fatal_batch_error(sleeps):
+    service = FakeService([http_error(400)])
+
+    results = run_batch(GmailExecutor(), service, ['a', 'b'])
+
+    assert [exception.resp.status for _, exception in results.values()] == [400, 400]
+    assert sleeps == []
+
+def test_retry_after_is_honoured_and_capped(sleeps):
+    service = FakeService([
+        {'a': http_error(429, {'retry-after': '3'})},
+        {'a': http_error(429, {'retry-after': '86400'})},
+        {'a': {'id': 'a'}},
+    ])
+
+    run_batch(GmailExecutor(max_delay=32.0), service, ['a'])
+
+    assert sleeps == [3.0, 32.0]
+
+def test_rate_limit_403_is_retried_but_permission_403_is_not(sleeps):
+    rate_limited = HttpError(FakeResponse(403), b'{"error": {"errors": [{"reason": "rateLimitExceeded"}]}}')
+    service = FakeService([{'a': rate_limited, 'b': http_error(403)}, {'a': {'id': 'a'}}])
+
+    results = run_batch(GmailExecutor(), service, ['a', 'b'])
+
+    assert service.batches == [['a', 'b'], ['a']]
+    assert results['a'] == ({'id': 'a'}, None)
+    assert results['b'][1].resp.status == 403
+
+class FakeGetService:
+    """Gmail service answering messages().get with the requested id."""
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def get(self, **kwargs):
+        return FakeRequest({'id': kwargs['id']})
+
+class FakeRequest:
+    def __init__(self, result):
+        self.result = result
+
+    def execute(self):
+        return self.result
+
+def test_sync_calls_are_charged_to_the_mailbox_owner(monkeypatch):
+    executor = GmailExecutor()
+    monkeypatch.setattr(email_fetcher, 'gmail_executor', executor)
+    monkeypatch.setattr(email_fetcher, 'message_cache', MessageCache())
+
+    assert email_fetcher.get_message(FakeGetService(), 'a', user='me@x.com') == {'id': 'a'}
+
+    assert list(executor._buckets) == ['me@x.com']
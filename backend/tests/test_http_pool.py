@@ -0,0 +1,99 @@
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import http_pool
+from http_pool import HttpPool
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.client_ports.append(self.client_address[1])
+        body = b'ok'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Set-Cookie', f'path={self.path.strip("/")}')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.client_ports = []
+    server.url = f'http://127.0.0.1:{server.server_address[1]}'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_sessions_share_the_pooled_adapter(server):
+    pool = HttpPool(per_host=2, headers={'User-Agent': 'test'})
+    first, second = pool.session(), pool.session()
+
+    for session in (first, second, first):
+        assert session.get(f'{server.url}/a', timeout=5).text == 'ok'
+
+    assert first.get_adapter(server.url) is second.get_adapter(server.url)
+    assert first.headers['User-Agent'] == 'test'
+    pool.close()
+
+def test_connection_is_kept_alive_across_sessions(server):
+    pool = HttpPool()
+    responses = [pool.session().get(f'{server.url}/{i}', timeout=5) for i in range(3)]
+
+    assert all(response.status_code == 200 for response in responses)
+    # Every request arrived over the same client socket
+    assert len(server.client_ports) == 3 and len(set(server.client_ports)) == 1
+    pool.close()
+
+def test_sessions_keep_their_own_cookies(server):
+    pool = HttpPool()
+    first, second = pool.session(), pool.session()
+
+    first.get(f'{server.url}/first', timeout=5)
+    second.get(f'{server.url}/second', timeout=5)
+
+    assert first.cookies.get('path') == 'first'
+    assert second.cookies.get('path') == 'second'
+    pool.close()
+
+def test_shared_pool_is_created_once_and_replaced_after_close():
+    http_pool.close_http_pool()
+    pool = http_pool.get_http_pool()
+
+    assert http_pool.get_http_pool() is pool
+    http_pool.close_http_pool()
+    assert http_pool.get_http_pool() is not pool
+    http_pool.close_http_pool()
+
+def test_async_client_falls_back_to_http1_without_h2(monkeypatch):
+    monkeypatch.setattr(http_pool, 'HTTP2_AVAILABLE', False)
+    monkeypatch.setitem(http_pool.app_config, 'HTTP2_ENABLED', True)
+
+    client = http_pool.create_async_client(headers={'User-Agent': 'test'})
+
+    assert client.follow_redirects
+    assert client.headers['User-Agent'] == 'test'
+    assert client.timeout.connect == http_pool.app_config['HTTP_CONNECT_TIMEOUT']
+
+def test_async_jobs_share_the_transport_but_not_cookies(server):
+    async def run():
+        transport = http_pool.create_async_transport()
+        first = http_pool.create_async_client(transport=transport)
+        second = http_pool.create_async_client(transport=transport)
+        await first.get(f'{server.url}/first')
+        await second.get(f'{server.url}/second')
+        await first.get(f'{server.url}/again')
+        cookies = (first.cookies.get('path'), second.cookies.get('path'))
+        await transport.aclose()
+        return cookies
+
+    assert asyncio.run(run()) == ('again', 'second')
+    assert len(set(server.client_ports)) == 1
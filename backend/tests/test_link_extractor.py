@@ -0,0 +1,115 @@
+import base64
+
+import pytest
+
+import link_extractor
+from link_extractor import BACKENDS, decode_part_tail, extract_unsubscribe_hrefs, find_body_unsubscribe_links, iter_text_parts
+
+def part(mime_type, text, **extra):
+    data = base64.urlsafe_b64encode(text.encode('utf-8')).decode('ascii').rstrip('=')
+    return {'mimeType': mime_type, 'body': {'data': data}, **extra}
+
+def multipart(mime_type, *parts):
+    return {'mimeType': mime_type, 'body': {'size': 0}, 'parts': list(parts)}
+
+FOOTER = '<p><a href="https://shop.com/unsubscribe?u=1">Unsubscribe</a> | <a href="https://shop.com/help">Help</a></p>'
+
+@pytest.mark.parametrize('backend', sorted(BACKENDS))
+def test_backends_agree_on_links(backend):
+    html = (
+        '<a href="https://shop.com/email_preferences">Preferences</a>'
+        '<a href="mailto:leave@shop.com?subject=unsubscribe">Mail</a>'
+        '<a href="https://shop.com/opt-out">Opt out</a>'
+        '<a href="https://shop.com/unsubscribe?u=1">Unsubscribe</a>'
+        '<a href=" https://shop.com/unsubscribe?u=1 ">Duplicate</a>'
+        '<a href="https://shop.com/products">Products</a>'
+    )
+
+    assert extract_unsubscribe_hrefs(html, backend) == [
+        'https://shop.com/email_preferences',
+        'mailto:leave@shop.com?subject=unsubscribe',
+        'https://shop.com/opt-out',
+        'https://shop.com/unsubscribe?u=1',
+    ]
+
+def test_empty_bodies_have_no_links():
+    assert extract_unsubscribe_hrefs('') == []
+    assert extract_unsubscribe_hrefs(' \n ') == []
+
+def test_nested_multipart_html_parts_come_first():
+    payload = multipart(
+        'multipart/mixed',
+        multipart(
+            'multipart/alternative',
+            part('text/plain', 'Unsubscribe: https://shop.com/unsubscribe?plain=1'),
+            multipart('multipart/related', part('text/html', FOOTER), part('image/png', 'png')),
+        ),
+        part('text/html', '<a href="https://shop.com/unsubscribe?attached=1">x</a>', filename='forwarded.html'),
+    )
+
+    assert [p['mimeType'] for _, p in iter_text_parts(payload)] == ['text/html', 'text/plain']
+    assert find_body_unsubscribe_links(payload) == ['https://shop.com/unsubscribe?u=1']
+
+def test_plain_text_part_is_the_fallback():
+    payload = multipart(
+        'multipart/alternative',
+        part('text/plain', 'Stop these emails: https://shop.com/unsubscribe?plain=1 thanks'),
+        part('text/html', '<p>No footer link here</p>'),
+    )
+
+    assert find_body_unsubscribe_links(payload) == ['https://shop.com/unsubscribe?plain=1']
+
+def test_undecodable_part_is_skipped():
+    payload = multipart(
+        'multipart/alternative',
+        {'mimeType': 'text/html', 'body': {'data': 'not base64!'}},
+        part('text/plain', 'https://shop.com/unsubscribe?plain=1'),
+    )
+
+    assert find_body_unsubscribe_links(payload) == ['https://shop.com/unsubscribe?plain=1']
+
+def test_tail_is_a_suffix_for_any_cut():
+    # Two-, three- and four-byte characters, so cuts land inside UTF-8 sequences
+    html = ''.join(f'<p>é€😀 line {i}</p>' for i in range(40)) + FOOTER
+    body = part('text/html', html)
+
+    for max_bytes in range(1, len(html.encode('utf-8')) + 8):
+        text, complete = decode_part_tail(body, max_bytes)
+        assert html.endswith(text)
+        if complete:
+            assert text == html
+        else:
+            assert text.startswith('<') or '<' not in text
+            # Whole base64 quanta: at most a few bytes over
+            assert len(text.encode('utf-8')) <= max_bytes + 6
+
+def test_tail_skips_a_cut_off_anchor():
+    html = '<p>intro</p><a href="https://shop.com/unsubscribe?u=1">Unsubscribe</a>'
+    cut = len(html.encode('utf-8')) - html.index('unsubscribe?u=1')
+
+    text, complete = decode_part_tail(part('text/html', html), cut)
+
+    assert not complete
+    assert 'href' not in text
+    assert extract_unsubscribe_hrefs(text) == []
+
+def test_whole_body_is_scanned_when_the_tail_has_no_link():
+    html = FOOTER.replace('<p>', '<p>Top: ', 1) + '<p>' + 'ü' * 5000 + '</p>'
+    payload = part('text/html', html)
+
+    assert find_body_unsubscribe_links(payload, tail_bytes=1024) == ['https://shop.com/unsubscribe?u=1']
+
+def test_tail_link_is_found_without_decoding_the_rest(monkeypatch):
+    html = '<p>' + 'x' * 100000 + '</p>' + FOOTER
+    payload = part('text/html', html)
+    decoded = []
+    monkeypatch.setattr(link_extractor, 'decode_part', lambda p: decoded.append(p) or '')
+
+    assert find_body_unsubscribe_links(payload, tail_bytes=1024) == ['https://shop.com/unsubscribe?u=1']
+    assert decoded == []
+
+def test_tail_bytes_zero_scans_whole_bodies():
+    html = FOOTER + '<p>' + 'x' * 5000 + '</p>'
+
+    assert decode_part_tail(part('text/html', html), 0) == (html, True)
+    assert find_body_unsubscribe_links(part('text/html', html), tail_bytes=0) == ['https://shop.com/unsubscribe?u=1']
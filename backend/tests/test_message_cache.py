@@ -0,0 +1,111 @@
+import pytest
+
+import message_cache as cache_module
+from message_cache import MessageCache, format_key
+
+def msg(msg_id, body=''):
+    return {'id': msg_id, 'snippet': body}
+
+def cached_ids(cache):
+    return [key[1] for key in cache._entries]
+
+def test_least_recently_used_entries_are_evicted():
+    cache = MessageCache(max_entries=3)
+    for msg_id in ('a', 'b', 'c'):
+        cache.put('me', msg_id, 'full', msg(msg_id))
+
+    # A hit makes 'a' the most recently used
+    assert cache.get('me', 'a', 'full') == msg('a')
+    cache.put('me', 'd', 'full', msg('d'))
+
+    assert cached_ids(cache) == ['c', 'a', 'd']
+    assert cache.get('me', 'b', 'full') is None
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+def test_entries_are_per_user_and_format():
+    cache = MessageCache()
+    cache.put('me', 'a', 'full', msg('a', 'full'))
+
+    assert cache.get('other', 'a', 'full') is None
+    assert cache.get('me', 'a', 'minimal') is None
+
+def test_full_message_answers_metadata_lookups():
+    cache = MessageCache()
+    cache.put('me', 'a', 'full', msg('a', 'full'))
+    metadata = format_key('metadata', ['Subject', 'From'])
+
+    assert metadata == 'metadata:from,subject'
+    assert cache.get('me', 'a', metadata) == msg('a', 'full')
+    # ...but metadata never answers a full lookup
+    cache.put('me', 'b', metadata, msg('b', 'metadata'))
+    assert cache.get('me', 'b', 'full') is None
+
+def test_returned_messages_are_copies():
+    cache = MessageCache()
+    cache.put('me', 'a', 'full', msg('a'))
+
+    cache.get('me', 'a', 'full')['sender_email'] = 'x@y.com'
+
+    assert 'sender_email' not in cache.get('me', 'a', 'full')
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, 'time', lambda: now[0])
+    cache = MessageCache(ttl=60)
+    cache.put('me', 'a', 'full', msg('a'))
+
+    now[0] += 59
+    assert cache.get('me', 'a', 'full') is not None
+    now[0] += 2
+    assert cache.get('me', 'a', 'full') is None
+
+def test_disk_tier_survives_a_new_cache(tmp_path):
+    path = str(tmp_path / 'cache' / 'messages.db')
+    first = MessageCache(max_entries=1, path=path)
+    first.put('me', 'a', 'full', msg('a', 'héllo'))
+    first.put('me', 'b', 'full', msg('b'))
+
+    # 'a' left memory on the first cache but is still on disk
+    assert first.get('me', 'a', 'full') == msg('a', 'héllo')
+
+    second = MessageCache(path=path)
+    assert second.get('me', 'a', 'full') == msg('a', 'héllo')
+    assert second.stats()['entries'] == 1
+
+    second.clear()
+    assert MessageCache(path=path).get('me', 'b', 'full') is None
+
+def test_memory_tier_is_bounded_by_size():
+    cache = MessageCache(max_bytes=350)
+    for msg_id in ('a', 'b', 'c', 'd'):
+        cache.put('me', msg_id, 'full', msg(msg_id, 'x' * 80))
+
+    assert cached_ids(cache) == ['b', 'c', 'd']
+    assert cache.stats()['bytes'] == cache.size <= 350
+
+def test_message_larger_than_the_budget_is_not_kept_in_memory(tmp_path):
+    cache = MessageCache(max_bytes=100, path=str(tmp_path / 'messages.db'))
+    cache.put('me', 'a', 'full', msg('a'))
+    cache.put('me', 'big', 'full', msg('big', 'x' * 500))
+
+    assert cached_ids(cache) == ['a']
+    # The disk tier still answers, without pulling it into memory
+    assert cache.get('me', 'big', 'full') == msg('big', 'x' * 500)
+    assert cached_ids(cache) == ['a']
+
+def test_replacing_an_entry_updates_the_size():
+    cache = MessageCache(max_bytes=1000)
+    cache.put('me', 'a', 'full', msg('a', 'x' * 200))
+    cache.put('me', 'a', 'full', msg('a'))
+
+    assert cache.size == len('{"id": "a", "snippet": ""}')
+
+def test_batches_round_trip_through_the_disk_tier(tmp_path):
+    path = str(tmp_path / 'messages.db')
+    cache = MessageCache(path=path)
+    cache.put_many('me', {'a': msg('a', 'full'), 'b': msg('b', 'full')}, 'full')
+    metadata = format_key('metadata', ['From'])
+
+    assert cache.get_many('me', ['a', 'x', 'b'], metadata) == {'a': msg('a', 'full'), 'b': msg('b', 'full')}
+    assert MessageCache(path=path).get_many('me', ['b', 'a'], 'full') == {'b': msg('b', 'full'), 'a': msg('a', 'full')}
+    assert cache.stats()['hits'] == 2 and cache.stats()['misses'] == 1
@@ -0,0 +1,176 @@
+import asyncio
+import logging
+
+import pytest
+
+import request_blocking
+from request_blocking import RequestFilter, log_blocked
+from unsub_process import PlaywrightUnsubscribeStrategy
+from async_unsubscribe import AsyncPlaywrightStrategy
+
+@pytest.fixture
+def request_filter():
+    return RequestFilter(
+        resource_types={'image', 'font', 'media'},
+        deny_hosts={'google-analytics.com', 'hotjar.com'},
+        allow_hosts={'cdn.esp.com'}
+    )
+
+@pytest.mark.parametrize('url, resource_type, reason', [
+    ('https://esp.com/unsubscribe', 'document', None),
+    ('https://esp.com/app.js', 'script', None),
+    ('https://esp.com/logo.png', 'image', 'image'),
+    ('https://esp.com/font.woff2', 'font', 'font'),
+    ('https://www.google-analytics.com/collect', 'xhr', 'tracker'),
+    ('https://static.hotjar.com/c/hotjar.js', 'script', 'tracker'),
+    # Only real subdomains match a denied host
+    ('https://nothotjar.com/app.js', 'script', None),
+    # Allowed hosts win over every other rule
+    ('https://cdn.esp.com/hero.png', 'image', None),
+    ('https://img.cdn.esp.com/hero.png', 'image', None),
+])
+def test_reason(request_filter, url, resource_type, reason):
+    assert request_filter.reason(url, resource_type) == reason
+
+class FakeFrame:
+    def __init__(self, parent_frame=None):
+        self.parent_frame = parent_frame
+
+class FakeRequest:
+    def __init__(self, url, resource_type, navigation=False, frame=None):
+        self.url = url
+        self.resource_type = resource_type
+        self.navigation = navigation
+        self.frame = frame or FakeFrame()
+
+    def is_navigation_request(self):
+        return self.navigation
+
+class FakeRoute:
+    def __init__(self, request):
+        self.request = request
+        self.outcome = None
+
+    def abort(self):
+        self.outcome = 'aborted'
+
+    def continue_(self):
+        self.outcome = 'continued'
+
+class FakeAsyncRoute(FakeRoute):
+    async def abort(self):
+        self.outcome = 'aborted'
+
+    async def continue_(self):
+        self.outcome = 'continued'
+
+class FakePage:
+    def __init__(self):
+        self.handler = None
+
+    def route(self, pattern, handler):
+        assert pattern == '**/*'
+        self.handler = handler
+
+class FakeAsyncPage(FakePage):
+    async def route(self, pattern, handler):
+        super().route(pattern, handler)
+
+REQUESTS = [
+    # The unsubscribe page itself is kept even on a tracker host
+    FakeRequest('https://hotjar.com/unsubscribe', 'document', navigation=True),
+    FakeRequest('https://esp.com/logo.png', 'image'),
+    FakeRequest('https://esp.com/banner.png', 'image'),
+    FakeRequest('https://www.google-analytics.com/collect', 'xhr'),
+    # A tracker iframe navigation is not the page itself
+    FakeRequest('https://hotjar.com/frame', 'document', navigation=True, frame=FakeFrame(parent_frame=FakeFrame())),
+    FakeRequest('https://esp.com/form', 'fetch'),
+]
+
+def test_install_aborts_and_counts_per_page(request_filter):
+    page = FakePage()
+    blocked = request_filter.install(page)
+
+    routes = [FakeRoute(request) for request in REQUESTS]
+    for route in routes:
+        page.handler(route)
+
+    assert [route.outcome for route in routes] == ['continued', 'aborted', 'aborted', 'aborted', 'aborted', 'continued']
+    assert blocked == {'image': 2, 'tracker': 2}
+    # Another page starts its own count
+    assert request_filter.install(FakePage()) == {}
+
+def test_install_async_aborts_and_counts(request_filter):
+    page = FakeAsyncPage()
+    blocked = asyncio.run(request_filter.install_async(page))
+
+    routes = [FakeAsyncRoute(request) for request in REQUESTS]
+    for route in routes:
+        asyncio.run(page.handler(route))
+
+    assert [route.outcome for route in routes] == ['continued', 'aborted', 'aborted', 'aborted', 'aborted', 'continued']
+    assert blocked == {'image': 2, 'tracker': 2}
+
+def test_log_blocked_summarises_reasons(caplog):
+    with caplog.at_level(logging.INFO):
+        log_blocked('https://esp.com/u', request_blocking.Counter({'tracker': 1, 'image': 3}))
+        log_blocked('https://esp.com/v', request_blocking.Counter())
+
+    assert [record.getMessage() for record in caplog.records] == ['Blocked 4 request(s) on https://esp.com/u: image=3, tracker=1']
+
+def test_filter_is_built_from_config(monkeypatch):
+    monkeypatch.setattr(request_blocking, '_filter', None)
+    monkeypatch.setitem(request_blocking.app_config, 'PLAYWRIGHT_BLOCK_ENABLED', True)
+    monkeypatch.setitem(request_blocking.app_config, 'PLAYWRIGHT_BLOCK_RESOURCES', 'image, Font')
+    monkeypatch.setitem(request_blocking.app_config, 'PLAYWRIGHT_BLOCK_HOSTS', 'ads.example.com')
+    monkeypatch.setitem(request_blocking.app_config, 'PLAYWRIGHT_ALLOW_HOSTS', 'doubleclick.net')
+
+    request_filter = request_blocking.get_request_filter()
+
+    assert request_filter.reason('https://x.com/a.woff', 'font') == 'font'
+    assert request_filter.reason('https://ads.example.com/px', 'script') == 'tracker'
+    assert request_filter.reason('https://hotjar.com/px', 'script') == 'tracker'
+    assert request_filter.reason('https://ad.doubleclick.net/px', 'script') is None
+
+    monkeypatch.setitem(request_blocking.app_config, 'PLAYWRIGHT_BLOCK_ENABLED', False)
+    assert request_blocking.get_request_filter() is None
+
+class FakeContext:
+    def __init__(self, page):
+        self.page = page
+
+    def new_page(self):
+        return self.page
+
+class FakeAsyncContext(FakeContext):
+    async def new_page(self):
+        return self.page
+
+def test_playwright_strategy_reports_blocked_requests_in_its_attempt(request_filter, monkeypatch):
+    def on_page(page, link):
+        for request in REQUESTS:
+            page.handler(FakeRoute(request))
+        return True, 'Unsubscribed'
+
+    strategy = PlaywrightUnsubscribeStrategy(pool=object(), request_filter=request_filter)
+    monkeypatch.setattr(strategy, '_unsubscribe_on_page', on_page)
+    attempt = {'tier': 'playwright'}
+
+    assert strategy._unsubscribe_in_context(FakeContext(FakePage()), 'https://esp.com/u', attempt) == (True, 'Unsubscribed')
+    assert attempt == {'tier': 'playwright', 'blocked': {'image': 2, 'tracker': 2}}
+
+def test_async_playwright_strategy_reports_blocked_requests_in_its_attempt(request_filter, monkeypatch):
+    async def on_page(page, link):
+        for request in REQUESTS:
+            await page.handler(FakeAsyncRoute(request))
+        return True, 'Unsubscribed'
+
+    strategy = AsyncPlaywrightStrategy(executor=None)
+    strategy.request_filter = request_filter
+    monkeypatch.setattr(strategy, '_unsubscribe_on_page', on_page)
+    attempt = {'tier': 'playwright'}
+
+    result = asyncio.run(strategy._unsubscribe_in_context(FakeAsyncContext(FakeAsyncPage()), 'https://esp.com/u', attempt))
+
+    assert result == (True, 'Unsubscribed')
+    assert attempt == {'tier': 'playwright', 'blocked': {'image': 2, 'tracker': 2}}
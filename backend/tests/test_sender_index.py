@@ -0,0 +1,249 @@
+import time
+import asyncio
+
+import httpx
+import pytest
+
+import main
+from sender_index import SenderIndex, sync_sender_index, PROMOTIONS_LABEL
+
+def message(msg_id, sender, labels=(PROMOTIONS_LABEL,), internal_date=1000):
+    return {
+        'id': msg_id,
+        'labelIds': list(labels),
+        'internalDate': str(internal_date),
+        'payload': {'headers': [{'name': 'From', 'value': f'Sender <{sender}>'}]},
+    }
+
+class FakeClient:
+    """Async Gmail client serving canned history pages and messages."""
+
+    def __init__(self, history_pages=(), messages=None, profile_history_id='900', history_error=None):
+        self.history_pages = list(history_pages)
+        self.messages = messages or {}
+        self.profile_history_id = profile_history_id
+        self.history_error = history_error
+        self.fetched = []
+        self.listed_pages = 0
+
+    async def list_history(self, start_history_id, history_types=None, label_id=None, page_token=None):
+        if self.history_error is not None:
+            raise self.history_error
+        return self.history_pages[int(page_token or 0)]
+
+    async def get_messages(self, message_ids, msg_format='metadata', metadata_headers=None):
+        self.fetched.extend(message_ids)
+        return {msg_id: self.messages[msg_id] for msg_id in message_ids if msg_id in self.messages}, {}
+
+    async def get_profile(self):
+        return {'historyId': self.profile_history_id}
+
+    async def list_messages(self, q=None, max_results=100, page_token=None, fields=None):
+        self.listed_pages += 1
+        ids = list(self.messages)
+        start = int(page_token or 0)
+        response = {'messages': [{'id': msg_id} for msg_id in ids[start:start + max_results]]}
+        if start + max_results < len(ids):
+            response['nextPageToken'] = str(start + max_results)
+        return response
+
+@pytest.fixture
+def index():
+    index = SenderIndex(':memory:')
+    index.add_messages('me@x.com', [
+        message('m1', 'a@shop.com'),
+        message('m2', 'b@shop.com'),
+        message('m3', 'c@shop.com'),
+    ])
+    index.set_history_id('me@x.com', '100', covered_from=0)
+    return index
+
+def indexed(index):
+    """Indexed senders of the mailbox with their message counts."""
+    senders = {}
+    for sender in index.get_senders('me@x.com', max_senders=100, older_than_days=0):
+        senders[sender['sender_email']] = sender['message_count']
+    return senders
+
+def test_history_applies_label_transitions(index):
+    history = {
+        'history': [
+            # Moved to social: leaves the index
+            {'labelsAdded': [{'message': {'id': 'm1'}, 'labelIds': ['CATEGORY_SOCIAL']}]},
+            # Promotions label removed: leaves the index
+            {'labelsRemoved': [{'message': {'id': 'm2'}, 'labelIds': [PROMOTIONS_LABEL]}]},
+            # Trashed: leaves the index
+            {'labelsAdded': [{'message': {'id': 'm3'}, 'labelIds': ['TRASH']}]},
+            # Moved into promotions: joins the index
+            {'labelsAdded': [{'message': {'id': 'm4'}, 'labelIds': [PROMOTIONS_LABEL]}]},
+            # New promotional mail
+            {'messagesAdded': [{'message': {'id': 'm5'}}]},
+            # Added then deleted within the window: never fetched
+            {'messagesAdded': [{'message': {'id': 'm6'}}]},
+            {'messagesDeleted': [{'message': {'id': 'm6'}}]},
+        ],
+        'historyId': '200',
+    }
+    client = FakeClient([history], messages={
+        'm4': message('m4', 'd@shop.com'),
+        'm5': message('m5', 'a@shop.com'),
+    })
+
+    result = asyncio.run(sync_sender_index(client, 'me@x.com', index=index))
+
+    assert result == {'mode': 'incremental', 'added': 2, 'removed': 3}
+    assert sorted(client.fetched) == ['m4', 'm5']
+    assert indexed(index) == {'d@shop.com': 1, 'a@shop.com': 1}
+    assert index.get_history_id('me@x.com') == '200'
+
+def test_history_rechecks_messages_leaving_an_excluded_label(index):
+    history = {
+        'history': [
+            # Restored from trash, still promotional: joins the index
+            {'labelsRemoved': [{'message': {'id': 'm7'}, 'labelIds': ['TRASH']}]},
+            # Out of spam but now in updates: re-checked and left out
+            {'labelsRemoved': [{'message': {'id': 'm8'}, 'labelIds': ['SPAM']}]},
+            # Trashed then restored within the window: the restore wins
+            {'labelsAdded': [{'message': {'id': 'm1'}, 'labelIds': ['TRASH']}]},
+            {'labelsRemoved': [{'message': {'id': 'm1'}, 'labelIds': ['TRASH']}]},
+        ],
+        'historyId': '250',
+    }
+    client = FakeClient([history], messages={
+        'm1': message('m1', 'a@shop.com'),
+        'm7': message('m7', 'e@shop.com'),
+        'm8': message('m8', 'f@shop.com', labels=[PROMOTIONS_LABEL, 'CATEGORY_UPDATES']),
+    })
+
+    result = asyncio.run(sync_sender_index(client, 'me@x.com', index=index))
+
+    assert result == {'mode': 'incremental', 'added': 2, 'removed': 0}
+    assert client.fetched == ['m7', 'm8', 'm1']
+    assert indexed(index) == {'a@shop.com': 1, 'b@shop.com': 1, 'c@shop.com': 1, 'e@shop.com': 1}
+
+def test_history_drops_added_messages_no_longer_promotional(index):
+    history = {'history': [{'messagesAdded': [{'message': {'id': 'm7'}}]}], 'historyId': '150'}
+    client = FakeClient([history], messages={'m7': message('m7', 'e@shop.com', labels=[PROMOTIONS_LABEL, 'CATEGORY_UPDATES'])})
+
+    result = asyncio.run(sync_sender_index(client, 'me@x.com', index=index))
+
+    assert result['added'] == 0
+    assert 'e@shop.com' not in indexed(index)
+
+def test_history_follows_pages(index):
+    pages = [
+        {'history': [{'messagesAdded': [{'message': {'id': 'm4'}}]}], 'nextPageToken': '1'},
+        {'history': [{'labelsRemoved': [{'message': {'id': 'm1'}, 'labelIds': [PROMOTIONS_LABEL]}]}], 'historyId': '300'},
+    ]
+    client = FakeClient(pages, messages={'m4': message('m4', 'd@shop.com')})
+
+    result = asyncio.run(sync_sender_index(client, 'me@x.com', index=index))
+
+    assert result == {'mode': 'incremental', 'added': 1, 'removed': 1}
+    assert index.get_history_id('me@x.com') == '300'
+
+def test_expired_history_falls_back_to_full_sync(index):
+    response = httpx.Response(404, request=httpx.Request('GET', 'https://gmail.googleapis.com/'))
+    client = FakeClient(
+        messages={'m9': message('m9', 'z@shop.com')},
+        history_error=httpx.HTTPStatusError('gone', request=response.request, response=response)
+    )
+
+    result = asyncio.run(sync_sender_index(client, 'me@x.com', index=index))
+
+    assert result == {'mode': 'full', 'added': 1, 'removed': 0}
+    assert indexed(index) == {'z@shop.com': 1}
+    assert index.get_history_id('me@x.com') == '900'
+
+DAY_MS = 24 * 3600 * 1000
+
+def days_ago(days):
+    return int(time.time() * 1000) - days * DAY_MS
+
+def mailbox(recent, old):
+    """Promotions newest first: `recent` messages from the last days, then `old` ones past the window."""
+    messages = {}
+    for i in range(recent):
+        messages[f'r{i}'] = message(f'r{i}', f'new{i % 3}@shop.com', internal_date=days_ago(1))
+    for i in range(old):
+        messages[f'o{i}'] = message(f'o{i}', f'old{i % 4}@shop.com', internal_date=days_ago(30 + i))
+    return messages
+
+def test_full_sync_pages_past_the_budget_to_the_window():
+    index = SenderIndex(':memory:')
+    client = FakeClient(messages=mailbox(recent=1200, old=1000))
+
+    result = asyncio.run(sync_sender_index(client, 'me@x.com', index=index, max_messages=10))
+
+    # Every recent message plus the old ones of the page that reached the budget
+    assert result['added'] == 1500
+    assert index.covers('me@x.com')
+    senders = index.get_senders('me@x.com', max_senders=100)
+    assert sorted(sender['sender_email'] for sender in senders) == [f'old{i}@shop.com' for i in range(4)]
+    # Counts of a truncated window are not totals
+    assert all(sender['message_count'] is None and sender['oldest_date'] is None for sender in senders)
+
+def test_full_sync_to_the_end_reports_totals():
+    index = SenderIndex(':memory:')
+    client = FakeClient(messages=mailbox(recent=2, old=8))
+
+    asyncio.run(sync_sender_index(client, 'me@x.com', index=index))
+
+    assert index.get_covered_from('me@x.com') == 0
+    assert indexed(index) == {'old0@shop.com': 2, 'old1@shop.com': 2, 'old2@shop.com': 2, 'old3@shop.com': 2,
+                              'new0@shop.com': 1, 'new1@shop.com': 1}
+    assert {sender['sender_email']: sender['message_count'] for sender in index.get_senders('me@x.com')} == {
+        'old0@shop.com': 2, 'old1@shop.com': 2, 'old2@shop.com': 2, 'old3@shop.com': 2
+    }
+
+def test_index_without_coverage_is_rebuilt(index):
+    # Built before coverage was recorded
+    index.clear('me@x.com')
+    index.set_history_id('me@x.com', '100')
+    client = FakeClient(messages={'m9': message('m9', 'z@shop.com')})
+
+    assert not index.covers('me@x.com')
+    result = asyncio.run(sync_sender_index(client, 'me@x.com', index=index))
+
+    assert result['mode'] == 'full'
+    assert index.covers('me@x.com')
+
+def test_incremental_sync_keeps_coverage(index):
+    asyncio.run(sync_sender_index(FakeClient([{'history': [], 'historyId': '200'}]), 'me@x.com', index=index))
+
+    assert index.get_history_id('me@x.com') == '200'
+    assert index.get_covered_from('me@x.com') == 0
+
+class FakeRequest:
+    session = {'user': {'email': 'me@x.com'}}
+
+def scan(monkeypatch, index, sync=None):
+    async def live_scan(client, max_senders=20, user=None):
+        yield {'id': 'live', 'sender_email': 'live@shop.com'}
+
+    async def no_sync(client, user):
+        pass
+
+    monkeypatch.setattr(main, 'sync_sender_index', sync or no_sync)
+    monkeypatch.setattr(main, 'get_sender_index', lambda: index)
+    monkeypatch.setattr(main, 'aiter_promotional_senders', live_scan)
+    return asyncio.run(main.scan_inbox(FakeRequest(), max_senders=10, client=None))
+
+def test_scan_is_served_from_a_covering_index(index, monkeypatch):
+    result = scan(monkeypatch, index)
+
+    assert result['count'] == 3
+    assert 'live@shop.com' not in [sender['sender_email'] for sender in result['emails']]
+
+def test_scan_falls_back_to_live_until_the_window_is_covered(monkeypatch):
+    index = SenderIndex(':memory:')
+    index.add_messages('me@x.com', [message('m1', 'a@shop.com')])
+    index.set_history_id('me@x.com', '100', covered_from=days_ago(1))
+
+    assert scan(monkeypatch, index)['emails'] == [{'id': 'live', 'sender_email': 'live@shop.com'}]
+
+def test_scan_falls_back_to_live_when_the_sync_fails(index, monkeypatch):
+    async def failing_sync(client, user):
+        raise RuntimeError('quota')
+
+    assert scan(monkeypatch, index, sync=failing_sync)['count'] == 1
@@ -0,0 +1,174 @@
+import json
+import datetime
+
+import pytest
+
+import auth
+import gmail_async
+import user_clients as user_clients_module
+from gmail_async import AsyncGmailClient
+from user_clients import UserClientCache, _token_saver
+
+class FakeClient:
+    def __init__(self, credentials, user=None, on_refresh=None):
+        self.credentials = credentials
+        self.user = user
+        self.on_refresh = on_refresh
+
+class FakeCredentials:
+    """google.oauth2 Credentials that hand out a new access token on every refresh."""
+
+    def __init__(self, info):
+        self.info = dict(info)
+        self.token = info.get('token')
+        self.refresh_token = info.get('refresh_token')
+        self.expiry = None
+        self.valid = False
+
+    @classmethod
+    def from_authorized_user_info(cls, info):
+        return cls(info)
+
+    def refresh(self, request):
+        self.token = f'{self.token}+'
+        self.valid = True
+
+    def to_json(self):
+        return json.dumps({**self.info, 'token': self.token})
+
+@pytest.fixture
+def users(monkeypatch):
+    stored = {}
+    loads = []
+
+    def get_user(email):
+        loads.append(email)
+        return stored.get(email)
+
+    monkeypatch.setattr(user_clients_module, 'get_user', get_user)
+    monkeypatch.setattr(user_clients_module, 'Credentials', FakeCredentials)
+    monkeypatch.setattr(user_clients_module, 'AsyncGmailClient', FakeClient)
+    stored['a@x.com'] = {'email': 'a@x.com', 'name': 'A', 'tokens': {'token': 'a'}}
+    stored['b@x.com'] = {'email': 'b@x.com', 'tokens': {'token': 'b'}}
+    stored['c@x.com'] = {'email': 'c@x.com', 'tokens': {'token': 'c'}}
+    stored['loads'] = loads
+    return stored
+
+def test_hit_reuses_the_client_without_a_lookup(users):
+    cache = UserClientCache()
+
+    client = cache.get('a@x.com')
+
+    assert client.credentials.token == 'a' and client.user == 'a@x.com'
+    assert cache.get('a@x.com') is client
+    assert users['loads'] == ['a@x.com']
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+def test_user_without_tokens_gets_no_client(users):
+    users['d@x.com'] = {'email': 'd@x.com'}
+    cache = UserClientCache()
+
+    assert cache.get('d@x.com') is None
+    assert cache.get('nobody@x.com') is None
+    assert cache.stats()['entries'] == 0
+
+def test_entries_expire_after_ttl(users, monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(user_clients_module.time, 'monotonic', lambda: now[0])
+    cache = UserClientCache(ttl=60)
+    first = cache.get('a@x.com')
+
+    now[0] += 60
+    assert cache.get('a@x.com') is first
+    now[0] += 1
+    assert cache.get('a@x.com') is not first
+
+def test_least_recently_used_client_is_evicted(users):
+    cache = UserClientCache(max_entries=2)
+    a = cache.get('a@x.com')
+    cache.get('b@x.com')
+    cache.get('a@x.com')
+
+    cache.get('c@x.com')
+
+    assert list(cache._entries) == ['a@x.com', 'c@x.com']
+    assert cache.get('a@x.com') is a
+
+def test_invalidate_rebuilds_from_the_stored_tokens(users):
+    cache = UserClientCache()
+    cache.get('a@x.com')
+    users['a@x.com']['tokens'] = {'token': 'new'}
+
+    cache.invalidate('a@x.com')
+
+    assert cache.get('a@x.com').credentials.token == 'new'
+
+def test_refreshed_token_is_written_back(monkeypatch):
+    saved = []
+    monkeypatch.setattr(user_clients_module, 'save_user', lambda user_info, tokens: saved.append((user_info, tokens)) or True)
+    monkeypatch.setattr(gmail_async, 'GoogleAuthRequest', lambda: None)
+    credentials = FakeCredentials({'token': 'old', 'refresh_token': 'r'})
+    user_data = {'email': 'a@x.com', 'name': 'A', 'picture': 'p.png', 'tokens': credentials.info}
+
+    client = AsyncGmailClient(credentials, user='a@x.com', on_refresh=_token_saver('a@x.com', user_data))
+    assert client._needs_refresh()
+    client._refresh()
+
+    assert saved == [(
+        {'email': 'a@x.com', 'name': 'A', 'picture': 'p.png'},
+        {'token': 'old+', 'refresh_token': 'r'},
+    )]
+
+def test_token_expiring_within_the_margin_is_refreshed():
+    credentials = FakeCredentials({'token': 'a', 'refresh_token': 'r'})
+    credentials.valid = True
+    client = AsyncGmailClient(credentials, user='a@x.com')
+    now = datetime.datetime.now(datetime.UTC).replace(tzinfo=None)
+
+    credentials.expiry = now + client.refresh_margin * 2
+    assert not client._needs_refresh()
+    credentials.expiry = now + client.refresh_margin / 2
+    assert client._needs_refresh()
+
+class FakeRequest:
+    def __init__(self, user=None):
+        self.session = {'user': user} if user else {}
+        self.headers = {'host': 'localhost:8000'}
+
+@pytest.fixture
+def cached(monkeypatch):
+    cache = UserClientCache()
+    cache._entries['a@x.com'] = (float('inf'), object())
+    monkeypatch.setattr(auth, 'user_clients', cache)
+    return cache
+
+def test_logout_invalidates_the_cached_client(cached):
+    auth.logout(FakeRequest({'email': 'a@x.com'}))
+
+    assert 'a@x.com' not in cached._entries
+
+def test_login_invalidates_the_cached_client(cached, monkeypatch):
+    class Flow:
+        credentials = FakeCredentials({'token': 'fresh'})
+
+        def fetch_token(self, code):
+            pass
+
+    class OAuth2:
+        def userinfo(self):
+            return self
+
+        def get(self):
+            return self
+
+        def execute(self):
+            return {'email': 'a@x.com', 'name': 'A'}
+
+    monkeypatch.setattr(auth, 'create_flow', lambda redirect_uri=None: Flow())
+    monkeypatch.setattr(auth, 'build', lambda *args, **kwargs: OAuth2())
+    monkeypatch.setattr(auth, 'save_user', lambda user_info, tokens: True)
+    monkeypatch.setattr(auth, 'get_user', lambda email: {'email': email})
+
+    auth.auth_callback(FakeRequest(), code='code')
+
+    assert 'a@x.com' not in cached._entries
@@ -4,17 +4,21 @@ from __future__ import annotations
 # Then standard library imports
 import logging
 import re
-from typing import List, Dict, Tuple, Set, Any, Union, Callable
+import time
+from typing import List, Dict, Tuple, Set, Any, Union, Callable, Optional
 from urllib.parse import urlparse, parse_qs, urlencode, urljoin
 from abc import ABC, abstractmethod
 
 # Third-party imports
 import requests
 from bs4 import BeautifulSoup
-from playwright.sync_api import sync_playwright
 
 # Local application imports
 # Supabase integration removed
+from browser_pool import BrowserPool, get_browser_pool
+from http_pool import HttpPool, get_http_pool, default_timeout
+from domain_routes import DomainRoutes, get_domain_routes
+from request_blocking import RequestFilter, get_request_filter, log_blocked
 
 # Configure logging
 logging.basicConfig(
@@ -36,105 +40,210 @@ HEADERS = {
     'DNT': '1',
 }
 
+# RFC 8058 request body
+ONE_CLICK_BODY = {'List-Unsubscribe': 'One-Click'}
+
+# Common keywords for buttons/links on unsubscribe pages, most specific first
+CLICK_KEYWORDS = ['confirm', 'yes', 'unsubscribe', 'opt out', 'opt-out', 'submit', 'update preferences']
+
+# Confirmation texts of unsubscribe pages (valid as both Python and JavaScript regexes)
+SUCCESS_PATTERNS = [
+    r'successfully\s+unsubscribed',
+    r'unsubscribed\s+successfully',
+    r'preference(?:s)?\s+updated',
+    r'you\s+have\s+been\s+unsubscribed',
+    r'removed\s+from\s.*list',
+    r'opted\s+out',
+    r'subscription\s+cancel'
+]
+
+# Attribute tagging the click candidates found by SCAN_PAGE_JS
+CANDIDATE_ATTR = 'data-unclut-candidate'
+
+# Buttons, links and submit inputs tried per page, best ranked first
+MAX_CLICK_CANDIDATES = 5
+
+# Milliseconds to wait for a confirmation after clicking
+POST_CLICK_TIMEOUT = 10000
+
+# Checks the page for a confirmation text and, failing that, collects the
+# visible elements whose label contains a click keyword, ranked by keyword,
+# then form controls before links, then document order. One round trip.
+SCAN_PAGE_JS = """
+({keywords, patterns, attr}) => {
+    const text = (document.body ? document.body.innerText : '').toLowerCase();
+    if (patterns.some(p => new RegExp(p).test(text))) {
+        return {success: true, candidates: []};
+    }
+    const candidates = [];
+    const elements = document.querySelectorAll('button, a, input[type=submit], input[type=button], [role=button]');
+    elements.forEach((el, order) => {
+        const label = (el.innerText || el.value || el.getAttribute('aria-label') || '').trim().toLowerCase();
+        const keyword = label ? keywords.findIndex(k => label.includes(k)) : -1;
+        if (keyword < 0) return;
+        const rect = el.getBoundingClientRect();
+        const style = getComputedStyle(el);
+        if (!rect.width || !rect.height || style.visibility === 'hidden' || style.display === 'none') return;
+        el.setAttribute(attr, String(order));
+        candidates.push({id: String(order), keyword, link: el.tagName === 'A', inForm: !!el.closest('form'), label: label.slice(0, 80)});
+    });
+    candidates.sort((a, b) => a.keyword - b.keyword || a.link - b.link || b.inForm - a.inForm);
+    return {success: false, candidates};
+}
+"""
+
+# Resolves truthy once the page shows a confirmation text
+PAGE_SUCCESS_JS = """
+patterns => {
+    const text = (document.body ? document.body.innerText : '').toLowerCase();
+    return patterns.some(p => new RegExp(p).test(text));
+}
+"""
+
+def scan_page_args() -> Dict[str, Any]:
+    """Argument of SCAN_PAGE_JS."""
+    return {'keywords': CLICK_KEYWORDS, 'patterns': SUCCESS_PATTERNS, 'attr': CANDIDATE_ATTR}
+
+def candidate_selector(candidate: Dict[str, Any]) -> str:
+    """Selector of a click candidate returned by SCAN_PAGE_JS."""
+    return f'[{CANDIDATE_ATTR}="{candidate["id"]}"]'
+
 class UnsubscribeStrategy(ABC):
     @abstractmethod
-    def unsubscribe(self, link: str) -> Tuple[bool, str]:
+    def unsubscribe(self, link: str, attempt: Optional[Dict[str, Any]] = None) -> Tuple[bool, str]:
+        """
+        Try to unsubscribe from `link`.
+
+        Args:
+            link: Unsubscribe URL
+            attempt: Cascade entry of this try, which the strategy may annotate
+                (e.g. with the 'blocked' requests of a browser page)
+
+        Returns:
+            Tuple of (success, message)
+        """
         pass
 
+class OneClickUnsubscribeStrategy(UnsubscribeStrategy):
+    """
+    RFC 8058 one-click unsubscribe: a single POST of "List-Unsubscribe=One-Click"
+    to the List-Unsubscribe URI. Only valid for senders that advertise
+    `List-Unsubscribe-Post: List-Unsubscribe=One-Click`.
+    """
+    name = 'one_click'
+
+    def __init__(self, http: HttpPool = None):
+        self.http = http or get_http_pool()
+
+    def unsubscribe(self, link: str, timeout=None, attempt: Optional[Dict[str, Any]] = None) -> Tuple[bool, str]:
+        if not link.startswith(('http://', 'https://')):
+            return False, f"Invalid URL: {link}"
+        try:
+            response = self.http.session().post(
+                link,
+                data=ONE_CLICK_BODY,
+                headers={'User-Agent': HEADERS['User-Agent'], 'Content-Type': 'application/x-www-form-urlencoded'},
+                timeout=timeout or default_timeout(),
+                allow_redirects=False
+            )
+            if response.ok:
+                return True, "Successfully unsubscribed (One-click)"
+            return False, f"One-click request failed with status code: {response.status_code}"
+        except requests.exceptions.RequestException as e:
+            return False, f"One-click request error: {str(e)}"
+
 class PlaywrightUnsubscribeStrategy(UnsubscribeStrategy):
     """
     Robust unsubscribe usage using Playwright (headless Chromium).
     Capable of handling JS execution, redirects, and clicking confirmation buttons.
+    Each link runs in a fresh context on a browser from the shared BrowserPool;
+    images, fonts, media and trackers are blocked by `request_filter`.
     """
-    def unsubscribe(self, link: str) -> Tuple[bool, str]:
-        try:
-             with sync_playwright() as p:
-                browser = p.chromium.launch(headless=True)
-                page = browser.new_page(
-                    user_agent='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-                )
-                
-                # Navigate
-                try:
-                    response = page.goto(link, timeout=30000, wait_until='domcontentloaded')
-                except Exception as nav_err:
-                     browser.close()
-                     return False, f"Navigation failed: {str(nav_err)}"
-
-                # Check initial state
-                content = page.content().lower()
-                final_url = page.url
-                
-                # 1. Immediate Success Check
-                if self._check_success(content):
-                    browser.close()
-                    return True, "Successfully unsubscribed (Direct load)"
-
-                # 2. Look for interactive elements
-                # Common keywords for buttons/links
-                keywords = ['confirm', 'yes', 'unsubscribe', 'opt out', 'opt-out', 'submit', 'update preferences']
-                
-                # Try to find a button or link with these keywords
-                clicked = False
-                for keyword in keywords:
-                    # Look for button or input[type=submit] or a with text
-                    # We use a broad selector to catch various elements
-                    try:
-                        # Case insensitive text match for buttons/links
-                        element = page.get_by_text(re.compile(keyword, re.IGNORECASE))
-                        if element.count() > 0:
-                            # If multiple, take first visible
-                            if element.first.is_visible():
-                                element.first.click(timeout=5000)
-                                page.wait_for_load_state('networkidle', timeout=10000)
-                                clicked = True
-                                break
-                    except:
-                        continue
-                
-                if clicked:
-                    # Check success again after interaction
-                    content_after = page.content().lower()
-                    if self._check_success(content_after):
-                        browser.close()
-                        return True, "Successfully unsubscribed (After interaction)"
-                    else:
-                        browser.close()
-                        # Pass true anyway if we clicked 'unsubscribe' as some sites don't show clear success message
-                        return True, "Clicked unsubscribe button (Confirmation ambiguous)"
-                
-                # 3. Form filling fallback (Naive)
-                # If there's a form requesting email (and we don't have it here easily injected), we might fail.
-                # But typically unsubscribe links encode the email.
-                
-                browser.close()
-                return False, f"Could not verify unsubscription. URL: {final_url}"
+    name = 'playwright'
+
+    def __init__(self, pool: BrowserPool = None, request_filter: Optional[RequestFilter] = None):
+        # Browsers are borrowed from the shared pool instead of launched per link
+        self.pool = pool or get_browser_pool()
+        self.request_filter = request_filter or get_request_filter()
 
+    def unsubscribe(self, link: str, attempt: Optional[Dict[str, Any]] = None) -> Tuple[bool, str]:
+        try:
+            return self.pool.run(lambda context: self._unsubscribe_in_context(context, link, attempt))
         except Exception as e:
             return False, f"Playwright error: {str(e)}"
 
-    def _check_success(self, html_content: str) -> bool:
-        """Heuristic to detect success messages."""
-        positive_patterns = [
-            r'successfully\s+unsubscribed',
-            r'unsubscribed\s+successfully',
-            r'preference(?:s)?\s+updated',
-            r'you\s+have\s+been\s+unsubscribed',
-            r'removed\s+from\s.*list',
-            r'opted\s+out',
-            r'subscription\s+cancel'
-        ]
-        for p in positive_patterns:
-            if re.search(p, html_content):
-                return True
-        return False
+    def _unsubscribe_in_context(self, context, link: str, attempt: Optional[Dict[str, Any]] = None) -> Tuple[bool, str]:
+        page = context.new_page()
+        blocked = self.request_filter.install(page) if self.request_filter else None
+        try:
+            return self._unsubscribe_on_page(page, link)
+        finally:
+            if blocked is not None:
+                log_blocked(link, blocked)
+                if attempt is not None:
+                    attempt['blocked'] = dict(blocked)
+
+    def _unsubscribe_on_page(self, page, link: str) -> Tuple[bool, str]:
+        # Navigate
+        try:
+            page.goto(link, timeout=30000, wait_until='domcontentloaded')
+        except Exception as nav_err:
+            return False, f"Navigation failed: {str(nav_err)}"
+        final_url = page.url
+
+        # 1. Success text and click candidates, found in one evaluation
+        try:
+            scan = page.evaluate(SCAN_PAGE_JS, scan_page_args())
+        except Exception as e:
+            return False, f"Could not inspect page: {str(e)}. URL: {final_url}"
+        if scan['success']:
+            return True, "Successfully unsubscribed (Direct load)"
+
+        # 2. Click the best ranked candidate that accepts the click
+        for candidate in scan['candidates'][:MAX_CLICK_CANDIDATES]:
+            try:
+                page.locator(candidate_selector(candidate)).click(timeout=5000)
+            except Exception:
+                continue
+            if self._await_confirmation(page):
+                return True, "Successfully unsubscribed (After interaction)"
+            # Some sites don't show a clear success message
+            return True, "Clicked unsubscribe button (Confirmation ambiguous)"
+
+        return False, f"Could not verify unsubscription. URL: {final_url}"
+
+    @staticmethod
+    def _await_confirmation(page) -> bool:
+        """
+        Wait until the page shows a confirmation text, following a navigation
+        started by the click; returns False if none appears within POST_CLICK_TIMEOUT.
+        """
+        try:
+            page.wait_for_function(PAGE_SUCCESS_JS, arg=SUCCESS_PATTERNS, timeout=POST_CLICK_TIMEOUT)
+            return True
+        except Exception:
+            pass
+        # The wait can be cut short by a navigation; check the page it landed on
+        try:
+            page.wait_for_load_state('domcontentloaded', timeout=5000)
+            return bool(page.evaluate(PAGE_SUCCESS_JS, SUCCESS_PATTERNS))
+        except Exception:
+            return False
 
 class RequestsUnsubscribeStrategy(UnsubscribeStrategy):
     """
     Standard requests-based unsubscribe strategy.
     Fast, lightweight, but might struggle with JS-heavy sites.
     """
-    def unsubscribe(self, link: str, timeout: int = 20) -> Tuple[bool, str]:
+    name = 'requests'
+
+    def __init__(self, http: HttpPool = None):
+        # Connections are pooled across links; each link gets its own cookies
+        self.http = http or get_http_pool()
+
+    def unsubscribe(self, link: str, timeout=None, attempt: Optional[Dict[str, Any]] = None) -> Tuple[bool, str]:
+        timeout = timeout or default_timeout()
+        session = self.http.session()
         try:
             # Skip if the link is not http(s)
             if not link.startswith(('http://', 'https://')):
@@ -142,10 +251,10 @@ class RequestsUnsubscribeStrategy(UnsubscribeStrategy):
                 
             # Handle SendGrid unsubscribe links specifically
             if 'sendgrid.net' in link or 'sendgrid.com' in link:
-                return self.handle_sendgrid_unsubscribe(link, timeout)
+                return self.handle_sendgrid_unsubscribe(link, timeout, session)
                 
             # Make the initial GET request
-            response = requests.get(
+            response = session.get(
                 link,
                 headers=HEADERS,
                 timeout=timeout,
@@ -164,7 +273,7 @@ class RequestsUnsubscribeStrategy(UnsubscribeStrategy):
                     return True, f"Successfully unsubscribed{redirect_info}"
                 else:
                     # If not confirmed, try to find and submit a form
-                    form_submitted = submit_unsubscribe_form(response.text, final_url, timeout)
+                    form_submitted = submit_unsubscribe_form(response.text, final_url, timeout, session)
                     if form_submitted:
                         return True, f"Form submitted successfully{redirect_info}"
                     return False, f"Unsubscription confirmation not detected{redirect_info}\nYou may need to unsubscribe manually: {final_url}"
@@ -176,8 +285,9 @@ class RequestsUnsubscribeStrategy(UnsubscribeStrategy):
         except Exception as e:
             return False, f"Unexpected error: {str(e)}"
 
-    def handle_sendgrid_unsubscribe(self, link: str, timeout: int) -> Tuple[bool, str]:
+    def handle_sendgrid_unsubscribe(self, link: str, timeout, session: requests.Session = None) -> Tuple[bool, str]:
         # Moved logic here
+        session = session or self.http.session()
         try:
             parsed = urlparse(link)
             params = parse_qs(parsed.query)
@@ -187,7 +297,7 @@ class RequestsUnsubscribeStrategy(UnsubscribeStrategy):
                     form_data[key] = value[0]
             form_data.update({'unsub_confirm': '1', 'submit': 'Unsubscribe'})
             
-            response = requests.post(
+            response = session.post(
                 f"{parsed.scheme}://{parsed.netloc}{parsed.path}",
                 data=form_data,
                 headers={**HEADERS, 'Content-Type': 'application/x-www-form-urlencoded', 'Origin': f"{parsed.scheme}://{parsed.netloc}", 'Referer': link},
@@ -213,7 +323,9 @@ def is_unsubscribe_confirmed(html_content: str) -> bool:
         
     return False # Simplified for brevity, logic remains similar to before
 
-def submit_unsubscribe_form(html_content: str, base_url: str, timeout: int) -> bool:
+def find_unsubscribe_forms(html_content: str, base_url: str) -> List[Tuple[str, str, Dict[str, str]]]:
+    """Return (method, url, data) for each form on the page that looks like an unsubscribe form."""
+    submissions = []
     try:
         soup = BeautifulSoup(html_content, 'html.parser')
         forms = soup.find_all('form')
@@ -236,41 +348,88 @@ def submit_unsubscribe_form(html_content: str, base_url: str, timeout: int) -> b
                 pass 
                 
             submit_url = urljoin(base_url, form_action) if form_action else base_url
-            method = form.get('method', 'get').lower()
-            
+            submissions.append((form.get('method', 'get').lower(), submit_url, form_data))
+    except:
+        pass
+    return submissions
+
+def submit_unsubscribe_form(html_content: str, base_url: str, timeout, session: requests.Session = None) -> bool:
+    # Reuse the caller's session so cookies set by the page reach the form handler
+    session = session or get_http_pool().session()
+    for method, submit_url, form_data in find_unsubscribe_forms(html_content, base_url):
+        try:
             if method == 'post':
-                r = requests.post(submit_url, data=form_data, headers={**HEADERS, 'Referer': base_url}, timeout=timeout)
+                r = session.post(submit_url, data=form_data, headers={**HEADERS, 'Referer': base_url}, timeout=timeout)
             else:
-                r = requests.get(submit_url, params=form_data, headers=HEADERS, timeout=timeout)
+                r = session.get(submit_url, params=form_data, headers=HEADERS, timeout=timeout)
                 
             if r.ok: return True
-    except:
-        pass
+        except:
+            pass
     return False
 
-def process_unsubscribe_links(unsub_links: List[str], selected_senders: List[str], dry_run: bool = True) -> Dict[str, Any]:
+def run_cascade(link: str, strategies: List[UnsubscribeStrategy], one_click: bool = False, routes: Optional[DomainRoutes] = None) -> Dict[str, Any]:
+    """
+    Try the strategies in order until one reports success.
+    The one-click tier is skipped unless the sender advertised one-click support.
+    With `routes`, the strategies are reordered by what worked before for the
+    link's domain and every attempt is recorded.
+
+    Returns:
+        Result dict with the status, message, link, the 'tier' that succeeded
+        (None on failure), total 'elapsed' seconds and the timing of each 'attempts'
+        tier (browser tiers add per-reason 'blocked' request counts)
+    """
+    started = time.monotonic()
+    attempts = []
+    success, msg, tier = False, "No strategy attempted", None
+    if routes is not None:
+        strategies = routes.order(link, strategies)
+    for strategy in strategies:
+        if strategy.name == 'one_click' and not one_click:
+            continue
+        tier_started = time.monotonic()
+        attempt = {'tier': strategy.name}
+        success, msg = strategy.unsubscribe(link, attempt=attempt)
+        attempt.update(success=success, elapsed=round(time.monotonic() - tier_started, 3))
+        attempts.append(attempt)
+        if success:
+            tier = strategy.name
+            break
+    if routes is not None:
+        routes.record_attempts(link, attempts)
+    return {
+        'status': 'success' if success else 'failed',
+        'message': msg,
+        'link': link,
+        'tier': tier,
+        'elapsed': round(time.monotonic() - started, 3),
+        'attempts': attempts,
+    }
+
+def process_unsubscribe_links(unsub_links: List[str], selected_senders: List[str], dry_run: bool = True, one_click: Optional[List[bool]] = None) -> Dict[str, Any]:
     """
     Orchestrator function.
-    NOW: Uses Strategy Pattern.
+    Runs a tiered cascade per link: RFC 8058 one-click POST (when `one_click`
+    flags the link), then plain HTTP with form submit, and a pooled headless
+    browser only when the cheaper tiers cannot confirm success. Domains with a
+    known working tier go straight to it (see domain_routes).
     """
     results = {}
+    one_click = one_click or [False] * len(unsub_links)
     
-    # Instantiate strategy
-    # Prefer Playwright for robustness
-    strategy = PlaywrightUnsubscribeStrategy()
+    # Cheapest first; HTTP tiers share pooled connections, the browser tier borrows from the browser pool
+    http = get_http_pool()
+    strategies = [OneClickUnsubscribeStrategy(http), RequestsUnsubscribeStrategy(http), PlaywrightUnsubscribeStrategy()]
+    routes = get_domain_routes()
     
-    for link, sender in zip(unsub_links, selected_senders):
+    for link, sender, link_one_click in zip(unsub_links, selected_senders, one_click):
         if dry_run:
             results[sender] = {'status': 'dry_run', 'message': f'Would unsub from {link}'}
             continue
 
         try:
-            success, msg = strategy.unsubscribe(link)
-            results[sender] = {
-                'status': 'success' if success else 'failed',
-                'message': msg,
-                'link': link
-            }
+            results[sender] = run_cascade(link, strategies, one_click=link_one_click, routes=routes)
         except Exception as e:
             results[sender] = {'status': 'error', 'message': str(e)}
             
@@ -1,22 +1,23 @@
 import re
-import base64
 import logging
 from typing import List, Dict, Any, Union
-from bs4 import BeautifulSoup
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 from config import config as app_config
+from gmail_executor import gmail_executor
+from link_extractor import find_body_unsubscribe_links
 
-def extract_unsubscribe_links(service_or_email_data, max_results=20):
+def extract_unsubscribe_links(service_or_email_data, max_results=20, user=None):
     """
     Extract unsubscribe links from Gmail messages with improved HTML parsing.
 
     Args:
         service_or_email_data: Either an authorized Gmail API service instance or a single email message data dict
         max_results: How many messages to scan (only used if service is provided)
+        user: Mailbox owner whose quota is charged (only used if service is provided)
 
     Returns:
         List of unsubscribe links.
@@ -27,19 +28,19 @@ def extract_unsubscribe_links(service_or_email_data, max_results=20):
         # If a service object is provided, fetch messages
         if hasattr(service_or_email_data, 'users'):
             logger.info(f"Fetching up to {max_results} messages...")
-            results = service_or_email_data.users().messages().list(
+            results = gmail_executor.execute(service_or_email_data.users().messages().list(
                 userId=app_config['USER_ID'], 
                 labelIds=['INBOX'], 
                 maxResults=max_results
-            ).execute()
+            ), 'messages.list', user=user)
             
             for msg in results.get('messages', [])[:max_results]:  # Limit to max_results
                 try:
-                    msg_data = service_or_email_data.users().messages().get(
+                    msg_data = gmail_executor.execute(service_or_email_data.users().messages().get(
                         userId=app_config['USER_ID'], 
                         id=msg['id'], 
                         format='full'
-                    ).execute()
+                    ), 'messages.get', user=user)
                     _process_email(msg_data, unsubscribe_links)
                 except Exception as e:
                     logger.error(f"Error processing message {msg.get('id')}: {str(e)}")
@@ -61,54 +62,6 @@ def extract_unsubscribe_links(service_or_email_data, max_results=20):
     seen = set()
     return [x for x in unsubscribe_links if x and not (x in seen or seen.add(x))]
 
-def _extract_links_from_html(html_content: str) -> List[str]:
-    """Extract unsubscribe links from HTML content using BeautifulSoup."""
-    if not html_content:
-        return []
-    
-    links = set()
-    
-    try:
-        # Clean up common HTML issues
-        html_content = html_content.replace('=\r\n', '').replace('=\n', '')
-        
-        # Try to parse with BeautifulSoup
-        soup = BeautifulSoup(html_content, 'html.parser')
-        
-        # Common patterns in unsubscribe links
-        patterns = [
-            r'unsubscribe',
-            r'email_preferences',
-            r'preferences',
-            r'optout',
-            r'opt-out',
-            r'manage_preferences',
-            r'emailpreferences',
-            r'email-preferences',
-            r'email_optout',
-            r'email-optout'
-        ]
-        
-        # Find all links that match our patterns
-        for pattern in patterns:
-            for a in soup.find_all('a', href=re.compile(pattern, re.IGNORECASE)):
-                href = a.get('href', '').strip()
-                if href:
-                    links.add(href)
-        
-        # Also look for mailto: links with unsubscribe in the email
-        for a in soup.find_all('a', href=re.compile(r'mailto:.*unsubscribe', re.IGNORECASE)):
-            href = a.get('href', '').strip()
-            if href:
-                links.add(href)
-                
-    except Exception as e:
-        logger.warning(f"Error parsing HTML: {str(e)}")
-        # Fallback to simple regex if BeautifulSoup fails
-        links.update(re.findall(r'https?://[^\s">]+unsubscribe[^\s">]*', html_content, re.IGNORECASE))
-    
-    return list(links)
-
 def _process_email(email_data: Dict[str, Any], links_list: List[str]) -> None:
     """Process a single email's data and extract unsubscribe links."""
     try:
@@ -131,36 +84,11 @@ def _process_email(email_data: Dict[str, Any], links_list: List[str]) -> None:
                 links_list.extend(found_links)
                 return  # Found links in header, no need to check body
         
-        # Check email body for unsubscribe links
-        parts = payload.get('parts', [])
-        if not parts and payload.get('body', {}).get('data'):
-            parts = [payload]  # Handle non-multipart emails
-            
-        for part in parts:
-            mime_type = part.get('mimeType', '').lower()
-            body_data = part.get('body', {}).get('data')
-            
-            if not body_data:
-                continue
-                
-            try:
-                # Decode the body data
-                if mime_type == 'text/html' or 'html' in mime_type:
-                    html = base64.urlsafe_b64decode(body_data).decode('utf-8', errors='ignore')
-                    found_links = _extract_links_from_html(html)
-                    if found_links:
-                        logger.debug(f"Found {len(found_links)} unsubscribe links in HTML body")
-                        links_list.extend(found_links)
-                        
-                elif mime_type == 'text/plain' or 'text' in mime_type:
-                    text = base64.urlsafe_b64decode(body_data).decode('utf-8', errors='ignore')
-                    found_links = re.findall(r'https?://[^\s"]+unsubscribe[^\s">]*', text, re.IGNORECASE)
-                    if found_links:
-                        logger.debug(f"Found {len(found_links)} unsubscribe links in plain text")
-                        links_list.extend(found_links)
-                        
-            except Exception as e:
-                logger.warning(f"Error processing email part: {str(e)}")
+        # Check email body for unsubscribe links; parts are decoded one at a time, HTML first
+        found_links = find_body_unsubscribe_links(payload)
+        if found_links:
+            logger.debug(f"Found {len(found_links)} unsubscribe links in body")
+            links_list.extend(found_links)
                 
     except Exception as e:
         logger.error(f"Error in _process_email: {str(e)}")
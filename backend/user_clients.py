@@ -0,0 +1,97 @@
+"""
+Per-user cache of authenticated Gmail clients for the API.
+
+Building a client costs a database round trip for the stored tokens and, once
+the access token has expired, an OAuth refresh. Cached clients keep their
+refreshed credentials, and refreshed tokens are written back to the user record
+so a new process or an evicted entry starts from a valid token.
+"""
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+from google.oauth2.credentials import Credentials
+
+from config import config as app_config
+from gmail_async import AsyncGmailClient
+from db import get_user, save_user
+
+def _token_saver(email: str, user_data: Dict[str, Any]):
+    """Return an on_refresh callback that stores refreshed tokens for the user."""
+    # save_user overwrites the profile fields, so carry the stored ones along
+    user_info = {
+        'email': email,
+        'name': user_data.get('name'),
+        'picture': user_data.get('picture'),
+    }
+
+    def save(credentials: Credentials) -> None:
+        if save_user(user_info, json.loads(credentials.to_json())):
+            logging.info(f"Stored refreshed tokens for {email}")
+
+    return save
+
+class UserClientCache:
+    """Thread-safe LRU/TTL cache of AsyncGmailClient instances keyed by user email."""
+
+    def __init__(self, max_entries: int = 256, ttl: float = 900):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, AsyncGmailClient]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, email: str) -> Optional[AsyncGmailClient]:
+        """
+        Return the Gmail client of `email`, building it from the stored tokens on a miss.
+
+        Returns:
+            The client, or None when the user has no stored tokens
+
+        Raises:
+            Exception: If the stored tokens cannot be turned into credentials
+        """
+        with self._lock:
+            entry = self._entries.get(email)
+            if entry is not None and time.monotonic() - entry[0] <= self.ttl:
+                self._entries.move_to_end(email)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        user_data = get_user(email)
+        if not user_data or 'tokens' not in user_data:
+            return None
+
+        creds = Credentials.from_authorized_user_info(user_data['tokens'])
+        client = AsyncGmailClient(creds, user=email, on_refresh=_token_saver(email, user_data))
+
+        with self._lock:
+            self._entries[email] = (time.monotonic(), client)
+            self._entries.move_to_end(email)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return client
+
+    def invalidate(self, email: str) -> None:
+        """Forget the client of `email` (after login with new tokens or logout)."""
+        with self._lock:
+            self._entries.pop(email, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries), 'max_entries': self.max_entries}
+
+user_clients = UserClientCache(
+    max_entries=app_config['CLIENT_CACHE_SIZE'],
+    ttl=app_config['CLIENT_CACHE_TTL']
+)
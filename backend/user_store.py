@@ -0,0 +1,453 @@
+"""
+Storage backends for user records: profile, OAuth tokens, activity counters and
+onboarding state.
+
+MongoUserStore is the production backend. SQLiteUserStore (WAL mode) serves
+single-node deployments and local benchmarks without a network round trip, and
+MemoryUserStore keeps everything in the process for tests and load runs.
+Records are returned in the same document shape by every backend.
+"""
+import os
+import copy
+import json
+import time
+import sqlite3
+import logging
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime, UTC
+from typing import Dict, Any, Optional, List, Tuple
+
+try:
+    from pymongo import MongoClient, UpdateOne
+    from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError, BulkWriteError
+    from pymongo.monitoring import ConnectionPoolListener
+except ImportError:
+    MongoClient = None
+    ConnectionPoolListener = object
+    BulkWriteError = Exception
+except Exception as e: # Catch any other unexpected import errors
+    print(f"ERROR: Failed to import pymongo: {e}")
+    MongoClient = None
+    ConnectionPoolListener = object
+    BulkWriteError = Exception
+
+# email -> (unsubs, deleted) increments
+ActivityBatch = Dict[str, Tuple[int, int]]
+
+class UserStore(ABC):
+    """Interface shared by the user storage backends."""
+
+    name = 'base'
+
+    @property
+    def available(self) -> bool:
+        """False when the backend is not configured; every call is then a no-op."""
+        return True
+
+    @abstractmethod
+    def get_user(self, email: str) -> Optional[Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    def save_user(self, user_info: Dict[str, Any], credentials: Dict[str, Any]) -> bool:
+        """Create or update a user's profile and tokens; counters and onboarding start at zero."""
+        pass
+
+    @abstractmethod
+    def update_onboarding(self, email: str, status: bool) -> bool:
+        pass
+
+    @abstractmethod
+    def apply_activity(self, batch: ActivityBatch) -> List[str]:
+        """
+        Add counter increments, creating missing users.
+
+        Returns:
+            Emails whose increments could not be written
+        """
+        pass
+
+    def after_fork(self) -> None:
+        """Drop connections inherited from the parent process."""
+
+    def close(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {'backend': self.name}
+
+def _new_user(email: str, now: datetime) -> Dict[str, Any]:
+    return {
+        '_id': email,
+        'email': email,
+        'createdAt': now,
+        'updatedAt': now,
+        'unsubs_count': 0,
+        'deleted_count': 0,
+        'hasOnboarded': False,
+    }
+
+class _PoolMetrics(ConnectionPoolListener):
+    """Counts connection pool events reported by the driver."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {'created': 0, 'closed': 0, 'checked_out': 0, 'checked_in': 0, 'checkout_failed': 0, 'pool_cleared': 0}
+
+    def _inc(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_check_out_started(self, event): pass
+    def pool_cleared(self, event): self._inc('pool_cleared')
+    def connection_created(self, event): self._inc('created')
+    def connection_closed(self, event): self._inc('closed')
+    def connection_checked_out(self, event): self._inc('checked_out')
+    def connection_checked_in(self, event): self._inc('checked_in')
+    def connection_check_out_failed(self, event): self._inc('checkout_failed')
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.counters)
+        stats['open'] = stats['created'] - stats['closed']
+        stats['in_use'] = stats['checked_out'] - stats['checked_in']
+        return stats
+
+class MongoUserStore(UserStore):
+    """
+    Users collection on MongoDB through one pooled client per process.
+    The server is pinged on connect and then at most every `health_check_interval` seconds.
+    """
+
+    name = 'mongo'
+
+    def __init__(self, uri: Optional[str], db_name: str = 'unclut', collection: str = 'users', max_pool_size: int = 50, min_pool_size: int = 0, max_idle_time_ms: int = 300000, health_check_interval: float = 30):
+        self.uri = uri
+        self.db_name = db_name
+        self.collection_name = collection
+        self.max_pool_size = max_pool_size
+        self.min_pool_size = min_pool_size
+        self.max_idle_time_ms = max_idle_time_ms
+        self.health_check_interval = health_check_interval
+        self._lock = threading.Lock()
+        self._forget_client()
+
+    @property
+    def available(self) -> bool:
+        return bool(self.uri and MongoClient)
+
+    def _forget_client(self) -> None:
+        self._client = None
+        self._client_pid = None
+        self._metrics = None
+        self._last_health_check = 0.0
+
+    def after_fork(self) -> None:
+        # pymongo clients are not fork-safe; the parent's lock may also be held
+        self._lock = threading.Lock()
+        self._forget_client()
+
+    def _collection(self):
+        if not self.available:
+            return None
+        with self._lock:
+            if self._client is not None and self._client_pid != os.getpid():
+                # Forked without the at-fork hook (e.g. os.register_at_fork unavailable)
+                self._forget_client()
+            try:
+                if self._client is None:
+                    self._metrics = _PoolMetrics()
+                    self._client = MongoClient(
+                        self.uri,
+                        serverSelectionTimeoutMS=3000,
+                        maxPoolSize=self.max_pool_size,
+                        minPoolSize=self.min_pool_size,
+                        maxIdleTimeMS=self.max_idle_time_ms,
+                        event_listeners=[self._metrics]
+                    )
+                    self._client_pid = os.getpid()
+                now = time.monotonic()
+                if now - self._last_health_check >= self.health_check_interval:
+                    self._client.admin.command('ping')
+                    if not self._last_health_check:
+                        logging.info(f"Successfully connected to MongoDB database: {self.db_name}")
+                    self._last_health_check = now
+                return self._client[self.db_name][self.collection_name]
+            except (ConnectionFailure, ServerSelectionTimeoutError) as e:
+                logging.error(f"MongoDB connection failed: {e}. Please check your MONGODB_URI and Network Access in Atlas.")
+                self._last_health_check = 0.0
+                return None
+            except Exception as e:
+                logging.error(f"An unexpected error occurred during MongoDB connection setup: {e}")
+                self._last_health_check = 0.0
+                return None
+
+    def get_user(self, email: str) -> Optional[Dict[str, Any]]:
+        coll = self._collection()
+        if coll is None:
+            return None
+        return coll.find_one({"_id": email})
+
+    def save_user(self, user_info: Dict[str, Any], credentials: Dict[str, Any]) -> bool:
+        coll = self._collection()
+        if coll is None:
+            return False
+
+        email = user_info['email']
+        now = datetime.now(UTC)
+        update_data = {
+            "$set": {
+                "email": email,
+                "name": user_info.get('name'),
+                "picture": user_info.get('picture'),
+                "updatedAt": now,
+                # Store credentials securely
+                "tokens": credentials # In a real app, encrypt this!
+            },
+            "$setOnInsert": {
+                "createdAt": now,
+                "unsubs_count": 0,
+                "deleted_count": 0,
+                "hasOnboarded": False  # Default to False for new users
+            }
+        }
+        try:
+            coll.update_one({"_id": email}, update_data, upsert=True)
+            return True
+        except Exception as e:
+            logging.error(f"Failed to save user {email}: {e}")
+            return False
+
+    def update_onboarding(self, email: str, status: bool) -> bool:
+        coll = self._collection()
+        if coll is None:
+            return False
+        try:
+            coll.update_one(
+                {"_id": email},
+                {"$set": {"hasOnboarded": status, "updatedAt": datetime.now(UTC)}}
+            )
+            return True
+        except Exception as e:
+            logging.error(f"Failed to update onboarding status for {email}: {e}")
+            return False
+
+    def apply_activity(self, batch: ActivityBatch) -> List[str]:
+        coll = self._collection()
+        emails = list(batch)
+        if coll is None:
+            return emails
+
+        now = datetime.now(UTC)
+        operations = [
+            UpdateOne({"_id": email}, {
+                "$setOnInsert": {"email": email, "createdAt": now},
+                "$inc": {"unsubs_count": batch[email][0], "deleted_count": batch[email][1]},
+                "$set": {"updatedAt": now}
+            }, upsert=True)
+            for email in emails
+        ]
+        try:
+            result = coll.bulk_write(operations, ordered=False)
+            if result.upserted_count:
+                logging.info(f"{result.upserted_count} new user(s) added to database.")
+            return []
+        except BulkWriteError as e:
+            failed = [emails[error['index']] for error in e.details.get('writeErrors', [])]
+            logging.error(f"Failed to record activity for {len(failed)} user(s) in MongoDB: {e}")
+            return failed
+        except Exception as e:
+            logging.error(f"Failed to record activity for {len(emails)} user(s) in MongoDB: {e}")
+            return emails
+
+    def close(self) -> None:
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+    def stats(self) -> Dict[str, Any]:
+        if self._metrics is None:
+            return {'backend': self.name, 'connected': False}
+        return {'backend': self.name, 'connected': self._client is not None, 'max_pool_size': self.max_pool_size, **self._metrics.snapshot()}
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    email TEXT PRIMARY KEY,
+    name TEXT,
+    picture TEXT,
+    tokens TEXT,
+    has_onboarded INTEGER NOT NULL DEFAULT 0,
+    unsubs_count INTEGER NOT NULL DEFAULT 0,
+    deleted_count INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+"""
+
+class SQLiteUserStore(UserStore):
+    """Users table in a local SQLite file in WAL mode, so reads do not block the writer."""
+
+    name = 'sqlite'
+
+    def __init__(self, path: str):
+        if path != ':memory:':
+            path = os.path.expanduser(path)
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+
+    def _connection(self) -> sqlite3.Connection:
+        """Open the database on first use and again in a forked child. Caller holds the lock."""
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn_pid = os.getpid()
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            with self._conn:
+                self._conn.executescript(SQLITE_SCHEMA)
+        return self._conn
+
+    def after_fork(self) -> None:
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def get_user(self, email: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT email, name, picture, tokens, has_onboarded, unsubs_count, deleted_count, "
+                "created_at, updated_at FROM users WHERE email = ?", (email,)
+            ).fetchone()
+        if row is None:
+            return None
+        email, name, picture, tokens, has_onboarded, unsubs, deleted, created_at, updated_at = row
+        user = {
+            '_id': email,
+            'email': email,
+            'createdAt': datetime.fromisoformat(created_at),
+            'updatedAt': datetime.fromisoformat(updated_at),
+            'unsubs_count': unsubs,
+            'deleted_count': deleted,
+            'hasOnboarded': bool(has_onboarded),
+        }
+        # Users created by activity alone have no profile yet, like their Mongo documents
+        if tokens is not None:
+            user.update({'name': name, 'picture': picture, 'tokens': json.loads(tokens)})
+        return user
+
+    def save_user(self, user_info: Dict[str, Any], credentials: Dict[str, Any]) -> bool:
+        email = user_info['email']
+        now = datetime.now(UTC).isoformat()
+        try:
+            with self._lock:
+                conn = self._connection()
+                with conn:
+                    conn.execute(
+                        "INSERT INTO users (email, name, picture, tokens, created_at, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(email) DO UPDATE SET "
+                        "name = excluded.name, picture = excluded.picture, tokens = excluded.tokens, "
+                        "updated_at = excluded.updated_at",
+                        (email, user_info.get('name'), user_info.get('picture'), json.dumps(credentials), now, now)
+                    )
+            return True
+        except sqlite3.Error as e:
+            logging.error(f"Failed to save user {email}: {e}")
+            return False
+
+    def update_onboarding(self, email: str, status: bool) -> bool:
+        try:
+            with self._lock:
+                conn = self._connection()
+                with conn:
+                    conn.execute(
+                        "UPDATE users SET has_onboarded = ?, updated_at = ? WHERE email = ?",
+                        (int(status), datetime.now(UTC).isoformat(), email)
+                    )
+            return True
+        except sqlite3.Error as e:
+            logging.error(f"Failed to update onboarding status for {email}: {e}")
+            return False
+
+    def apply_activity(self, batch: ActivityBatch) -> List[str]:
+        now = datetime.now(UTC).isoformat()
+        try:
+            with self._lock:
+                conn = self._connection()
+                with conn:
+                    conn.executemany(
+                        "INSERT INTO users (email, unsubs_count, deleted_count, created_at, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?) ON CONFLICT(email) DO UPDATE SET "
+                        "unsubs_count = unsubs_count + excluded.unsubs_count, "
+                        "deleted_count = deleted_count + excluded.deleted_count, "
+                        "updated_at = excluded.updated_at",
+                        [(email, unsubs, deleted, now, now) for email, (unsubs, deleted) in batch.items()]
+                    )
+            return []
+        except sqlite3.Error as e:
+            logging.error(f"Failed to record activity for {len(batch)} user(s) in SQLite: {e}")
+            return list(batch)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+class MemoryUserStore(UserStore):
+    """Process-local store; contents are lost on exit."""
+
+    name = 'memory'
+
+    def __init__(self):
+        self._users: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def after_fork(self) -> None:
+        self._lock = threading.Lock()
+
+    def get_user(self, email: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            user = self._users.get(email)
+            return copy.deepcopy(user) if user is not None else None
+
+    def save_user(self, user_info: Dict[str, Any], credentials: Dict[str, Any]) -> bool:
+        email = user_info['email']
+        now = datetime.now(UTC)
+        with self._lock:
+            user = self._users.setdefault(email, _new_user(email, now))
+            user.update({
+                'name': user_info.get('name'),
+                'picture': user_info.get('picture'),
+                'tokens': copy.deepcopy(credentials),
+                'updatedAt': now,
+            })
+        return True
+
+    def update_onboarding(self, email: str, status: bool) -> bool:
+        with self._lock:
+            user = self._users.get(email)
+            if user is not None:
+                user['hasOnboarded'] = status
+                user['updatedAt'] = datetime.now(UTC)
+        return True
+
+    def apply_activity(self, batch: ActivityBatch) -> List[str]:
+        now = datetime.now(UTC)
+        with self._lock:
+            for email, (unsubs, deleted) in batch.items():
+                user = self._users.setdefault(email, _new_user(email, now))
+                user['unsubs_count'] += unsubs
+                user['deleted_count'] += deleted
+                user['updatedAt'] = now
+        return []
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'backend': self.name, 'users': len(self._users)}